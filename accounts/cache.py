@@ -0,0 +1,67 @@
+"""
+Short-lived cache of the users JWT requests authenticate as.
+
+An entry remembers the user's version token it was built under and is only
+served while that still matches. Any save or delete of the user - profile
+edits, password changes, the seller flag flipped in the admin, last_login -
+bumps the version (signals.py), now and again after commit, and the
+version is read before the user row on a miss, so an entry built from a
+row that was about to change is already stale when it lands. A bulk
+queryset.update() of users doesnt send the signals, call invalidate_user.
+
+A hit is one cache read and no queries. The password hash is left out
+(deferred), the few places that check it load it on access.
+"""
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+USER_KEY = 'auth-user:{}'
+USER_VERSION_KEY = 'auth-user-version:{}'
+
+
+def _timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60 * 5)
+
+
+def _keys(user_id):
+    return USER_KEY.format(user_id), USER_VERSION_KEY.format(user_id)
+
+
+def _users():
+    return get_user_model().objects.defer('password')
+
+
+def _lookup(user_id):
+    return {jwt_settings.USER_ID_FIELD: user_id}
+
+
+def get_user(user_id):
+    """The user with USER_ID_FIELD user_id, None if there isnt one."""
+    key, version_key = _keys(user_id)
+    found = cache.get_many([key, version_key])
+    entry, version = found.get(key), found.get(version_key)
+    if entry is not None and version is not None and entry['version'] == version:
+        return entry['user']
+
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, _timeout() * 2)
+        version = cache.get(version_key)
+    user = _users().filter(**_lookup(user_id)).first()
+    if user is not None:
+        cache.set(key, {'version': version, 'user': user}, _timeout())
+    return user
+
+
+def invalidate_user(user):
+    """Drop the cached user, now and after commit."""
+    version_key = USER_VERSION_KEY.format(getattr(user, jwt_settings.USER_ID_FIELD))
+
+    def bump():
+        cache.set(version_key, uuid.uuid4().hex, _timeout() * 2)
+    bump()
+    transaction.on_commit(bump)
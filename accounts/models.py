@@ -1,6 +1,10 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+# what other users see of a user - the seller and review author names in
+# the product list and details
+PUBLIC_FIELDS = ('first_name', 'last_name', 'username', 'email')
+
 
 class CustomUser(AbstractUser):
     """
@@ -27,6 +31,17 @@ class CustomUser(AbstractUser):
             models.Index(fields=['is_seller']),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # so a save can tell whether the catalog's cached names went stale
+        if all(f in field_names for f in PUBLIC_FIELDS):
+            instance._public_values = instance.public_values()
+        return instance
+
+    def public_values(self):
+        return tuple(getattr(self, f) for f in PUBLIC_FIELDS)
+
     def __str__(self):
         return self.email
 
@@ -1,7 +1,11 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import invalidate_user
 
 User = get_user_model()
 
@@ -68,3 +72,66 @@ class AuthTests(TestCase):
         resp = self.client.get(self.profile_url)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(resp.data['email'], self.user_data['email'])
+
+
+class CachedUserTests(TestCase):
+    """JWT requests get request.user from accounts/cache.py."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.profile_url = '/api/v1/auth/profile/'
+        self.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer', password='SecurePass123!',
+        )
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_cached_user_costs_no_queries(self):
+        self.assertEqual(self.client.get(self.profile_url).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.profile_url)
+        self.assertEqual(resp.data['email'], 'buyer@example.com')
+
+    def test_profile_and_seller_changes_show_up_straight_away(self):
+        self.client.get(self.profile_url)
+        resp = self.client.patch(self.profile_url, {'first_name': 'Ada'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(self.profile_url).data['full_name'], 'Ada')
+
+        # flipped somewhere else, eg the admin
+        self.assertEqual(
+            self.client.post('/api/v1/products/', {}, format='json').status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+        user = User.objects.get(pk=self.user.pk)
+        user.is_seller = True
+        user.save()
+        self.assertTrue(self.client.get(self.profile_url).data['is_seller'])
+        self.assertEqual(
+            self.client.post('/api/v1/products/', {}, format='json').status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    def test_password_change(self):
+        self.client.get(self.profile_url)
+        resp = self.client.post('/api/v1/auth/change-password/', {
+            'old_password': 'SecurePass123!', 'new_password': 'EvenBetter456!',
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # the hash isnt cached, the check loads the new one
+        resp = self.client.post('/api/v1/auth/change-password/', {
+            'old_password': 'SecurePass123!', 'new_password': 'Another789!',
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('EvenBetter456!'))
+
+    def test_deactivated_or_deleted_user_is_turned_away(self):
+        self.client.get(self.profile_url)
+        # bulk updates dont send signals, they invalidate by hand
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_user(self.user)
+        self.assertEqual(self.client.get(self.profile_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        User.objects.get(pk=self.user.pk).delete()
+        self.assertEqual(self.client.get(self.profile_url).status_code, status.HTTP_401_UNAUTHORIZED)
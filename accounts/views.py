@@ -1,14 +1,16 @@
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth import get_user_model
 
+from core.throttling import BatchThrottleMixin
 from .serializers import RegisterSerializer, UserSerializer, ChangePasswordSerializer
 
 User = get_user_model()
 
 
-class RegisterView(generics.CreateAPIView):
+class RegisterView(BatchThrottleMixin, generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [permissions.AllowAny]
@@ -27,7 +29,7 @@ class RegisterView(generics.CreateAPIView):
         )
 
 
-class ProfileView(generics.RetrieveUpdateAPIView):
+class ProfileView(BatchThrottleMixin, generics.RetrieveUpdateAPIView):
     """Get or update the current user's profile."""
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -36,7 +38,7 @@ class ProfileView(generics.RetrieveUpdateAPIView):
         return self.request.user
 
 
-class ChangePasswordView(APIView):
+class ChangePasswordView(BatchThrottleMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
@@ -52,3 +54,11 @@ class ChangePasswordView(APIView):
             {'message': 'Password updated successfully.'},
             status=status.HTTP_200_OK
         )
+
+
+class LoginView(BatchThrottleMixin, TokenObtainPairView):
+    pass
+
+
+class RefreshView(BatchThrottleMixin, TokenRefreshView):
+    pass
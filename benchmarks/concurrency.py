@@ -0,0 +1,247 @@
+"""
+Concurrent load against the two deployments, in process:
+
+  wsgi   core.wsgi as docker-compose runs it - `workers` sync workers, each
+         serving one request at a time. Clients queue for a free worker
+  asgi   core.asgi - one worker, every request in flight at once on its
+         event loop, the DRF views run in threads
+
+`concurrency` clients send the catalog read mix back to back until
+`requests` have been made, straight into Django's WSGIHandler / ASGIHandler
+(what gunicorn and uvicorn call, minus the network). Latency is measured
+from when a client sends, so time spent queueing for a wsgi worker counts.
+The workers are threads here rather than processes, and the cache is the
+local one - cache_latency puts a network round trip back in front of every
+cache call.
+
+Unlike the suite this needs committed data, the workers have their own
+database connections - kept open between requests under wsgi, closed after
+each one under asgi like core/asgi.py sets up, and all closed after the run.
+"""
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .runner import percentile
+
+MODES = ('wsgi', 'asgi')
+SLOW_CACHE_METHODS = ('get', 'get_many', 'set', 'set_many', 'add', 'delete', 'delete_many')
+# a remote cache's async calls are BaseCache's: the sync call in a thread
+ASYNC_CACHE_METHODS = ('aget', 'aget_many', 'aset', 'aset_many', 'aadd', 'adelete')
+
+
+def catalog_urls(ctx, products=50):
+    """The read mix: list pages, details, reviews and the category tree."""
+    urls = ['/api/v1/products/', '/api/v1/products/?ordering=price', '/api/v1/categories/']
+    for _, slug in ctx.products[:products]:
+        urls.append(f'/api/v1/products/{slug}/')
+        urls.append(f'/api/v1/products/{slug}/reviews/')
+    return urls
+
+
+def client_address(i):
+    # a different address per request, so the anon throttle never kicks in
+    # (without NUM_PROXIES set DRF takes X-Forwarded-For as the address)
+    return f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'
+
+
+def wsgi_get(handler, url, address):
+    path, _, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SCRIPT_NAME': '', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'testserver', 'HTTP_X_FORWARDED_FOR': address,
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+        'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+        'wsgi.multithread': True, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    status = []
+    body = handler(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        for _ in body:
+            pass
+    finally:
+        body.close()  # request_finished, closes the db connection like gunicorn
+    return int(status[0].split()[0])
+
+
+async def asgi_get(handler, url, address):
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'x-forwarded-for', address.encode())],
+        'client': ['127.0.0.1', 0], 'server': ['testserver', 80],
+    }
+    status = []
+    disconnected = asyncio.Event()  # never set, the client stays connected
+    sent_request = False
+
+    async def receive():
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
+
+
+@contextmanager
+def cache_latency(seconds):
+    """
+    Sleep `seconds` in front of every cache call (not the nested ones), and
+    make the async calls go through a thread like they do on a remote cache.
+    """
+    if not seconds:
+        yield
+        return
+    backend = type(caches['default'])
+    names = SLOW_CACHE_METHODS + ASYNC_CACHE_METHODS
+    originals = {name: backend.__dict__.get(name) for name in names}
+    local = threading.local()
+
+    def slow(fn):
+        def wrapper(self, *args, **kwargs):
+            if getattr(local, 'busy', False):
+                return fn(self, *args, **kwargs)
+            local.busy = True
+            try:
+                time.sleep(seconds)
+                return fn(self, *args, **kwargs)
+            finally:
+                local.busy = False
+        return wrapper
+
+    for name in SLOW_CACHE_METHODS:
+        setattr(backend, name, slow(getattr(backend, name)))
+    for name in ASYNC_CACHE_METHODS:
+        setattr(backend, name, getattr(BaseCache, name))
+    try:
+        yield
+    finally:
+        for name, fn in originals.items():
+            if fn is None:
+                delattr(backend, name)
+            else:
+                setattr(backend, name, fn)
+
+
+@contextmanager
+def worker_connections(conn_max_age=None):
+    """
+    Close the connections the worker threads open once the run is over,
+    otherwise they outlive it (and the test database). conn_max_age
+    overrides DB_CONN_MAX_AGE for the run.
+    """
+    caller = threading.get_ident()
+    opened = []
+
+    def track(sender, connection, **kwargs):
+        if threading.get_ident() != caller:
+            opened.append(connection)
+
+    settings_dict = connections.settings['default']
+    old_max_age = settings_dict['CONN_MAX_AGE']
+    if conn_max_age is not None:
+        settings_dict['CONN_MAX_AGE'] = conn_max_age
+    connection_created.connect(track)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(track)
+        settings_dict['CONN_MAX_AGE'] = old_max_age
+        for connection in opened:
+            connection.inc_thread_sharing()
+            try:
+                connection.close()
+            finally:
+                connection.dec_thread_sharing()
+
+
+def run_wsgi(urls, requests, concurrency, workers):
+    handler = WSGIHandler()
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    timings, statuses = [], []
+
+    def next_request():
+        with lock:
+            return next(counter, None)
+
+    def client(worker_pool):
+        while (i := next_request()) is not None:
+            start = time.perf_counter()
+            # first come first served, like the listen backlog
+            status = worker_pool.submit(
+                wsgi_get, handler, urls[i % len(urls)], client_address(i)
+            ).result()
+            timings.append(time.perf_counter() - start)
+            statuses.append(status)
+
+    with ThreadPoolExecutor(max_workers=workers) as worker_pool:
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            for future in [clients.submit(client, worker_pool) for _ in range(concurrency)]:
+                future.result()
+    return timings, statuses
+
+
+def run_asgi(urls, requests, concurrency):
+    async def main():
+        handler = ASGIHandler()
+        counter = iter(range(requests))
+        timings, statuses = [], []
+
+        async def worker():
+            while (i := next(counter, None)) is not None:
+                start = time.perf_counter()
+                status = await asgi_get(handler, urls[i % len(urls)], client_address(i))
+                timings.append(time.perf_counter() - start)
+                statuses.append(status)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return timings, statuses
+
+    return asyncio.run(main())
+
+
+def measure(mode, urls, requests=1000, concurrency=50, workers=3):
+    """
+    {'mode', 'requests', 'seconds', 'rps', 'p50_ms', 'p90_ms', 'p99_ms',
+    'errors'} for one run. errors counts the non-2xx/304 responses.
+    """
+    with worker_connections(conn_max_age=0 if mode == 'asgi' else None):
+        start = time.perf_counter()
+        if mode == 'wsgi':
+            timings, statuses = run_wsgi(urls, requests, concurrency, workers)
+        else:
+            timings, statuses = run_asgi(urls, requests, concurrency)
+        seconds = time.perf_counter() - start
+    return {
+        'mode': mode,
+        'requests': len(timings),
+        'seconds': round(seconds, 3),
+        'rps': round(len(timings) / seconds, 1),
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p90_ms': round(percentile(timings, 90) * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        'errors': sum(1 for s in statuses if not (200 <= s < 300 or s == 304)),
+    }
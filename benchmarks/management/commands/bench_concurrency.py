@@ -0,0 +1,104 @@
+"""
+Concurrency benchmark, sync (gunicorn + core.wsgi) vs async (core.asgi)
+deployment, on the catalog read endpoints.
+Usage: python manage.py bench_concurrency
+       python manage.py bench_concurrency --concurrency 100 --requests 5000 --cache-latency-ms 5
+       python manage.py bench_concurrency --modes asgi --cold
+
+Builds the benchmark dataset (benchmarks/suite.py) and deletes it again at
+the end - it has to be committed, the workers read it over their own
+connections. Caches are warmed first unless --cold, which starts every
+mode from a bumped catalog version instead.
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from benchmarks import concurrency
+from benchmarks.suite import build_dataset, cleanup
+from products.cache import CATEGORIES, DETAILS, PRODUCTS, bump_versions
+from products.models import Category, Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Throughput and latency of the catalog reads under concurrent load, WSGI vs ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(concurrency.MODES),
+                            help='comma separated, wsgi and/or asgi')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='clients sending at once')
+        parser.add_argument('--workers', type=int, default=3,
+                            help='sync workers for wsgi (docker-compose runs 3)')
+        parser.add_argument('--cache-latency-ms', type=float, default=2.0,
+                            help='round trip added to every cache call, 0 for none')
+        parser.add_argument('--cold', action='store_true',
+                            help='dont warm the caches before each mode')
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        modes = [m.strip() for m in options['modes'].split(',') if m.strip()]
+        unknown = [m for m in modes if m not in concurrency.MODES]
+        if unknown:
+            raise CommandError(f"Unknown mode(s): {', '.join(unknown)}")
+        if User.objects.filter(email__startswith='bench-').exists():
+            raise CommandError("Benchmark users already exist, a previous run didnt clean up?")
+
+        overrides = override_settings(
+            DEBUG=False,
+            CELERY_BROKER_URL='memory://',
+            CELERY_RESULT_BACKEND='cache+memory://',
+        )
+        try:
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            own_environment = False
+        overrides.enable()
+        ctx = None
+        try:
+            self.stdout.write(f"Building dataset ({options['products']} products)...")
+            ctx = build_dataset(products=options['products'], seed=options['seed'])
+            urls = concurrency.catalog_urls(ctx)
+            self.stdout.write(
+                f"{len(urls)} urls, {options['requests']} requests, "
+                f"{options['concurrency']} clients, cache latency {options['cache_latency_ms']}ms"
+            )
+            self.stdout.write(
+                f"{'mode':<8}{'workers':>8}{'req/s':>10}{'p50 ms':>10}"
+                f"{'p90 ms':>10}{'p99 ms':>10}{'errors':>8}"
+            )
+            with concurrency.cache_latency(options['cache_latency_ms'] / 1000):
+                for mode in modes:
+                    self._run(mode, urls, options)
+        finally:
+            if ctx is not None:
+                self._delete_dataset(ctx)
+            overrides.disable()
+            if own_environment:
+                teardown_test_environment()
+
+    def _run(self, mode, urls, options):
+        workers = options['workers'] if mode == 'wsgi' else 1
+        bump_versions(PRODUCTS, CATEGORIES, DETAILS)
+        if not options['cold']:
+            concurrency.measure(mode, urls, len(urls), options['concurrency'], workers)
+        result = concurrency.measure(
+            mode, urls, options['requests'], options['concurrency'], workers,
+        )
+        line = (
+            f"{mode:<8}{workers:>8}{result['rps']:>10.1f}{result['p50_ms']:>10.2f}"
+            f"{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['errors']:>8}"
+        )
+        self.stdout.write(self.style.ERROR(line) if result['errors'] else line)
+        return result
+
+    def _delete_dataset(self, ctx):
+        cleanup(ctx)
+        Product.objects.filter(seller=ctx.seller).delete()
+        Category.objects.filter(name__startswith='Bench ').order_by('-depth').delete()
+        User.objects.filter(email__startswith='bench-').delete()
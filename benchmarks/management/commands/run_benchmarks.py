@@ -0,0 +1,143 @@
+"""
+Benchmark the API hot paths and compare against a stored baseline.
+Usage: python manage.py run_benchmarks
+       python manage.py run_benchmarks --only product_list,place_order_10 --iterations 50
+       python manage.py run_benchmarks --save-baseline benchmarks/baseline.json
+       python manage.py run_benchmarks --baseline benchmarks/baseline.json --time-threshold 0.3
+
+Builds its own dataset (see benchmarks/suite.py) inside a transaction that
+is rolled back at the end, so it can run against any dev database, SQLite or
+Postgres. Celery goes to an in-memory broker for the run. Exits non-zero
+if anything regressed past the thresholds.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from benchmarks import runner
+from benchmarks.suite import BENCHMARKS, build_dataset, cleanup
+
+
+class Command(BaseCommand):
+    help = 'Query counts, latency percentiles and allocations for the API hot paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', default='', help='comma separated case names')
+        parser.add_argument('--list', action='store_true', help='list the cases and exit')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default='benchmark-results.json',
+                            help='where to write the results')
+        parser.add_argument('--baseline', help='results file to compare against')
+        parser.add_argument('--save-baseline', metavar='PATH',
+                            help='also write the results here as the new baseline')
+        parser.add_argument('--time-threshold', type=float,
+                            default=runner.DEFAULT_THRESHOLDS['time'],
+                            help='allowed p50 slowdown as a fraction (0.25 = 25%%)')
+        parser.add_argument('--min-ms', type=float,
+                            default=runner.DEFAULT_THRESHOLDS['min_ms'],
+                            help='ignore p50 changes smaller than this')
+        parser.add_argument('--query-threshold', type=int,
+                            default=runner.DEFAULT_THRESHOLDS['queries'],
+                            help='allowed extra queries per request')
+        parser.add_argument('--memory-threshold', type=float,
+                            default=runner.DEFAULT_THRESHOLDS['memory'],
+                            help='allowed peak allocation growth as a fraction')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for case in BENCHMARKS.values():
+                self.stdout.write(f"{case.name:<24}{case.description}")
+            return
+
+        names = [n.strip() for n in options['only'].split(',') if n.strip()] or list(BENCHMARKS)
+        unknown = [n for n in names if n not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+        cases = [BENCHMARKS[n] for n in names]
+
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = runner.load_results(options['baseline'])['benchmarks']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cant read baseline {options['baseline']}: {e}")
+
+        results = self._run(cases, options)
+
+        meta = runner.make_meta(
+            iterations=options['iterations'], products=options['products'], seed=options['seed'],
+        )
+        runner.save_results(options['output'], meta, results)
+        self.stdout.write(f"Results written to {options['output']}")
+        if options['save_baseline']:
+            runner.save_results(options['save_baseline'], meta, results)
+            self.stdout.write(f"Baseline saved to {options['save_baseline']}")
+
+        if baseline is not None:
+            self._compare(results, baseline, options)
+
+    def _run(self, cases, options):
+        overrides = override_settings(
+            DEBUG=False,
+            # .delay() shouldnt wait on a broker that isnt there
+            CELERY_BROKER_URL='memory://',
+            CELERY_RESULT_BACKEND='cache+memory://',
+        )
+        # the test client needs 'testserver' in ALLOWED_HOSTS, and this
+        # keeps any confirmation emails in memory
+        try:
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            own_environment = False  # already set up, eg. by the test runner
+        overrides.enable()
+        try:
+            with transaction.atomic():
+                self.stdout.write(f"Building dataset ({options['products']} products)...")
+                ctx = build_dataset(products=options['products'], seed=options['seed'])
+                try:
+                    self.stdout.write(
+                        f"{'benchmark':<24}{'queries':>8}{'p50 ms':>10}{'p90 ms':>10}"
+                        f"{'p99 ms':>10}{'peak KB':>10}"
+                    )
+                    return runner.run_suite(
+                        cases, ctx, iterations=options['iterations'],
+                        warmup=options['warmup'], on_result=self._print_result,
+                    )
+                finally:
+                    transaction.set_rollback(True)
+                    cleanup(ctx)
+        finally:
+            overrides.disable()
+            if own_environment:
+                teardown_test_environment()
+
+    def _print_result(self, case, result):
+        self.stdout.write(
+            f"{case.name:<24}{result['queries']:>8}{result['p50_ms']:>10.2f}"
+            f"{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['peak_kb']:>10.0f}"
+        )
+
+    def _compare(self, results, baseline, options):
+        thresholds = {
+            'time': options['time_threshold'], 'min_ms': options['min_ms'],
+            'queries': options['query_threshold'], 'memory': options['memory_threshold'],
+        }
+        rows = runner.compare(results, baseline, thresholds)
+        self.stdout.write('')
+        for name, status, reasons in rows:
+            line = f"{name:<24}{status:<11}{'; '.join(reasons)}"
+            if status == 'regressed':
+                self.stdout.write(self.style.ERROR(line))
+            elif status == 'improved':
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(line)
+
+        regressed = [name for name, status, _ in rows if status == 'regressed']
+        if regressed:
+            raise CommandError(f"{len(regressed)} benchmark(s) regressed: {', '.join(regressed)}")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
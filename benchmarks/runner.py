@@ -0,0 +1,146 @@
+"""
+Timing, query counting and allocation tracking for the benchmark cases, and
+the results file / baseline comparison.
+
+Each case is timed over `iterations` runs (after `warmup` untimed ones),
+then run once more with tracemalloc and the query log on - both slow the
+request down, so they never overlap with the timed runs.
+
+Results file:
+
+    {"meta": {...}, "benchmarks": {"product_list": {"queries": 4,
+        "p50_ms": ..., "p90_ms": ..., "p99_ms": ..., "mean_ms": ...,
+        "min_ms": ..., "max_ms": ..., "peak_kb": ..., "retained_kb": ...}}}
+"""
+import json
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+# a case regresses when it gets slower than baseline by more than `time`
+# (fraction of p50) and by at least `min_ms`, runs more than `queries`
+# extra queries, or peaks more than `memory` (fraction) higher
+DEFAULT_THRESHOLDS = {'time': 0.25, 'min_ms': 1.0, 'queries': 0, 'memory': 0.5}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def _prepare(case, ctx):
+    ctx.reset_throttles()
+    if case.prepare:
+        case.prepare(ctx)
+
+
+def measure(case, ctx, iterations=20, warmup=2):
+    for _ in range(warmup):
+        _prepare(case, ctx)
+        case.run(ctx)
+
+    timings = []
+    for _ in range(iterations):
+        _prepare(case, ctx)
+        start = time.perf_counter()
+        case.run(ctx)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    _prepare(case, ctx)
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        with CaptureQueriesContext(connection) as queries:
+            case.run(ctx)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'queries': len(queries.captured_queries),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'peak_kb': round((peak - before) / 1024, 1),
+        'retained_kb': round((after - before) / 1024, 1),
+    }
+
+
+def run_suite(cases, ctx, iterations=20, warmup=2, on_result=None):
+    results = {}
+    for case in cases:
+        results[case.name] = measure(case, ctx, iterations=iterations, warmup=warmup)
+        if on_result:
+            on_result(case, results[case.name])
+    return results
+
+
+def make_meta(**extra):
+    return {
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'machine': platform.machine(),
+        **extra,
+    }
+
+
+def save_results(path, meta, results):
+    with open(path, 'w') as fh:
+        json.dump({'meta': meta, 'benchmarks': results}, fh, indent=2, sort_keys=True)
+        fh.write('\n')
+
+
+def load_results(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def compare(results, baseline, thresholds=None):
+    """
+    [(name, status, reasons)] for every case in either run. status is one
+    of ok, regressed, improved, new, missing.
+    """
+    limits = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    rows = []
+    for name in list(results) + [n for n in baseline if n not in results]:
+        current, old = results.get(name), baseline.get(name)
+        if old is None:
+            rows.append((name, 'new', []))
+            continue
+        if current is None:
+            rows.append((name, 'missing', []))
+            continue
+
+        reasons = []
+        slower = current['p50_ms'] - old['p50_ms']
+        if slower > max(old['p50_ms'] * limits['time'], limits['min_ms']):
+            reasons.append(f"p50 {old['p50_ms']:.2f} -> {current['p50_ms']:.2f} ms")
+        if current['queries'] - old['queries'] > limits['queries']:
+            reasons.append(f"queries {old['queries']} -> {current['queries']}")
+        if old['peak_kb'] and current['peak_kb'] > old['peak_kb'] * (1 + limits['memory']):
+            reasons.append(f"peak {old['peak_kb']:.0f} -> {current['peak_kb']:.0f} KB")
+
+        if reasons:
+            status = 'regressed'
+        elif (-slower > max(old['p50_ms'] * limits['time'], limits['min_ms'])
+                or current['queries'] < old['queries']):
+            status = 'improved'
+        else:
+            status = 'ok'
+        rows.append((name, status, reasons))
+    return rows
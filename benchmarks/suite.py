@@ -0,0 +1,261 @@
+"""
+The benchmark cases and the data they run against.
+
+Every case is one API request through the full Django stack (middleware,
+auth, throttles, serializers, JSON rendering) made with the test client,
+so it measures what a real request costs minus the network. prepare() runs
+before each timed request and isnt counted - the catalog cases use it to
+bump the cache versions, so they time the real query + serialize work and
+not a cache hit (product_list_cached is the cache hit).
+"""
+import random
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from rest_framework.test import APIClient
+
+from core import throttling
+from products.cache import CATEGORIES, DETAILS, PRODUCTS, bump_versions
+from products.models import Category, Product, Review
+from products.ratings import rebuild_ratings
+from products.search import get_search_backend
+from products.tree import rebuild_category_tree
+
+User = get_user_model()
+
+PASSWORD = 'BenchPass123!'
+WORDS = [
+    'wireless', 'mouse', 'keyboard', 'usb', 'cable', 'charger', 'laptop',
+    'stand', 'monitor', 'hdmi', 'adapter', 'speaker', 'headphones', 'case',
+    'leather', 'cotton', 'shirt', 'lamp', 'desk', 'chair', 'bottle', 'steel',
+]
+
+
+class Benchmark:
+
+    def __init__(self, name, run, prepare=None, description=''):
+        self.name = name
+        self.run = run
+        self.prepare = prepare
+        self.description = description
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name, prepare=None):
+    """Register fn(ctx) as a benchmark case, in definition order."""
+    def decorator(fn):
+        BENCHMARKS[name] = Benchmark(name, fn, prepare, (fn.__doc__ or '').strip())
+        return fn
+    return decorator
+
+
+class BenchContext:
+    """The dataset's handles plus a client per audience."""
+
+    def __init__(self, buyer, seller, products, categories):
+        self.buyer = buyer
+        self.seller = seller
+        self.products = products  # (pk, slug)
+        self.categories = categories  # slugs
+        self.anon = APIClient()
+        self.client = APIClient()
+        self.pending = []  # orders prepare() placed for the cancel case
+        self._next = 0
+
+        self.reset_throttles()
+        resp = self.client.post(
+            '/api/v1/auth/login/', {'email': buyer.email, 'password': PASSWORD}, format='json'
+        )
+        self.check(resp, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {resp.data['access']}")
+
+    def reset_throttles(self):
+        # the throttle checks stay in the timings, just not their limits
+        throttling.reset('anon', '127.0.0.1')
+        throttling.reset('user', self.buyer.pk)
+        throttling.reset('place_order', self.buyer.pk)
+
+    @staticmethod
+    def check(resp, expected):
+        if resp.status_code != expected:
+            raise AssertionError(
+                f"{resp.request['PATH_INFO']} returned {resp.status_code}, expected {expected}"
+            )
+        return resp
+
+    def get(self, url):
+        return self.check(self.anon.get(url), 200)
+
+    def take(self, count):
+        """count different product ids, moving along the catalog each call."""
+        start = self._next
+        self._next = (self._next + count) % len(self.products)
+        return [self.products[(start + i) % len(self.products)][0] for i in range(count)]
+
+    def place_order(self, lines):
+        return self.check(self.client.post('/api/v1/orders/place/', {
+            'shipping_address': '1 Bench Street',
+            'items': [{'product_id': pk, 'quantity': 1} for pk in self.take(lines)],
+        }, format='json'), 201)
+
+
+def build_dataset(products=2000, reviews=4000, seed=42):
+    """
+    Deterministic catalog to benchmark against: a three level category tree,
+    products spread over the leaves, a few thousand reviews. Meant to be
+    rolled back afterwards (see run_benchmarks).
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    seller = User.objects.create(
+        email='bench-seller@example.com', username='bench-seller',
+        password=password, is_seller=True, first_name='Bench', last_name='Seller',
+    )
+    buyer = User.objects.create(
+        email='bench-buyer@example.com', username='bench-buyer',
+        password=password, first_name='Bench', last_name='Buyer',
+    )
+    reviewers = User.objects.bulk_create([
+        User(email=f'bench-reviewer-{i}@example.com', username=f'bench-reviewer-{i}',
+             password=password)
+        for i in range(50)
+    ])
+
+    leaves = []
+    for a in range(4):
+        root = Category.objects.create(name=f'Bench {a}')
+        for b in range(3):
+            child = Category.objects.create(name=f'Bench {a}.{b}', parent=root)
+            for c in range(3):
+                leaves.append(Category.objects.create(name=f'Bench {a}.{b}.{c}', parent=child))
+
+    created = Product.objects.bulk_create([
+        Product(
+            name=' '.join(rng.sample(WORDS, 3)).title() + f' {i}',
+            slug=f'bench-product-{i}', sku=f'BENCH-{i:07d}',
+            description=' '.join(rng.choices(WORDS, k=30)),
+            price=Decimal(rng.randint(100, 50000)) / 100,
+            stock_quantity=10 ** 6, category=rng.choice(leaves), seller=seller,
+        )
+        for i in range(products)
+    ], batch_size=1000)
+
+    pairs = set()
+    while len(pairs) < min(reviews, len(created) * len(reviewers)):
+        pairs.add((rng.randrange(len(created)), rng.randrange(len(reviewers))))
+    Review.objects.bulk_create([
+        Review(product=created[p], user=reviewers[u], rating=rng.randint(1, 5), comment='bench')
+        for p, u in sorted(pairs)
+    ], batch_size=1000)
+
+    # bulk_create skips the counters and the search index
+    rebuild_category_tree()
+    rebuild_ratings([p.pk for p in created])
+    backend = get_search_backend()
+    for product in created:
+        backend.product_saved(product)
+
+    return BenchContext(
+        buyer, seller, [(p.pk, p.slug) for p in created], [c.slug for c in leaves],
+    )
+
+
+def _bust_catalog_cache(ctx):
+    bump_versions(PRODUCTS, CATEGORIES, DETAILS)
+
+
+@benchmark('product_list', prepare=_bust_catalog_cache)
+def product_list(ctx):
+    """First page of the catalog, anonymous."""
+    ctx.get('/api/v1/products/')
+
+
+@benchmark('product_list_cached')
+def product_list_cached(ctx):
+    """Same page served from the catalog cache."""
+    ctx.get('/api/v1/products/')
+
+
+@benchmark('product_list_filtered', prepare=_bust_catalog_cache)
+def product_list_filtered(ctx):
+    """Category + price range + in stock."""
+    ctx.get(f'/api/v1/products/?category={ctx.categories[0]}'
+            '&min_price=10&max_price=300&in_stock=true')
+
+
+@benchmark('product_list_search', prepare=_bust_catalog_cache)
+def product_list_search(ctx):
+    """Two term ranked search."""
+    ctx.get('/api/v1/products/?search=wireless%20mou')
+
+
+@benchmark('product_list_ordered', prepare=_bust_catalog_cache)
+def product_list_ordered(ctx):
+    """Ordered by price, second page through the cursor."""
+    first = ctx.get('/api/v1/products/?ordering=price&pagination=cursor')
+    ctx.get(first.data['next'])
+
+
+@benchmark('product_detail', prepare=_bust_catalog_cache)
+def product_detail(ctx):
+    """A product page with its reviews and images."""
+    ctx.get(f'/api/v1/products/{ctx.products[0][1]}/')
+
+
+@benchmark('product_detail_cached')
+def product_detail_cached(ctx):
+    """Same page served from the detail cache."""
+    ctx.get(f'/api/v1/products/{ctx.products[0][1]}/')
+
+
+@benchmark('category_tree', prepare=_bust_catalog_cache)
+def category_tree(ctx):
+    """Every category with its nested subcategories and counts."""
+    ctx.get('/api/v1/categories/')
+
+
+@benchmark('place_order_1')
+def place_order_1(ctx):
+    """One line order, every line a different product."""
+    ctx.place_order(1)
+
+
+@benchmark('place_order_10')
+def place_order_10(ctx):
+    """Ten line order, every line a different product."""
+    ctx.place_order(10)
+
+
+@benchmark('place_order_50')
+def place_order_50(ctx):
+    """Fifty line order, every line a different product."""
+    ctx.place_order(50)
+
+
+def _place_pending(ctx):
+    ctx.pending.append(ctx.place_order(3).data['id'])
+
+
+@benchmark('cancel_order', prepare=_place_pending)
+def cancel_order(ctx):
+    """Cancel a pending three line order (stock goes back)."""
+    order_id = ctx.pending.pop()
+    ctx.check(ctx.client.post(f'/api/v1/orders/{order_id}/cancel/'), 200)
+
+
+@benchmark('login')
+def login(ctx):
+    """JWT login, dominated by the password hash."""
+    ctx.check(ctx.anon.post('/api/v1/auth/login/', {
+        'email': ctx.buyer.email, 'password': PASSWORD,
+    }, format='json'), 200)
+
+
+def cleanup(ctx):
+    """Drop the rolled back products from an in-process search index."""
+    backend = get_search_backend()
+    for pk, _ in ctx.products:
+        backend.product_deleted(pk)
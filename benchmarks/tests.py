@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+
+from products.models import Category, Product
+from .runner import compare, percentile
+
+
+def result(p50, queries=3, peak=100.0):
+    return {'p50_ms': p50, 'queries': queries, 'peak_kb': peak}
+
+
+class RunnerTests(TestCase):
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([7], 90), 7)
+
+    def test_compare(self):
+        baseline = {
+            'list': result(10), 'detail': result(10), 'login': result(300),
+            'gone': result(1),
+        }
+        current = {
+            'list': result(14),                 # slower, past 25%
+            'detail': result(10, queries=4),    # one more query
+            'login': result(200),               # faster
+            'search': result(5),
+        }
+        rows = {name: (status, reasons) for name, status, reasons in compare(current, baseline)}
+        self.assertEqual(rows['list'][0], 'regressed')
+        self.assertIn('queries 3 -> 4', rows['detail'][1])
+        self.assertEqual(rows['login'][0], 'improved')
+        self.assertEqual(rows['search'][0], 'new')
+        self.assertEqual(rows['gone'][0], 'missing')
+
+        # thresholds are configurable, tiny changes are noise
+        rows = compare(current, baseline, {'time': 0.5, 'queries': 1})
+        self.assertEqual([s for n, s, _ in rows if n in ('list', 'detail')], ['ok', 'ok'])
+        rows = compare({'list': result(1.4)}, {'list': result(1.0)})
+        self.assertEqual(rows[0][1], 'ok')
+
+    def test_command_runs_and_rolls_back(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        output = os.path.join(tmp, 'results.json')
+        args = [
+            '--only', 'product_list,product_detail', '--iterations', '2',
+            '--warmup', '0', '--products', '30', '--output', output,
+        ]
+        call_command('run_benchmarks', *args, stdout=StringIO())
+
+        with open(output) as fh:
+            data = json.load(fh)
+        self.assertEqual(set(data['benchmarks']), {'product_list', 'product_detail'})
+        self.assertGreater(data['benchmarks']['product_list']['queries'], 0)
+        self.assertEqual(Product.objects.count(), 0)
+
+        # comparing against a baseline with fewer queries fails the run
+        baseline = os.path.join(tmp, 'baseline.json')
+        data['benchmarks']['product_list']['queries'] = 0
+        with open(baseline, 'w') as fh:
+            json.dump(data, fh)
+        with self.assertRaises(CommandError):
+            call_command('run_benchmarks', *args, '--baseline', baseline, stdout=StringIO())
+
+
+class ConcurrencyBenchTests(TransactionTestCase):
+
+    def test_command_runs_and_cleans_up(self):
+        out = StringIO()
+        call_command(
+            'bench_concurrency', '--requests', '30', '--concurrency', '5',
+            '--products', '10', '--cache-latency-ms', '1', stdout=out,
+        )
+        # every request answered, by both deployments
+        self.assertRegex(out.getvalue(), r'wsgi +3 +[\d.]+ +[\d.]+ +[\d.]+ +[\d.]+ +0\n')
+        self.assertRegex(out.getvalue(), r'asgi +1 +[\d.]+ +[\d.]+ +[\d.]+ +[\d.]+ +0\n')
+        self.assertEqual(Product.objects.count(), 0)
+        self.assertEqual(Category.objects.count(), 0)
@@ -1,5 +1,19 @@
+"""
+ASGI entry point, not the default deployment (Dockerfile / docker-compose
+run core.wsgi). To try it, pip install uvicorn[standard] and
+
+    gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker
+
+The views are the same sync DRF views, run in a thread per request. What
+changes is that the catalog export streams from an async iterator and
+idle connections dont hold a worker. With a local cache bench_concurrency
+has the 3 sync workers ahead, so measure against the real setup before
+switching.
+"""
 import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# connections arent reused across requests here, see DB_CONN_MAX_AGE
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 application = get_asgi_application()
@@ -0,0 +1,90 @@
+"""
+Cache backends that report hits, misses and time to the current request's
+metrics (core/metrics.py). Drop-in for the backends they extend, outside a
+request they cost one contextvar lookup per call.
+"""
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+from django_redis.cache import RedisCache
+
+from .metrics import current
+
+_missing = object()
+
+
+class InstrumentedCacheMixin:
+
+    def _timed(self, fn, *args, **kwargs):
+        metrics = current()
+        if metrics is None or metrics.in_cache:
+            return fn(*args, **kwargs), None
+        metrics.in_cache = True
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs), metrics
+        finally:
+            metrics.in_cache = False
+            metrics.cache_time += time.perf_counter() - start
+
+    def get(self, key, default=None, version=None):
+        value, metrics = self._timed(super().get, key, _missing, version=version)
+        if metrics is not None:
+            if value is _missing:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is _missing else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found, metrics = self._timed(super().get_many, keys, version=version)
+        if metrics is not None:
+            metrics.cache_hits += len(found)
+            metrics.cache_misses += len(keys) - len(found)
+        return found
+
+    def set(self, *args, **kwargs):
+        return self._timed(super().set, *args, **kwargs)[0]
+
+    def add(self, *args, **kwargs):
+        return self._timed(super().add, *args, **kwargs)[0]
+
+    def set_many(self, *args, **kwargs):
+        return self._timed(super().set_many, *args, **kwargs)[0]
+
+    def delete(self, *args, **kwargs):
+        return self._timed(super().delete, *args, **kwargs)[0]
+
+    def delete_many(self, *args, **kwargs):
+        return self._timed(super().delete_many, *args, **kwargs)[0]
+
+    def incr(self, *args, **kwargs):
+        return self._timed(super().incr, *args, **kwargs)[0]
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    # process memory behind a lock, nothing to wait on. BaseCache's async
+    # methods would hop to a thread for every call, run them inline instead
+
+    async def aget(self, key, default=None, version=None):
+        return self.get(key, default, version=version)
+
+    async def aget_many(self, keys, version=None):
+        return self.get_many(keys, version=version)
+
+    async def aset(self, *args, **kwargs):
+        return self.set(*args, **kwargs)
+
+    async def aset_many(self, *args, **kwargs):
+        return self.set_many(*args, **kwargs)
+
+    async def aadd(self, *args, **kwargs):
+        return self.add(*args, **kwargs)
+
+    async def adelete(self, *args, **kwargs):
+        return self.delete(*args, **kwargs)
+
+
+class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+    pass
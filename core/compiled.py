@@ -0,0 +1,389 @@
+"""
+Compiled read-only serializers.
+
+compile_serializer(serializer) walks a (Model)Serializer's readable fields
+once and returns a CompiledSerializer: one small function per field, picked
+for that field's type, and a flat loop that builds the dict. This skips the
+per-field get_attribute / to_representation dispatch that dominates DRF
+serialization cost on list pages. The output is the same as serializer.data
+field for field, so it renders to the same JSON:
+
+  - Decimal and ISO-8601 datetimes are formatted inline when the value is
+    already in its final shape (DB decimals, aware datetimes). Anything else
+    goes through the DRF field
+  - nested serializers are compiled recursively
+  - fields we dont special-case (SerializerMethodField, source='*', custom
+    field classes) call the DRF field as-is
+
+It also takes .values() rows when every field is a plain column, a
+join column or a foreign key id. value_columns lists what to ask for, and
+from_row() builds the dict from the row.
+
+A serializer that overrides to_representation can only be compiled if it
+moves its tweaks into adjust_representation(instance, data). Otherwise it
+runs through DRF whole.
+
+Compiled plans are kept per (serializer class, selected fields) and bound
+to each request's serializer, unless a field has to go through DRF - those
+read the serializer's context, so they're compiled per request.
+"""
+import copy
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db import models
+from django.utils import timezone
+from rest_framework import fields as drf_fields
+from rest_framework import relations, serializers
+from rest_framework.fields import SkipField, empty, is_simple_callable
+from rest_framework.settings import api_settings
+
+SKIP = object()
+
+
+def _identity(value):
+    return value
+
+
+def _decimal_formatter(field):
+    coerce = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce or field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+    exponent = -field.decimal_places
+    slow = field.to_representation
+
+    def fmt(value):
+        # DB values already have the column's scale, so quantize is a no-op
+        if type(value) is Decimal and value.as_tuple().exponent == exponent:
+            return f'{value:f}'
+        return slow(value)
+    return fmt
+
+
+def _datetime_formatter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if (output_format is None or output_format.lower() != drf_fields.ISO_8601
+            or hasattr(field, 'timezone') or not settings.USE_TZ):
+        return field.to_representation
+    tz = timezone.get_current_timezone()
+    slow = field.to_representation
+
+    def fmt(value):
+        if getattr(value, 'tzinfo', None) is None:
+            return slow(value)
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return fmt
+
+
+# exact classes only, a subclass may have its own to_representation
+FORMATTERS = {
+    drf_fields.CharField: str,
+    drf_fields.SlugField: str,
+    drf_fields.URLField: str,
+    drf_fields.EmailField: str,
+    drf_fields.IntegerField: int,
+    drf_fields.FloatField: float,
+    drf_fields.BooleanField: bool,
+    drf_fields.ReadOnlyField: _identity,
+    drf_fields.DecimalField: _decimal_formatter,
+    drf_fields.DateTimeField: _datetime_formatter,
+}
+_FACTORIES = (drf_fields.DecimalField, drf_fields.DateTimeField)
+NATIVE_TYPES = {str: str, int: int, float: float, bool: bool}
+
+
+def _formatter(field):
+    fmt = FORMATTERS.get(type(field))
+    if fmt is None:
+        return None
+    return fmt(field) if type(field) in _FACTORIES else fmt
+
+
+def _missing(field):
+    """What DRF does when the source attribute isnt there (Field.get_attribute)."""
+    if field.default is not empty:
+        return lambda: field.get_default()
+    if field.allow_null:
+        return lambda: None
+    if not field.required:
+        return lambda: SKIP
+    return None
+
+
+def _attribute_getter(field):
+    attrs = field.source_attrs
+    missing = _missing(field)
+
+    def get(instance):
+        try:
+            for attr in attrs:
+                try:
+                    instance = getattr(instance, attr)
+                except ObjectDoesNotExist:
+                    return None
+                if callable(instance) and is_simple_callable(instance):
+                    instance = instance()
+        except (AttributeError, KeyError):
+            if missing is None:
+                raise
+            return missing()
+        return instance
+
+    if len(attrs) == 1 and missing is not None:
+        # the common case, one attribute on the instance itself
+        attr = attrs[0]
+
+        def get(instance, get=get):
+            try:
+                value = getattr(instance, attr)
+            except (AttributeError, ObjectDoesNotExist):
+                return get(instance)
+            if callable(value) and is_simple_callable(value):
+                return get(instance)
+            return value
+    return get
+
+
+def _drf_field(field):
+    def run(instance):
+        try:
+            attribute = field.get_attribute(instance)
+        except SkipField:
+            return SKIP
+        check = attribute.pk if isinstance(attribute, relations.PKOnlyObject) else attribute
+        if check is None:
+            return None
+        return field.to_representation(attribute)
+    # the field belongs to one serializer instance, and so its context
+    run.reusable = False
+    return run
+
+
+def _field_function(field, model):
+    """instance -> output value (or SKIP) for one serializer field."""
+    if isinstance(field, serializers.ListSerializer) and field.source != '*':
+        child = compile_serializer(field.child)
+        get = _attribute_getter(field)
+
+        def many(instance):
+            value = get(instance)
+            if value is SKIP or value is None:
+                return value
+            if isinstance(value, models.manager.BaseManager):
+                value = value.all()
+            return [child.to_representation(item) for item in value]
+        many.reusable = child.reusable and child.adjust is None
+        return many
+
+    if isinstance(field, serializers.BaseSerializer) and field.source != '*':
+        nested = compile_serializer(field)
+        get = _attribute_getter(field)
+
+        def one(instance):
+            value = get(instance)
+            if value is SKIP or value is None:
+                return value
+            return nested.to_representation(value)
+        one.reusable = nested.reusable and nested.adjust is None
+        return one
+
+    if (type(field) is relations.PrimaryKeyRelatedField and model is not None
+            and len(field.source_attrs) == 1 and field.pk_field is None
+            and field.use_pk_only_optimization()):
+        attname = _fk_attname(model, field.source)
+        if attname:
+            return lambda instance: getattr(instance, attname)
+
+    fmt = _formatter(field)
+    if fmt is None or field.source == '*':
+        return _drf_field(field)
+
+    # model columns: no callables or missing attributes to worry about, and
+    # a value that already has the output type is passed through as is
+    exact = NATIVE_TYPES.get(fmt)
+    attrs = field.source_attrs
+    if len(attrs) == 1 and _is_column(model, attrs[0]):
+        attr = attrs[0]
+
+        def column(instance):
+            v = getattr(instance, attr)
+            if v is None or type(v) is exact:
+                return v
+            return fmt(v)
+        return column
+
+    missing = _missing(field)
+    if (len(attrs) == 2 and missing is not None and _fk_attname(model, attrs[0])
+            and _is_column(model._meta.get_field(attrs[0]).related_model, attrs[1])):
+        head, attr = attrs
+
+        def joined(instance):
+            related = getattr(instance, head)
+            if related is None:
+                return missing()
+            v = getattr(related, attr)
+            if v is None or type(v) is exact:
+                return v
+            return fmt(v)
+        return joined
+
+    get = _attribute_getter(field)
+
+    def value(instance):
+        v = get(instance)
+        if v is SKIP or v is None:
+            return v
+        return fmt(v)
+    return value
+
+
+def _is_column(model, name):
+    if model is None:
+        return False
+    try:
+        return model._meta.get_field(name).concrete
+    except FieldDoesNotExist:
+        return False
+
+
+def _fk_attname(model, name):
+    try:
+        f = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return f.attname if f.many_to_one and f.concrete else None
+
+
+def _row_plan(field, model):
+    """(columns, row -> value) for a field that can be read off a .values() row."""
+    if model is None or isinstance(field, serializers.BaseSerializer) or field.source == '*':
+        return None
+    attrs = field.source_attrs
+    if type(field) is relations.PrimaryKeyRelatedField and len(attrs) == 1:
+        if (_fk_attname(model, attrs[0]) and field.pk_field is None
+                and field.use_pk_only_optimization()):
+            key = attrs[0]
+            return [key], lambda row: row[key]
+        return None
+
+    fmt = _formatter(field)
+    if fmt is None or len(attrs) > 2:
+        return None
+    if len(attrs) == 1:
+        if not _is_column(model, attrs[0]):
+            return None
+        key = attrs[0]
+
+        def plain(row):
+            v = row[key]
+            return None if v is None else fmt(v)
+        return [key], plain
+
+    # 'fk.column' - DRF skips the key (read only) when the fk is null
+    head, attr = attrs
+    if not _fk_attname(model, head) or not _is_column(model._meta.get_field(head).related_model, attr):
+        return None
+    missing = _missing(field)
+    if missing is None:
+        return None
+    key = f'{head}__{attr}'
+
+    def joined(row):
+        if row[head] is None:
+            return missing()
+        v = row[key]
+        return None if v is None else fmt(v)
+    return [head, key], joined
+
+
+class CompiledSerializer:
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        meta = getattr(serializer, 'Meta', None)
+        model = getattr(meta, 'model', None)
+        cls = type(serializer)
+        custom = cls.to_representation is not serializers.Serializer.to_representation
+        self.adjust = getattr(serializer, 'adjust_representation', None)
+        self.fallback = custom and self.adjust is None
+
+        readable = list(serializer._readable_fields)
+        self.functions = [(f.field_name, _field_function(f, model)) for f in readable]
+        self.reusable = not self.fallback and not any(
+            getattr(f.default, 'requires_context', False) for f in readable
+        ) and all(getattr(fn, 'reusable', True) for _, fn in self.functions)
+
+        # .values() support, only when every field is a column
+        plans = [(f.field_name, _row_plan(f, model)) for f in readable]
+        if self.fallback or self.adjust or any(plan is None for _, plan in plans):
+            self.value_columns = None
+            self.row_functions = None
+        else:
+            columns = []
+            for _, (cols, _) in plans:
+                columns.extend(c for c in cols if c not in columns)
+            self.value_columns = columns
+            self.row_functions = [(name, fn) for name, (_, fn) in plans]
+
+    def bind(self, serializer):
+        """This plan for another instance of the same serializer and fields."""
+        bound = copy.copy(self)
+        bound.serializer = serializer
+        if self.adjust is not None:
+            bound.adjust = serializer.adjust_representation
+        return bound
+
+    def to_representation(self, instance):
+        if self.fallback:
+            return self.serializer.to_representation(instance)
+        data = {}
+        for name, fn in self.functions:
+            value = fn(instance)
+            if value is not SKIP:
+                data[name] = value
+        if self.adjust is not None:
+            data = self.adjust(instance, data)
+        return data
+
+    def from_row(self, row):
+        data = {}
+        for name, fn in self.row_functions:
+            value = fn(row)
+            if value is not SKIP:
+                data[name] = value
+        return data
+
+    def serialize(self, items):
+        """List of dicts from model instances or (if value_columns) .values() rows."""
+        if isinstance(items, models.QuerySet) and items._iterable_class is not models.query.ModelIterable:
+            return [self.from_row(row) for row in items]
+        rows = list(items)
+        if rows and isinstance(rows[0], dict):
+            return [self.from_row(row) for row in rows]
+        return [self.to_representation(item) for item in rows]
+
+
+# ?fields= picks the keys, so there's a limit
+PLAN_CACHE_SIZE = 256
+_plans = {}
+
+
+def compile_serializer(serializer):
+    """
+    Compile a serializer instance (with its context, and after any field
+    pruning). The plan is reused for the next instance with the same fields.
+    """
+    key = (type(serializer), tuple(serializer.fields), timezone.get_current_timezone_name())
+    compiled = _plans.get(key)
+    if compiled is not None:
+        return compiled.bind(serializer)
+    compiled = CompiledSerializer(serializer)
+    if compiled.reusable:
+        if len(_plans) >= PLAN_CACHE_SIZE:
+            _plans.clear()
+        _plans[key] = compiled
+    return compiled
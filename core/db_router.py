@@ -0,0 +1,152 @@
+"""
+Primary / replica routing with read-your-writes.
+
+Writes always go to the primary ('default'). Reads go to one of
+settings.DATABASE_REPLICAS only inside a request that
+
+  - is a GET/HEAD/OPTIONS
+  - is for a view with replica_reads = True (the catalog and order history)
+  - isnt from a user who wrote something in the last REPLICA_PIN_SECONDS
+
+so a user who just placed an order, posted a review or edited a product
+sees it straight away, and a POST's own reads (the stock checks and
+select_for_update in PlaceOrderSerializer) never see a lagging replica.
+Management commands and celery tasks run outside a request and stay on
+the primary.
+
+ReplicaMiddleware keeps the request in a contextvar for the router and sets
+the pin after a successful write. The decision is made at the first query,
+after url resolution, and the whole request then sticks to that database.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+PRIMARY = 'default'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_KEY = 'db-pin:{}'
+
+_current = ContextVar('replica_request', default=None)
+
+
+class ReadState:
+    def __init__(self, request):
+        self.request = request
+        self.database = None  # picked at the first read
+
+
+def pin_key(user_id):
+    return PIN_KEY.format(user_id)
+
+
+def token_user_id(request):
+    """The user id claim of a valid bearer token, without a query."""
+    auth = JWTAuthentication()
+    try:
+        header = auth.get_header(request)
+        raw_token = None if header is None else auth.get_raw_token(header)
+        if raw_token is None:
+            return None
+        return auth.get_validated_token(raw_token).get(jwt_settings.USER_ID_CLAIM)
+    except AuthenticationFailed:
+        return None
+
+
+def replica_allowed(request):
+    if request.method not in SAFE_METHODS:
+        return False
+    match = request.resolver_match
+    view_class = getattr(match.func, 'cls', None) if match else None
+    if not getattr(view_class, 'replica_reads', False):
+        return False
+    user_id = token_user_id(request)
+    if user_id is None:
+        # no token: anonymous, unless it's a browsable api session we
+        # cant tell the user of without a query, those stay on the primary
+        return settings.SESSION_COOKIE_NAME not in request.COOKIES
+    return cache.get(pin_key(user_id)) is None
+
+
+def read_database(state):
+    if state.database is None:
+        if replica_allowed(state.request):
+            state.database = random.choice(settings.DATABASE_REPLICAS)
+        else:
+            state.database = PRIMARY
+    return state.database
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None:
+            return PRIMARY
+        return read_database(state)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas are copies of the primary, same rows everywhere
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+def written_by(request, response):
+    """The user id to pin after request, None if it didnt write anything."""
+    if request.method in SAFE_METHODS or response.status_code >= 400:
+        return None
+    # DRF responses carry the DRF request, authenticated by now
+    context = getattr(response, 'renderer_context', None) or {}
+    drf_request = context.get('request')
+    user = getattr(drf_request, '_user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        token = _current.set(ReadState(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        user_id = written_by(request, response)
+        if user_id is not None:
+            cache.set(pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        token = _current.set(ReadState(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        user_id = written_by(request, response)
+        if user_id is not None:
+            await cache.aset(pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS)
+        return response
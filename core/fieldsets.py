@@ -0,0 +1,135 @@
+"""
+Sparse fieldsets for read endpoints.
+
+    ?fields=id,name,price     only these fields
+    ?expand=images            also include fields that are left out by
+                              default (Meta.expandable_fields)
+
+The chosen fields also drive the query through prune_queryset(). Only the
+columns, joins and prefetches those fields actually read get loaded:
+
+    plain model field            .only(source)
+    'fk.attr' source             .select_related(fk) + .only('fk__attr')
+    nested serializer            .select_related(source)
+    nested many=True             .prefetch_related(source)
+
+Properties and anything custom are declared in Meta.field_queries, eg.
+
+    field_queries = {
+        'avg_rating': {'only': ['rating_count', 'rating_sum']},
+        'in_stock': {'only': [...], 'annotate': ['with_available_stock']},
+    }
+
+A field that can't be mapped either way just turns off the column pruning
+(everything gets loaded), so a missing entry costs speed, not correctness.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_list(value):
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+
+class SparseFieldsetMixin:
+    """For ModelSerializers, see module docstring. Only applies to reads."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.selected_fields(self.context.get('request'))
+        if selected is not None:
+            for name in list(self.fields):
+                if name not in selected and not self.fields[name].write_only:
+                    self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, request):
+        """Field names for this request, or None for writes / no request."""
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        available = set(cls.Meta.fields)
+        expandable = set(getattr(cls.Meta, 'expandable_fields', ()))
+        requested = parse_list(request.query_params.get('fields'))
+        expand = parse_list(request.query_params.get('expand'))
+
+        unknown = set(requested) - available
+        if unknown:
+            raise ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+        unknown = set(expand) - expandable
+        if unknown:
+            raise ValidationError({'expand': f"Cant expand: {', '.join(sorted(unknown))}"})
+
+        if requested:
+            return set(requested) | set(expand)
+        return (available - expandable) | set(expand)
+
+    @classmethod
+    def prune_queryset(cls, queryset, fields, keep=()):
+        """
+        Cut queryset down to what the given fields read. keep is extra
+        columns to always load (eg. whatever the pagination orders by).
+        """
+        model = queryset.model
+        specs = getattr(cls.Meta, 'field_queries', {})
+        declared = cls().fields
+        only, select, prefetch, annotate = set(keep), set(), [], []
+        prunable = True
+
+        for name in fields:
+            if name in specs:
+                spec = specs[name]
+                only.update(spec.get('only', ()))
+                select.update(spec.get('select', ()))
+                prefetch.extend(p for p in spec.get('prefetch', ()) if p not in prefetch)
+                annotate.extend(a for a in spec.get('annotate', ()) if a not in annotate)
+                continue
+
+            field = declared[name]
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                if field.source not in prefetch:
+                    prefetch.append(field.source)
+            elif isinstance(field, serializers.BaseSerializer):
+                select.add(field.source)
+                only.add(field.source)
+            elif '.' in field.source:
+                head, attr = field.source.split('.', 1)
+                select.add(head)
+                if _is_column(_related_model(model, head), attr):
+                    only.add(f'{head}__{attr}')
+                else:
+                    only.add(head)
+            elif _is_column(model, field.source):
+                only.add(field.source)
+            else:
+                prunable = False
+
+        qs = queryset.select_related(None)
+        if select:
+            qs = qs.select_related(*select)
+        for method in annotate:
+            qs = getattr(qs, method)()
+        if prefetch:
+            qs = qs.prefetch_related(*prefetch)
+        if prunable:
+            qs = qs.only(*only)
+        return qs
+
+
+def _related_model(model, name):
+    try:
+        return model._meta.get_field(name).related_model
+    except FieldDoesNotExist:
+        return None
+
+
+def _is_column(model, name):
+    if model is None:
+        return False
+    try:
+        return model._meta.get_field(name).concrete
+    except FieldDoesNotExist:
+        return False
@@ -0,0 +1,393 @@
+"""
+Per-request performance numbers.
+
+MetricsMiddleware keeps a RequestMetrics for every request (in a contextvar)
+and fills it from:
+
+  SQL          an execute_wrapper on every db connection - count + time.
+               installed once per connection rather than per request,
+               under ASGI the views run on sync_to_async's threads
+  cache        the Instrumented*Cache backends (core/cache_backends.py) -
+               hits, misses, time. This covers the catalog response cache,
+               the version lookups and the page count cache
+  serialize    span('serialize') around the serializer calls in the views
+  render       DRF rendering the response to JSON
+  view / total the view call / the whole middleware stack
+
+Everything is labelled by the DRF view and action (ProductViewSet.list),
+falls back to the url name for plain Django views.
+
+Staff callers get the numbers back as a Server-Timing header. Every request
+also goes into an in-process registry of counters and latency histograms,
+which each process copies into the shared cache every
+METRICS_FLUSH_INTERVAL seconds. GET /metrics renders all processes' copies
+added up, in the Prometheus text format. The queries are also checked
+against the endpoint's query budget (core/querybudget.py).
+"""
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+from . import querybudget
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROCESS_KEY = 'metrics:process:{}'
+PROCESSES_KEY = 'metrics:processes'
+PROCESS_TTL = 60 * 60  # a dead worker's numbers drop out after this
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.token = None  # the contextvar reset token
+        self.db_count = 0
+        self.queries = []  # sql strings, for the query budget check
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_time = 0.0
+        self.in_cache = False  # get_many -> get on some backends, count once
+        self.spans = {}
+        self.view_started = None
+        self.render_started = None
+
+    def sql(self, execute, sql, params, many, context):
+        """execute_wrapper hook."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.db_count += 1
+            self.queries.append(sql)
+
+    def add_span(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+
+def current():
+    """The RequestMetrics for the request being handled, or None."""
+    return _current.get()
+
+
+def record_sql(execute, sql, params, many, context):
+    # contextvars follow the request into sync_to_async threads, so this
+    # finds the right request whichever thread the query runs on
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.sql(execute, sql, params, many, context)
+
+
+def install_sql_hook(connection, **kwargs):
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+connection_created.connect(install_sql_hook)
+
+
+@contextmanager
+def span(name):
+    """Time a block into the current request's `name` span (no-op outside one)."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_span(name, time.perf_counter() - start)
+
+
+def view_label(request, response):
+    # the view that actually answered (renderer_context), not just the one
+    # the url resolved to - ReviewCreateView hands GETs to ProductViewSet
+    view = getattr(response, 'renderer_context', None) and response.renderer_context.get('view')
+    if view is not None:
+        action = getattr(view, 'action', None) or request.method.lower()
+        return f'{view.__class__.__name__}.{action}'
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        cls = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+        if cls is None:
+            return match.view_name or match.func.__name__
+        # eg. a 304 from conditional_response never reaches DRF
+        actions = getattr(match.func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{cls.__name__}.{action}'
+    return 'unmatched'
+
+
+def server_timing(metrics, total):
+    entries = [
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.db_count} queries"',
+        f'cache;dur={metrics.cache_time * 1000:.1f};'
+        f'desc="{metrics.cache_hits} hits {metrics.cache_misses} misses"',
+    ]
+    for name, seconds in metrics.spans.items():
+        entries.append(f'{name};dur={seconds * 1000:.1f}')
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class Registry:
+    """Counters and histograms for this process, by view label."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = 0.0
+        self.process = f'{socket.gethostname()}:{os.getpid()}'
+
+    def observe(self, label, status, metrics, total):
+        with self.lock:
+            stats = self.views.get(label)
+            if stats is None:
+                stats = self.views[label] = {
+                    'requests': {}, 'buckets': [0] * len(LATENCY_BUCKETS),
+                    'count': 0, 'sum': 0.0, 'db_queries': 0, 'db_seconds': 0.0,
+                    'cache_hits': 0, 'cache_misses': 0, 'cache_seconds': 0.0, 'spans': {},
+                }
+            status = str(status)
+            stats['requests'][status] = stats['requests'].get(status, 0) + 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if total <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['sum'] += total
+            stats['db_queries'] += metrics.db_count
+            stats['db_seconds'] += metrics.db_time
+            stats['cache_hits'] += metrics.cache_hits
+            stats['cache_misses'] += metrics.cache_misses
+            stats['cache_seconds'] += metrics.cache_time
+            for name, seconds in metrics.spans.items():
+                stats['spans'][name] = stats['spans'].get(name, 0.0) + seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                label: {**stats, 'requests': dict(stats['requests']),
+                        'buckets': list(stats['buckets']), 'spans': dict(stats['spans'])}
+                for label, stats in self.views.items()
+            }
+
+    def flush(self, force=False):
+        """Copy this process's numbers to the cache, at most every interval."""
+        now = time.monotonic()
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 15)
+        if not force and now - self.last_flush < interval:
+            return
+        self.last_flush = now
+        try:
+            cache.set(PROCESS_KEY.format(self.process), self.snapshot(), PROCESS_TTL)
+            processes = cache.get(PROCESSES_KEY) or []
+            if self.process not in processes:
+                # racy read-modify-write, a lost entry is re-added next flush
+                cache.set(PROCESSES_KEY, [*processes, self.process], None)
+        except Exception:
+            pass  # metrics are never worth failing a request over
+
+    def collect(self):
+        """Every live process's snapshot added up."""
+        self.flush(force=True)
+        processes = cache.get(PROCESSES_KEY) or []
+        found = cache.get_many([PROCESS_KEY.format(p) for p in processes])
+        alive = [p for p in processes if PROCESS_KEY.format(p) in found]
+        if len(alive) != len(processes):
+            cache.set(PROCESSES_KEY, alive, None)
+
+        total = {}
+        for snapshot in found.values():
+            for label, stats in snapshot.items():
+                into = total.setdefault(label, {
+                    'requests': {}, 'buckets': [0] * len(LATENCY_BUCKETS), 'spans': {},
+                })
+                for status, n in stats['requests'].items():
+                    into['requests'][status] = into['requests'].get(status, 0) + n
+                into['buckets'] = [a + b for a, b in zip(into['buckets'], stats['buckets'])]
+                for name, seconds in stats['spans'].items():
+                    into['spans'][name] = into['spans'].get(name, 0.0) + seconds
+                for key in ('count', 'sum', 'db_queries', 'db_seconds',
+                            'cache_hits', 'cache_misses', 'cache_seconds'):
+                    into[key] = into.get(key, 0) + stats[key]
+        return total
+
+
+registry = Registry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(views):
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    metric('http_requests_total', 'counter', 'Requests by view and status code.')
+    for label, stats in sorted(views.items()):
+        for status, n in sorted(stats['requests'].items()):
+            lines.append(f'http_requests_total{{view="{_escape(label)}",status="{status}"}} {n}')
+
+    metric('http_request_duration_seconds', 'histogram', 'Time in the middleware stack.')
+    for label, stats in sorted(views.items()):
+        view = _escape(label)
+        for bound, n in zip(LATENCY_BUCKETS, stats['buckets']):
+            lines.append(f'http_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {n}')
+        lines.append(f'http_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'http_request_duration_seconds_sum{{view="{view}"}} {stats["sum"]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{view="{view}"}} {stats["count"]}')
+
+    counters = [
+        ('db_queries_total', 'db_queries', 'SQL queries run.'),
+        ('db_query_seconds_total', 'db_seconds', 'Time spent in SQL.'),
+        ('cache_hits_total', 'cache_hits', 'Cache reads that found the key.'),
+        ('cache_misses_total', 'cache_misses', 'Cache reads that did not.'),
+        ('cache_seconds_total', 'cache_seconds', 'Time spent in cache calls.'),
+    ]
+    for name, key, help_text in counters:
+        metric(name, 'counter', help_text)
+        for label, stats in sorted(views.items()):
+            lines.append(f'{name}{{view="{_escape(label)}"}} {stats[key]}')
+
+    metric('view_span_seconds_total', 'counter', 'Time in named spans (serialize, render, view).')
+    for label, stats in sorted(views.items()):
+        for name, seconds in sorted(stats['spans'].items()):
+            lines.append(
+                f'view_span_seconds_total{{view="{_escape(label)}",span="{name}"}} {seconds:.6f}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Goes first in MIDDLEWARE so total covers the whole stack."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(metrics.token)
+        return self._finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(metrics.token)
+        return self._finish(request, response, metrics)
+
+    def _start(self):
+        # connections opened before this module was imported didnt get the
+        # connection_created signal
+        for connection in connections.all():
+            install_sql_hook(connection)
+        metrics = RequestMetrics()
+        metrics.token = _current.set(metrics)
+        return metrics
+
+    def _finish(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        if 'view' not in metrics.spans and metrics.view_started:
+            # plain django views dont go through process_template_response
+            metrics.add_span('view', time.perf_counter() - metrics.view_started)
+        label = view_label(request, response)
+        registry.observe(label, response.status_code, metrics, total)
+        registry.flush()  # blocking, but only every METRICS_FLUSH_INTERVAL
+        querybudget.check(label, metrics.queries)  # logs, or raises in tests
+
+        if self._is_staff(request, response, loaded_only=iscoroutinefunction(self)):
+            response['Server-Timing'] = server_timing(metrics, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns, time that separately
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_span('view', time.perf_counter() - (metrics.view_started or metrics.started))
+            metrics.render_started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda r: metrics.add_span('render', time.perf_counter() - metrics.render_started)
+            )
+        return response
+
+    @staticmethod
+    def _is_staff(request, response, loaded_only=False):
+        # DRF authenticates (JWT) inside the view, so ask its request first
+        context = getattr(response, 'renderer_context', None) or {}
+        user = getattr(context.get('request'), 'user', None) or getattr(request, 'user', None)
+        if loaded_only and isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            # the session user nobody looked at, loading it on the event
+            # loop would be a query there
+            return False
+        return bool(user is not None and user.is_authenticated and user.is_staff)
+
+
+def has_metrics_token(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    return bool(token) and constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+    )
+
+
+class CanScrapeMetrics(permissions.BasePermission):
+    """Staff, or a scraper sending Authorization: Bearer <METRICS_TOKEN>."""
+
+    def has_permission(self, request, view):
+        return has_metrics_token(request) or bool(request.user and request.user.is_staff)
+
+
+class MetricsView(APIView):
+    permission_classes = [CanScrapeMetrics]
+    throttle_classes = []
+
+    def get_authenticators(self):
+        # the scraper's token isnt a JWT, dont let the JWT auth reject it
+        if has_metrics_token(self.request):
+            return []
+        return super().get_authenticators()
+
+    def get(self, request):
+        return HttpResponse(
+            render_prometheus(registry.collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
@@ -0,0 +1,232 @@
+"""
+Pagination classes shared by the api apps.
+
+PageNumberPagination runs an exact COUNT(*) and an OFFSET scan on every
+request, which gets slower the bigger the table and the deeper the page.
+KeysetPagination seeks straight to the next page using the last row's
+(ordering value, pk) instead, and CachedCountPagination keeps the page
+number api but only counts once per query every COUNT_CACHE_TIMEOUT seconds.
+"""
+import hashlib
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import partial
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+COUNT_CACHE_TIMEOUT = 60
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Django paginator that caches COUNT(*) per distinct query.
+
+    count_version lets the caller tie the cached count to something that
+    changes on writes (eg. the catalog cache version), otherwise it is just
+    allowed to be up to COUNT_CACHE_TIMEOUT seconds old.
+    """
+
+    def __init__(self, *args, count_version=None, **kwargs):
+        self.count_version = count_version
+        super().__init__(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except (AttributeError, EmptyResultSet):
+            return super().count
+
+        raw = f'{queryset.db}:{self.count_version}:{sql}:{params}'
+        key = f'page-count:{hashlib.md5(raw.encode()).hexdigest()}'
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    def page(self, number):
+        # same as Paginator.page but without clamping the slice to self.count,
+        # a slightly stale count must never cut rows off the page
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class CachedCountPagination(PageNumberPagination):
+    """
+    PageNumberPagination with a cached count. Views can define
+    get_count_version() to invalidate the cached counts on writes.
+    """
+    django_paginator_class = CachedCountPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        get_version = getattr(view, 'get_count_version', None)
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            count_version=get_version() if get_version else None,
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (ordering field, pk).
+
+    The ordering comes from OrderingFilter (so ?ordering=price works as
+    usual) and the pk is added as a tiebreaker in the same direction, so
+    every page is a range seek on a (field, id) index. The cursor just holds
+    the ordering plus the boundary row's values - no COUNT and no OFFSET.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    default_ordering = '-created_at'
+    ordering_fields = None  # defaults to the view's
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(queryset, view)
+        field_name = self.ordering.lstrip('-')
+        self.field = queryset.model._meta.get_field(field_name)
+        descending = self.ordering.startswith('-')
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor['reverse'] if cursor else False
+
+        # walking backwards just flips the direction, then we un-flip the rows
+        scan_descending = descending != reverse
+        prefix = '-' if scan_descending else ''
+        queryset = queryset.order_by(f'{prefix}{field_name}', f'{prefix}pk')
+
+        if cursor:
+            lookup = 'lt' if scan_descending else 'gt'
+            value, pk = cursor['value'], cursor['pk']
+            queryset = queryset.filter(
+                Q(**{f'{field_name}__{lookup}': value})
+                | Q(**{field_name: value, f'pk__{lookup}': pk})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            self.has_next = cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = rows
+        return rows
+
+    def get_ordering(self, queryset, view):
+        allowed = self.ordering_fields or getattr(view, 'ordering_fields', None) or []
+        for term in queryset.query.order_by:
+            if isinstance(term, str) and term.lstrip('-') in allowed:
+                return term
+            break
+        return self.default_ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if data['o'] != self.ordering:
+                raise ValueError('cursor was made for a different ordering')
+            return {
+                'value': self.field.to_python(data['v']),
+                'pk': int(data['pk']),
+                'reverse': bool(data.get('r')),
+            }
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse=False):
+        if isinstance(instance, dict):
+            # .values() rows, the view has to include the field and pk
+            value, pk = instance[self.field.attname], instance['pk']
+        else:
+            value, pk = getattr(instance, self.field.attname), instance.pk
+        data = {
+            'o': self.ordering,
+            'v': value.isoformat() if hasattr(value, 'isoformat') else str(value),
+            'pk': pk,
+        }
+        if reverse:
+            data['r'] = 1
+        encoded = b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded.decode('ascii')
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class HybridPagination(CachedCountPagination):
+    """
+    Page numbers by default, keyset cursors when the client asks for them
+    with ?pagination=cursor (the next/previous links carry ?cursor= after that).
+    """
+    mode_query_param = 'pagination'
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.keyset_class.cursor_query_param in request.query_params
+        ):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
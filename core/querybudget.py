@@ -0,0 +1,166 @@
+"""
+Query budgets - the most SQL queries an endpoint is allowed per request.
+
+BUDGETS below is the table, keyed by the same view labels as the metrics
+(ProductViewSet.list, OrderViewSet.cancel, ...). MetricsMiddleware already
+sees every query, so it checks the request against its budget at the end:
+
+  - normally it logs a warning with the fingerprints of the queries that
+    ran (literals and IN lists collapsed), so the N+1 stands out as
+    '25x SELECT ... FROM products_productimage WHERE ... = %s'
+  - with QUERY_BUDGETS_STRICT on (the test suites turn it on) it raises
+    QueryBudgetExceeded instead, which fails the test
+
+Budgets are per request and dont depend on how many rows come back. To
+catch an endpoint whose count grows with the result set use
+QueryBudgetMixin.assertQueriesConstant() in a test.
+
+query_budget() does the same check around any block of code:
+
+    with query_budget(4):
+        ...
+
+    @query_budget(label='PlaceOrderView.post')
+    def test_place_order(self):
+        ...
+
+Endpoints missing from the table aren't checked.
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# counted with JWT auth (one query for the user) and an empty cache, so
+# anonymous and cached requests come in under. writes include the
+# savepoint + release. imports run in the background so their create
+# isnt here, neither is the export, which streams after the middleware
+BUDGETS = {
+    'TokenObtainPairView.post': 2,
+    'RegisterView.post': 3,
+    'ProfileView.get': 1,
+    'ProfileView.patch': 2,
+    'ProfileView.put': 2,
+
+    'CategoryViewSet.list': 4,
+    'CategoryViewSet.retrieve': 3,
+    'CategoryViewSet.create': 10,
+    'CategoryViewSet.update': 7,
+    'CategoryViewSet.partial_update': 7,
+    'CategoryViewSet.destroy': 8,
+
+    'ProductViewSet.list': 4,
+    'ProductViewSet.retrieve': 6,
+    'ProductViewSet.reviews': 4,
+    'ProductViewSet.create': 12,
+    'ProductViewSet.update': 10,
+    'ProductViewSet.partial_update': 10,
+    'ProductViewSet.destroy': 12,
+    'ReviewCreateView.post': 8,
+    'ProductImportViewSet.list': 2,
+    'ProductImportViewSet.retrieve': 2,
+
+    'PlaceOrderView.post': 9,
+    'OrderViewSet.list': 4,
+    'OrderViewSet.retrieve': 3,
+    'OrderViewSet.cancel': 12,
+}
+
+_IN_LIST = re.compile(r'\bIN \((?:%s|\?)(?:, ?(?:%s|\?))*\)', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """The query with its values taken out, so repeats group together."""
+    sql = _STRING.sub('%s', sql)
+    sql = _NUMBER.sub('%s', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def describe(label, queries, budget, limit=10):
+    counts = Counter(fingerprint(sql) for sql in queries).most_common(limit)
+    lines = [f'{label} ran {len(queries)} queries, budget is {budget}:']
+    lines.extend(f'  {n}x {sql[:300]}' for sql, n in counts)
+    return '\n'.join(lines)
+
+
+def check(label, queries, budget=None, strict=None):
+    """Warn (or raise, in strict mode) if `queries` is over the budget."""
+    if budget is None:
+        budget = BUDGETS.get(label)
+    if budget is None or len(queries) <= budget:
+        return True
+    if strict is None:
+        strict = getattr(settings, 'QUERY_BUDGETS_STRICT', False)
+    message = describe(label, queries, budget)
+    if strict:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+    return False
+
+
+class query_budget(ContextDecorator):
+    """
+    Check the queries run inside a block against a budget, given directly
+    or looked up in BUDGETS by label. Raises unless strict=False.
+    """
+
+    def __init__(self, budget=None, label=None, strict=True, using=None):
+        if budget is None and label not in BUDGETS:
+            raise ValueError(f'No budget given and none in the table for {label!r}')
+        self.budget = BUDGETS[label] if budget is None else budget
+        self.label = label or 'block'
+        self.strict = strict
+        self.using = using
+
+    def _record(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries = []
+        aliases = [self.using] if self.using else list(connections)
+        self._stack = ExitStack()
+        for alias in aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stack.close()
+        if exc_type is None:
+            check(self.label, self.queries, self.budget, self.strict)
+        return False
+
+
+class QueryBudgetMixin:
+    """TestCase helpers on top of the budget table."""
+
+    def assertQueriesConstant(self, request, grow, using='default'):
+        """
+        Call request(), then grow() to add rows to what it returns, then
+        request() again - the second call can't run more queries.
+        """
+        from django.test.utils import CaptureQueriesContext  # not on the request path
+
+        with CaptureQueriesContext(connections[using]) as small:
+            request()
+        grow()
+        with CaptureQueriesContext(connections[using]) as large:
+            request()
+        if len(large) > len(small):
+            self.fail(
+                f'Queries grew with the result set, {len(small)} -> {len(large)}\n'
+                + describe('after', [q['sql'] for q in large.captured_queries], len(small))
+            )
@@ -38,9 +38,17 @@ INSTALLED_APPS = [
     'orders',
 ]
 
+# the benchmark suite (run_benchmarks, bench_concurrency) creates and drops
+# its own data, so it only comes with DEBUG or when asked for
+if DEBUG or os.getenv('BENCHMARKS', 'False').lower() in ('true', '1', 'yes'):
+    INSTALLED_APPS.append('benchmarks')
+
 MIDDLEWARE = [
+    # first, so its timings cover everything below
+    'core.metrics.MetricsMiddleware',
+    'core.db_router.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.staticfiles.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,20 +80,27 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 
 # Database
-DATABASE_URL = os.getenv('DATABASE_URL')
-if DATABASE_URL:
+def _postgres_from_url(url):
     import urllib.parse
-    _parsed = urllib.parse.urlparse(DATABASE_URL)
-    DATABASES = {
-        'default': {
-            'ENGINE': 'django.db.backends.postgresql',
-            'NAME': _parsed.path[1:],
-            'USER': _parsed.username,
-            'PASSWORD': _parsed.password,
-            'HOST': _parsed.hostname,
-            'PORT': _parsed.port or 5432,
-        }
+    parsed = urllib.parse.urlparse(url)
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': parsed.path[1:],
+        'USER': parsed.username,
+        'PASSWORD': parsed.password,
+        'HOST': parsed.hostname,
+        'PORT': parsed.port or 5432,
     }
+
+
+def _env_list(name):
+    return [item.strip() for item in os.getenv(name, '').split(',') if item.strip()]
+
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+if DATABASE_URL:
+    DATABASES = {'default': _postgres_from_url(DATABASE_URL)}
+    _replicas = [_postgres_from_url(url) for url in _env_list('DATABASE_REPLICA_URLS')]
 elif os.getenv('DB_HOST'):
     DATABASES = {
         'default': {
@@ -97,6 +112,10 @@ elif os.getenv('DB_HOST'):
             'PORT': os.getenv('DB_PORT', '5432'),
         }
     }
+    # same database and credentials, streaming replicas of the primary
+    _replicas = [
+        {**DATABASES['default'], 'HOST': host} for host in _env_list('DB_REPLICA_HOSTS')
+    ]
 else:
     DATABASES = {
         'default': {
@@ -104,7 +123,32 @@ else:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
-
+    _replicas = []
+
+# safe-method catalog and order history reads go to a replica, everything
+# else (and a user's reads for a while after they write) to the primary,
+# see core/db_router.py. tests run the replicas against the test database
+DATABASE_REPLICAS = []
+for _number, _replica in enumerate(_replicas, start=1):
+    DATABASES[f'replica_{_number}'] = {**_replica, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{_number}')
+
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+
+# how long after a write the user's reads stay on the primary, should be
+# well over the replication lag
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+# keep connections open between requests instead of connecting every time,
+# checked before reuse so a restarted database or a failed over replica
+# doesnt error the next request. under ASGI every request gets a fresh
+# thread and a persistent connection is never reused, just left open -
+# core/asgi.py makes the default 0 there, pgbouncer in front of postgres
+# does the pooling
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+for _database in DATABASES.values():
+    _database['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+    _database['CONN_HEALTH_CHECKS'] = True
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -124,14 +168,19 @@ STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# bulk import uploads, the celery worker has to see the same directory
+MEDIA_URL = 'media/'
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 # ---- REST Framework config ----
 
 REST_FRAMEWORK = {
+    # JWTAuthentication with the user cached (accounts/cache.py)
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -143,13 +192,17 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 12,
+    # sliding window counters, atomic in redis (core/throttling.py)
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'core.throttling.AnonThrottle',
+        'core.throttling.UserThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '50/hour',
         'user': '200/hour',
+        # endpoints with their own budget, separate from browsing
+        'export': '30/hour',
+        'place_order': '30/hour',
     },
 }
 
@@ -161,6 +214,10 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# how long an authenticated user stays cached, saves to the user drop it
+# straight away (accounts/cache.py)
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 60 * 5))
+
 # CORS - wide open for local dev, tighten in production
 CORS_ALLOWED_ORIGINS = os.getenv(
     'CORS_ALLOWED_ORIGINS',
@@ -184,7 +241,8 @@ _redis_url = os.getenv('REDIS_URL')
 if _redis_url:
     CACHES = {
         'default': {
-            'BACKEND': 'django_redis.cache.RedisCache',
+            # django_redis.cache.RedisCache + hit/miss/time metrics
+            'BACKEND': 'core.cache_backends.InstrumentedRedisCache',
             'LOCATION': _redis_url,
             'OPTIONS': {
                 'CLIENT_CLASS': 'django_redis.client.DefaultClient',
@@ -195,10 +253,31 @@ if _redis_url:
 else:
     CACHES = {
         'default': {
-            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'BACKEND': 'core.cache_backends.InstrumentedLocMemCache',
         }
     }
 
+# catalog list responses are invalidated by version bumps on write
+# (products/cache.py), so they can live a lot longer than a plain TTL cache
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 60 * 6))
+
+# without postgres search ranks this many matches at most (one CASE branch
+# per row), a broader query says so with search_limit in the product list
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 1000))
+
+# product list/detail responses go through core/compiled.py instead of the
+# DRF field machinery (same output). off switch in case something looks off
+COMPILED_SERIALIZERS = os.getenv('COMPILED_SERIALIZERS', 'True') == 'True'
+
+# request metrics (core/metrics.py). each process pushes its numbers to the
+# cache this often, /metrics needs staff or Authorization: Bearer <token>
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 15))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# requests over their query budget (core/querybudget.py) log a warning,
+# strict mode raises instead. the test suites switch it on
+QUERY_BUDGETS_STRICT = os.getenv('QUERY_BUDGETS_STRICT', 'False') == 'True'
+
 
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
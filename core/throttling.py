@@ -0,0 +1,238 @@
+"""
+Sliding window rate limits, in place of DRF's Anon/User/ScopedRateThrottle.
+
+DRF's throttles keep every request's timestamp per client and read, trim
+and rewrite that list on each request - 200 floats at 200/hour, and two
+requests at once can both read the old list. Here a client has a counter
+per fixed window and the limit applies to
+
+    previous window's count * (share of it still inside the sliding window)
+        + this window's count
+
+so the state is two integers, and the check and increment happen together:
+
+  redis      one lua script per request (all the throttles at once), atomic
+             across every worker
+  otherwise  the same steps on the default cache behind a process lock -
+             the local stand-in for tests and single process dev
+
+Requests that are turned down dont count. Same rates, scopes and idents as
+DRF (DEFAULT_THROTTLE_RATES, throttle_scope, X-Forwarded-For/REMOTE_ADDR).
+The views take BatchThrottleMixin, so a request checks all of its throttles
+in one round trip.
+"""
+import threading
+from collections import namedtuple
+
+from django.core.cache import caches
+from django_redis.cache import RedisCache
+from rest_framework.throttling import SimpleRateThrottle
+
+# expiry in milliseconds, two windows so the previous count is still there
+Window = namedtuple('Window', 'current previous limit weight expiry')
+
+SCRIPT = """
+local results = {}
+for i = 1, #KEYS / 2 do
+    local limit = tonumber(ARGV[3 * i - 2])
+    local weight = tonumber(ARGV[3 * i - 1])
+    local current = tonumber(redis.call('GET', KEYS[2 * i - 1]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[2 * i]) or '0')
+    local allowed = 0
+    if previous * weight + current + 1 <= limit then
+        allowed = 1
+        current = redis.call('INCR', KEYS[2 * i - 1])
+        if current == 1 then
+            redis.call('PEXPIRE', KEYS[2 * i - 1], ARGV[3 * i])
+        end
+    end
+    results[i] = {allowed, current, previous}
+end
+return results
+"""
+
+
+class LocalBackend:
+    """SCRIPT on the default cache, atomic within the process."""
+    lock = threading.Lock()
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def hit_many(self, windows):
+        """[(allowed, current count, previous count)] for windows."""
+        with self.lock:
+            keys = [key for window in windows for key in (window.current, window.previous)]
+            counts = self.cache.get_many(keys)
+            results = []
+            for window in windows:
+                current = counts.get(window.current, 0)
+                previous = counts.get(window.previous, 0)
+                allowed = previous * window.weight + current + 1 <= window.limit
+                if allowed:
+                    current += 1
+                    counts[window.current] = current
+                    self._incr(window, current)
+                results.append((allowed, current, previous))
+            return results
+
+    def _incr(self, window, current):
+        if current > 1:
+            try:
+                self.cache.incr(window.current)
+                return
+            except ValueError:
+                pass  # expired since get_many, start it again
+        self.cache.set(window.current, current, window.expiry / 1000)
+
+
+class RedisBackend:
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def hit_many(self, windows):
+        client = self.cache.client.get_client(write=True)
+        keys, args = [], []
+        for window in windows:
+            keys += [self.cache.make_key(window.current), self.cache.make_key(window.previous)]
+            args += [window.limit, repr(window.weight), int(window.expiry)]
+        results = client.register_script(SCRIPT)(keys=keys, args=args)
+        return [(bool(allowed), current, previous) for allowed, current, previous in results]
+
+
+def get_backend():
+    cache = caches['default']
+    if isinstance(cache, RedisCache):
+        return RedisBackend(cache)
+    return LocalBackend(cache)
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle with a sliding window counter, subclasses pick the
+    scope and get_cache_key like DRF's.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def prepare(self, request, view):
+        """Work out self.window for this request, False if not throttled."""
+        self.window = None
+        if self.rate is None:
+            return False
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return False
+        self.now = self.timer()
+        index, self.offset = divmod(self.now, self.duration)
+        self.window = Window(
+            current=f'{self.key}:{int(index)}',
+            previous=f'{self.key}:{int(index) - 1}',
+            limit=self.num_requests,
+            weight=1 - self.offset / self.duration,
+            expiry=(2 * self.duration - self.offset) * 1000,
+        )
+        return True
+
+    def finish(self, result):
+        allowed, self.current, self.previous = result
+        return allowed
+
+    def allow_request(self, request, view):
+        return not throttled([self], request, view)
+
+    def wait(self):
+        """Seconds until the next request would be let through."""
+        limit, remaining = self.num_requests, self.duration - self.offset
+        if limit == 0:
+            return self.duration
+        if self.current + 1 > limit:
+            # this window alone is full, wait for it to become the previous
+            # one and slide far enough past it
+            return remaining + self.duration * (1 - (limit - 1) / self.current)
+        share = (limit - 1 - self.current) / self.previous
+        return max(0, (1 - share) * self.duration - self.offset)
+
+
+class AnonThrottle(SlidingWindowThrottle):
+    """AnonRateThrottle: anonymous clients by address."""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserThrottle(SlidingWindowThrottle):
+    """UserRateThrottle: users by id, anonymous clients by address."""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class ScopedThrottle(UserThrottle):
+    """
+    ScopedRateThrottle: the view's throttle_scope rate, for endpoints with
+    their own budget (throttle_classes = [ScopedThrottle] replaces the
+    browsing one).
+    """
+    scope_attr = 'throttle_scope'
+
+    def __init__(self):
+        # the scope and rate come from the view
+        self.rate = None
+
+    def prepare(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return False
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().prepare(request, view)
+
+
+def _split(throttles, request, view):
+    windowed = [t for t in throttles if isinstance(t, SlidingWindowThrottle)]
+    others = [t for t in throttles if not isinstance(t, SlidingWindowThrottle)]
+    pending = [t for t in windowed if t.prepare(request, view)]
+    denied = [t for t in others if not t.allow_request(request, view)]
+    return pending, denied
+
+
+def throttled(throttles, request, view):
+    """The throttles that turn the request down, one backend call for all."""
+    pending, denied = _split(throttles, request, view)
+    if pending:
+        results = get_backend().hit_many([t.window for t in pending])
+        denied += [t for t, result in zip(pending, results) if not t.finish(result)]
+    return denied
+
+
+class BatchThrottleMixin:
+    """
+    For APIViews: DRF's check_throttles() asks each throttle in turn, this
+    checks them all with one backend call.
+    """
+
+    def check_throttles(self, request):
+        denied = throttled(self.get_throttles(), request, self)
+        if denied:
+            durations = [d for d in (t.wait() for t in denied) if d is not None]
+            self.throttled(request, max(durations, default=None))
+
+
+def reset(scope, ident):
+    """Forget a client's count for scope, eg between benchmark runs."""
+    rate = SimpleRateThrottle.THROTTLE_RATES.get(scope)
+    if rate is None:
+        return
+    _, duration = ScopedThrottle().parse_rate(rate)
+    key = SlidingWindowThrottle.cache_format % {'scope': scope, 'ident': ident}
+    index = int(SimpleRateThrottle.timer() // duration)
+    caches['default'].delete_many([f'{key}:{index}', f'{key}:{index - 1}'])
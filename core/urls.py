@@ -4,6 +4,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from .metrics import MetricsView
+
 schema_view = get_schema_view(
     openapi.Info(
         title="E-Commerce API",
@@ -25,6 +27,9 @@ urlpatterns = [
     path('api/v1/', include('products.urls')),
     path('api/v1/', include('orders.urls')),
 
+    # prometheus scrape target, see core/metrics.py
+    path('metrics', MetricsView.as_view(), name='metrics'),
+
     # docs
     path('api/docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('api/redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
@@ -0,0 +1,52 @@
+"""
+Set-based order cancellation, shared by the cancel endpoint and the
+stale order cleanup task.
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from products.inventory import increment_stock, lock_products
+from .models import Order, OrderItem
+
+
+def cancel_orders(order_ids):
+    """
+    Cancel the given (already locked, still pending) orders and put their
+    stock back: one query to total the quantities per product, one to lock
+    those products in pk order, one UPDATE for the stock and one for the
+    statuses - however many orders and items there are.
+    """
+    restock = dict(
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .order_by()
+        .values('product_id')
+        .annotate(quantity=Sum('quantity'))
+        .values_list('product_id', 'quantity')
+    )
+    if restock:
+        # same lock order as order placement, so the two cant deadlock
+        lock_products(list(restock))
+        increment_stock(restock)
+
+    return Order.objects.filter(pk__in=order_ids).update(
+        status='cancelled', updated_at=timezone.now(),
+    )
+
+
+def cancel_stale_chunk(cutoff, chunk_size):
+    """
+    Claim up to chunk_size stale pending orders and cancel them in one
+    transaction. SKIP LOCKED means several workers can run this at the same
+    time and each gets a different chunk. Returns how many were cancelled.
+    """
+    with transaction.atomic():
+        order_ids = list(
+            Order.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', created_at__lt=cutoff)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not order_ids:
+            return 0
+        return cancel_orders(order_ids)
@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from django.db import transaction
 from .models import Order, OrderItem
+from products.inventory import (
+    claim_from_buckets, decrement_stock, lock_products, merge_quantities,
+)
 from products.models import Product
 
 
@@ -41,23 +44,24 @@ class OrderSerializer(serializers.ModelSerializer):
 class PlaceOrderSerializer(serializers.Serializer):
     """
     Validates stock, creates order + items, decrements inventory.
+
+    Query count doesnt depend on the number of lines: one read to validate,
+    then one locking SELECT (in pk order), one guarded UPDATE for the stock
+    and one INSERT each for the order and its items. Bucketed (hot) products
+    skip the product row lock and claim from their stock buckets instead,
+    see products/inventory.py.
     """
     shipping_address = serializers.CharField()
     notes = serializers.CharField(required=False, default='')
     items = OrderItemCreateSerializer(many=True)
 
-    def validate_items(self, value):
-        if not value:
-            raise serializers.ValidationError(
-                "Order must have at least one item."
-            )
-
-        for item in value:
-            try:
-                product = Product.objects.get(id=item['product_id'])
-            except Product.DoesNotExist:
+    @staticmethod
+    def _check_products(quantities, products):
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
                 raise serializers.ValidationError(
-                    f"Product {item['product_id']} not found."
+                    f"Product {product_id} not found."
                 )
 
             if not product.is_active:
@@ -65,49 +69,88 @@ class PlaceOrderSerializer(serializers.Serializer):
                     f"'{product.name}' is currently unavailable."
                 )
 
-            if product.stock_quantity < item['quantity']:
+            if product.available_stock < quantity:
                 raise serializers.ValidationError(
                     f"Not enough stock for '{product.name}'. "
-                    f"Available: {product.stock_quantity}, "
-                    f"requested: {item['quantity']}"
+                    f"Available: {product.available_stock}, "
+                    f"requested: {quantity}"
                 )
 
+    def validate_items(self, value):
+        if not value:
+            raise serializers.ValidationError(
+                "Order must have at least one item."
+            )
+
         return value
 
+    @classmethod
+    def _load_products(cls, quantities):
+        products = Product.objects.with_available_stock().in_bulk(list(quantities))
+        cls._check_products(quantities, products)
+        return products
+
+    def validate(self, attrs):
+        try:
+            products = self._load_products(merge_quantities(attrs['items']))
+        except serializers.ValidationError as e:
+            raise serializers.ValidationError({'items': e.detail})
+        # handed to create() with the rest of validated_data, so it doesnt
+        # have to read them again
+        attrs['products'] = products
+        return attrs
+
     def create(self, validated_data):
         user = self.context['request'].user
         items_data = validated_data.pop('items')
+        quantities = merge_quantities(items_data)
+        products = validated_data.pop('products', None)
+        if products is None:
+            products = self._load_products(quantities)
+        products = dict(products)
 
-        # lock rows so two orders cant oversell the same product
         with transaction.atomic():
-            order = Order.objects.create(
-                user=user,
-                shipping_address=validated_data['shipping_address'],
-                notes=validated_data.get('notes', ''),
-            )
-
-            for item_data in items_data:
-                product = Product.objects.select_for_update().get(
-                    id=item_data['product_id']
+            # lock rows so two orders cant oversell the same product, always
+            # in pk order so concurrent carts cant deadlock each other
+            plain_ids = [pk for pk in quantities if not products[pk].bucket_count]
+            locked = {p.pk: p for p in lock_products(plain_ids)}
+            products.update(locked)
+            plain = {
+                pk: quantities[pk] for pk, p in locked.items() if not p.bucket_count
+            }
+
+            # double check stock now that we have the lock
+            self._check_products(plain, products)
+
+            if not decrement_stock(plain):
+                raise serializers.ValidationError(
+                    "Not enough stock for one of the products."
                 )
 
-                # double check stock now that we have the lock
-                if product.stock_quantity < item_data['quantity']:
+            # pk order here too - a bucket row held by one cart while the
+            # other locks all of that product's buckets would deadlock
+            for pk in sorted(quantities):
+                if pk not in plain and not claim_from_buckets(pk, quantities[pk]):
                     raise serializers.ValidationError(
-                        f"Not enough stock for '{product.name}'. "
-                        f"Available: {product.stock_quantity}"
+                        f"Not enough stock for '{products[pk].name}'."
                     )
 
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    product_name=product.name,
-                    product_price=product.price,
-                    quantity=item_data['quantity'],
+            order_items = [
+                OrderItem(
+                    product=products[item['product_id']],
+                    product_name=products[item['product_id']].name,
+                    product_price=products[item['product_id']].price,
+                    quantity=item['quantity'],
                 )
-
-                product.stock_quantity -= item_data['quantity']
-                product.save(update_fields=['stock_quantity'])
-
-            order.calculate_total()
+                for item in items_data
+            ]
+            order = Order.objects.create(
+                user=user,
+                shipping_address=validated_data['shipping_address'],
+                notes=validated_data.get('notes', ''),
+                total_amount=sum(item.subtotal for item in order_items),
+            )
+            for item in order_items:
+                item.order = order
+            OrderItem.objects.bulk_create(order_items)
         return order
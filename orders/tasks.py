@@ -28,29 +28,42 @@ def send_order_confirmation(order_id):
 
 
 @shared_task
-def cancel_stale_orders():
+def cancel_stale_orders(hours=24, chunk_size=500, max_chunks=None):
     """
     Auto-cancel orders stuck in pending for over 24 hours.
     Designed to run on a schedule via celery beat.
+
+    Works through the backlog in chunks of chunk_size orders, one
+    transaction per chunk. Chunks are claimed with SKIP LOCKED, so after a
+    big outage you can just queue this a few times and the workers will
+    split the backlog between them.
     """
+    import time
     from django.utils import timezone
-    from django.db import transaction
     from datetime import timedelta
-    from .models import Order
+    from .cancellation import cancel_stale_chunk
 
-    cutoff = timezone.now() - timedelta(hours=24)
-    stale = Order.objects.filter(status='pending', created_at__lt=cutoff)
+    cutoff = timezone.now() - timedelta(hours=hours)
+    started = time.monotonic()
 
     count = 0
-    for order in stale:
-        with transaction.atomic():
-            for item in order.items.select_related('product').all():
-                if item.product:
-                    item.product.stock_quantity += item.quantity
-                    item.product.save(update_fields=['stock_quantity'])
-            order.status = 'cancelled'
-            order.save(update_fields=['status'])
-            count += 1
-
-    logger.info(f"Cancelled {count} stale orders")
-    return f"Cancelled {count} stale orders"
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        cancelled = cancel_stale_chunk(cutoff, chunk_size)
+        if not cancelled:
+            break
+        count += cancelled
+        chunks += 1
+
+    elapsed = time.monotonic() - started
+    rate = count / elapsed if elapsed else 0.0
+    logger.info(
+        f"Cancelled {count} stale orders in {chunks} chunks, "
+        f"{elapsed:.2f}s ({rate:.0f} orders/s)"
+    )
+    return {
+        'cancelled': count,
+        'chunks': chunks,
+        'seconds': round(elapsed, 3),
+        'orders_per_second': round(rate, 1),
+    }
@@ -1,14 +1,33 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework_simplejwt.tokens import RefreshToken
+from core.db_router import PrimaryReplicaRouter, ReadState, pin_key, read_database
+from core.querybudget import QueryBudgetMixin, query_budget
+from core.throttling import LocalBackend, ScopedThrottle, SlidingWindowThrottle, UserThrottle, throttled
+from products.inventory import set_bucket_count
 from products.models import Category, Product
-from .models import Order
+from .models import Order, OrderItem
+from .serializers import PlaceOrderSerializer
+from .tasks import cancel_stale_orders
 
 User = get_user_model()
 
 
-class OrderTests(TestCase):
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class OrderTests(QueryBudgetMixin, TestCase):
 
     def setUp(self):
         self.client = APIClient()
@@ -37,7 +56,8 @@ class OrderTests(TestCase):
         }, format='json')
 
     def test_place_order(self):
-        resp = self._place_order()
+        with query_budget(label='PlaceOrderView.post'):
+            resp = self._place_order()
         self.assertEqual(resp.status_code, 201)
         self.assertEqual(Order.objects.count(), 1)
 
@@ -49,6 +69,25 @@ class OrderTests(TestCase):
         # 49.99 * 2 = 99.98
         self.assertEqual(float(resp.data['total_amount']), 99.98)
 
+    def test_create_without_is_valid(self):
+        # validated_data from somewhere else, the products are read here
+        request = RequestFactory().post('/api/v1/orders/place/')
+        request.user = self.buyer
+        serializer = PlaceOrderSerializer(context={'request': request})
+        order = serializer.create({
+            'shipping_address': '123 Test St',
+            'items': [{'product_id': self.product.id, 'quantity': 3}],
+        })
+        self.assertEqual(order.items.get().quantity, 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 7)
+
+        with self.assertRaises(ValidationError):
+            serializer.create({
+                'shipping_address': '123 Test St',
+                'items': [{'product_id': self.product.id, 'quantity': 999}],
+            })
+
     def test_not_enough_stock(self):
         self.client.force_authenticate(user=self.buyer)
         resp = self.client.post('/api/v1/orders/place/', {
@@ -84,3 +123,304 @@ class OrderTests(TestCase):
             'items': [{'product_id': self.product.id, 'quantity': 1}],
         }, format='json')
         self.assertEqual(resp.status_code, 401)
+
+    def test_order_queries_dont_grow_with_cart_size(self):
+        products = [
+            Product.objects.create(
+                name=f'Cable {i}', description='cable', price='5.00',
+                sku=f'CB-{i}', stock_quantity=10,
+                category=self.product.category, seller=self.seller,
+            )
+            for i in range(10)
+        ]
+        self.client.force_authenticate(user=self.buyer)
+
+        def place(items):
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.post('/api/v1/orders/place/', {
+                    'shipping_address': '123 Test St',
+                    'items': items,
+                }, format='json')
+            self.assertEqual(resp.status_code, 201)
+            return len(ctx.captured_queries)
+
+        one = place([{'product_id': products[0].id, 'quantity': 1}])
+        ten = place([{'product_id': p.id, 'quantity': 2} for p in products])
+        self.assertEqual(one, ten)
+
+        order = Order.objects.first()
+        self.assertEqual(order.items.count(), 10)
+        self.assertEqual(float(order.total_amount), 100.0)
+        products[5].refresh_from_db()
+        self.assertEqual(products[5].stock_quantity, 8)
+
+    def test_order_list_queries_dont_grow(self):
+        def add_order():
+            # straight to the db, placing through the api waits on celery
+            order = Order.objects.create(
+                user=self.buyer, shipping_address='123 Test St', total_amount='49.99',
+            )
+            OrderItem.objects.create(
+                order=order, product=self.product, product_name=self.product.name,
+                product_price=self.product.price, quantity=1,
+            )
+
+        add_order()
+        self.client.force_authenticate(user=self.buyer)
+        self.assertQueriesConstant(
+            lambda: self.client.get('/api/v1/orders/'),
+            lambda: [add_order() for _ in range(3)],
+        )
+
+    def test_duplicate_lines_share_the_stock_check(self):
+        self.client.force_authenticate(user=self.buyer)
+        resp = self.client.post('/api/v1/orders/place/', {
+            'shipping_address': '123 Test St',
+            'items': [
+                {'product_id': self.product.id, 'quantity': 6},
+                {'product_id': self.product.id, 'quantity': 6},
+            ],
+        }, format='json')
+        self.assertEqual(resp.status_code, 400)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+
+    def test_cancel_stale_orders_in_chunks(self):
+        for _ in range(3):
+            self._place_order()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 4)
+
+        Order.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        result = cancel_stale_orders(chunk_size=2)
+
+        self.assertEqual(result['cancelled'], 3)
+        self.assertEqual(result['chunks'], 2)
+        self.assertFalse(Order.objects.filter(status='pending').exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+
+    def test_bucketed_stock_never_oversells(self):
+        set_bucket_count(self.product, 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 10)
+
+        self.assertEqual(self._place_order().status_code, 201)
+        self.client.force_authenticate(user=self.buyer)
+        # 8 left but no single bucket has 8, has to take from several
+        resp = self.client.post('/api/v1/orders/place/', {
+            'shipping_address': '123 Test St',
+            'items': [{'product_id': self.product.id, 'quantity': 8}],
+        }, format='json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(self._place_order().status_code, 400)
+
+        self.client.logout()
+        resp = self.client.get('/api/v1/products/?in_stock=false')
+        self.assertEqual(len(resp.data['results']), 1)
+        self.assertFalse(resp.data['results'][0]['in_stock'])
+
+        self.client.force_authenticate(user=self.buyer)
+        order = Order.objects.filter(status='pending').first()
+        self.client.post(f'/api/v1/orders/{order.id}/cancel/')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 8)
+        self.assertEqual(self.product.buckets.count(), 4)
+
+
+    def test_buckets_are_claimed_in_pk_order(self):
+        other = Product.objects.create(
+            name='Cable', description='usb', price='5.00', sku='CB-1', stock_quantity=10,
+            category=self.product.category, seller=self.seller,
+        )
+        set_bucket_count(self.product, 2)
+        set_bucket_count(other, 2)
+
+        self.client.force_authenticate(user=self.buyer)
+        with patch('orders.serializers.claim_from_buckets', return_value=True) as claim:
+            self.client.post('/api/v1/orders/place/', {
+                'shipping_address': '123 Test St',
+                'items': [{'product_id': other.id, 'quantity': 1},
+                          {'product_id': self.product.id, 'quantity': 1}],
+            }, format='json')
+        self.assertEqual([c.args[0] for c in claim.call_args_list], [self.product.id, other.id])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """Which database a request's reads go to, see core/db_router.py."""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.buyer = User.objects.create_user(
+            email='buyer@test.com', username='buyer', password='Pass123!',
+        )
+        self.other = User.objects.create_user(
+            email='other@test.com', username='other', password='Pass123!',
+        )
+        seller = User.objects.create_user(
+            email='seller@test.com', username='seller',
+            password='Pass123!', is_seller=True,
+        )
+        self.product = Product.objects.create(
+            name='Bluetooth Speaker', price='49.99', sku='BS-001',
+            stock_quantity=10, seller=seller,
+        )
+
+    def _reads_from(self, method, path, user=None, **extra):
+        if user is not None:
+            extra['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        request = getattr(self.factory, method)(path, **extra)
+        request.resolver_match = resolve(path)
+        return read_database(ReadState(request))
+
+    def test_catalog_and_order_history_reads_use_a_replica(self):
+        self.assertEqual(self._reads_from('get', '/api/v1/products/'), 'replica')
+        self.assertEqual(self._reads_from('get', '/api/v1/categories/'), 'replica')
+        self.assertEqual(self._reads_from('get', '/api/v1/orders/', self.buyer), 'replica')
+        self.assertEqual(
+            self._reads_from('get', f'/api/v1/products/{self.product.slug}/reviews/'), 'replica'
+        )
+
+    def test_everything_else_uses_the_primary(self):
+        self.assertEqual(self._reads_from('post', '/api/v1/orders/place/', self.buyer), 'default')
+        self.assertEqual(self._reads_from('post', '/api/v1/orders/1/cancel/', self.buyer), 'default')
+        self.assertEqual(self._reads_from('get', '/api/v1/auth/profile/', self.buyer), 'default')
+        # a browsable api session, cant check the pin without a query
+        self.assertEqual(
+            self._reads_from('get', '/api/v1/orders/', HTTP_COOKIE='sessionid=abc'), 'default'
+        )
+
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Order), 'default')  # outside a request
+        self.assertEqual(router.db_for_write(Order), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'orders'))
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        client = APIClient()
+        client.force_authenticate(user=self.buyer)
+        # the replica is the test database itself here, the requests run
+        with override_settings(DATABASE_REPLICAS=['default']):
+            resp = client.post('/api/v1/orders/place/', {
+                'shipping_address': '123 Test St',
+                'items': [{'product_id': self.product.id, 'quantity': 1}],
+            }, format='json')
+            self.assertEqual(resp.status_code, 201)
+            # a failed write doesnt pin
+            client.force_authenticate(user=self.other)
+            resp = client.post('/api/v1/orders/place/', {
+                'shipping_address': '123 Test St',
+                'items': [{'product_id': self.product.id, 'quantity': 999}],
+            }, format='json')
+            self.assertEqual(resp.status_code, 400)
+
+        self.assertEqual(self._reads_from('get', '/api/v1/orders/', self.buyer), 'default')
+        self.assertEqual(self._reads_from('get', '/api/v1/products/', self.buyer), 'default')
+        self.assertEqual(self._reads_from('get', '/api/v1/orders/', self.other), 'replica')
+        self.assertEqual(self._reads_from('get', '/api/v1/products/'), 'replica')
+
+        # until the pin runs out
+        cache.delete(pin_key(self.buyer.pk))
+        self.assertEqual(self._reads_from('get', '/api/v1/orders/', self.buyer), 'replica')
+
+
+class ThrottleTests(TestCase):
+    """core/throttling.py, on the local stand-in."""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user(
+            email='buyer@test.com', username='buyer', password='Pass123!',
+        )
+        seller = User.objects.create_user(
+            email='seller@test.com', username='seller',
+            password='Pass123!', is_seller=True,
+        )
+        self.product = Product.objects.create(
+            name='Bluetooth Speaker', price='49.99', sku='BS-001',
+            stock_quantity=100, seller=seller,
+        )
+        self.request = RequestFactory().get('/api/v1/products/')
+        self.request.user = self.buyer
+        self.now = 7200.0  # the start of a minute and an hour window
+        clock = patch.object(SlidingWindowThrottle, 'timer', lambda _: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def _hits(self, count, rate='4/min'):
+        """How many of count requests get through, and the last wait."""
+        allowed, wait = 0, None
+        with patch.dict(UserThrottle.THROTTLE_RATES, {'user': rate}):
+            for _ in range(count):
+                denied = throttled([UserThrottle()], self.request, None)
+                if denied:
+                    wait = denied[0].wait()
+                else:
+                    allowed += 1
+        return allowed, wait
+
+    def test_sliding_window(self):
+        self.assertEqual(self._hits(6), (4, 75.0))
+        # half way through the next window half the last one still counts,
+        # the turned down requests didnt
+        self.now += 90
+        allowed, wait = self._hits(3)
+        self.assertEqual(allowed, 2)
+        self.assertAlmostEqual(wait, 15.0)
+        self.now += 15
+        self.assertEqual(self._hits(1)[0], 1)
+        # two windows on, nothing left over
+        self.now += 120
+        self.assertEqual(self._hits(5)[0], 4)
+
+    def test_concurrent_requests_dont_overshoot(self):
+        results = []
+
+        def hit():
+            results.append(self._hits(10, rate='25/min')[0])
+
+        with patch.dict(UserThrottle.THROTTLE_RATES, {'user': '25/min'}):
+            threads = [threading.Thread(target=hit) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sum(results), 25)
+
+    def test_expired_count_starts_again(self):
+        self.assertEqual(self._hits(2), (2, None))
+        # the key went between reading the counts and bumping them
+        with patch.object(cache, 'incr', side_effect=ValueError):
+            self.assertEqual(self._hits(1), (1, None))
+        self.assertEqual(self._hits(3), (1, 75.0))
+
+    def test_zero_rate_waits_the_whole_window(self):
+        self.assertEqual(self._hits(2, rate='0/min'), (0, 60))
+
+    def test_one_backend_call_per_request(self):
+        with patch.object(LocalBackend, 'hit_many', autospec=True, side_effect=LocalBackend.hit_many) as hits:
+            APIClient().get('/api/v1/products/')
+        # the anon and user windows, checked together
+        self.assertEqual(hits.call_count, 1)
+        self.assertEqual(len(hits.call_args.args[1]), 2)
+
+    def test_placing_orders_has_its_own_budget(self):
+        client = APIClient()
+        client.force_authenticate(user=self.buyer)
+        order = {
+            'shipping_address': '123 Test St',
+            'items': [{'product_id': self.product.id, 'quantity': 1}],
+        }
+        rates = {'user': '3/hour', 'place_order': '2/hour'}
+        with patch.dict(ScopedThrottle.THROTTLE_RATES, rates):
+            self.assertEqual(client.post('/api/v1/orders/place/', order, format='json').status_code, 201)
+            self.assertEqual(client.post('/api/v1/orders/place/', order, format='json').status_code, 201)
+            resp = client.post('/api/v1/orders/place/', order, format='json')
+            self.assertEqual(resp.status_code, 429)
+            self.assertEqual(resp['Retry-After'], '5400')
+
+            # browsing still has all of its budget
+            for _ in range(3):
+                self.assertEqual(client.get('/api/v1/orders/').status_code, 200)
+            self.assertEqual(client.get('/api/v1/orders/').status_code, 429)
@@ -3,6 +3,8 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db import transaction
 
+from core.throttling import BatchThrottleMixin, ScopedThrottle
+from .cancellation import cancel_orders
 from .models import Order
 from .serializers import OrderSerializer, PlaceOrderSerializer
 from .tasks import send_order_confirmation
@@ -10,45 +12,51 @@ from .tasks import send_order_confirmation
 
 class IsOrderOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user
+        return obj.user_id == request.user.pk
 
 
-class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+class OrderViewSet(BatchThrottleMixin, viewsets.ReadOnlyModelViewSet):
     """List + detail for the current user's orders."""
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated, IsOrderOwner]
+    # GETs can read from a replica, see core/db_router.py
+    replica_reads = True
 
     def get_queryset(self):
+        # items only show the product id, no need to load the products
         return Order.objects.filter(
             user=self.request.user
-        ).prefetch_related('items', 'items__product')
+        ).select_related('user').prefetch_related('items')
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         order = self.get_object()
 
-        if order.status != 'pending':
-            return Response(
-                {'detail': 'Only pending orders can be cancelled.'},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        # restore stock inside a transaction so nothing gets lost
+        # restore stock inside a transaction so nothing gets lost. the row
+        # lock stops this racing the stale order task for the same order
         with transaction.atomic():
-            for item in order.items.select_related('product').all():
-                if item.product:
-                    item.product.stock_quantity += item.quantity
-                    item.product.save(update_fields=['stock_quantity'])
+            status_now = Order.objects.select_for_update().filter(
+                pk=order.pk
+            ).values_list('status', flat=True).get()
+
+            if status_now != 'pending':
+                return Response(
+                    {'detail': 'Only pending orders can be cancelled.'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
 
-            order.status = 'cancelled'
-            order.save(update_fields=['status'])
+            cancel_orders([order.pk])
 
+        order.refresh_from_db(fields=['status', 'updated_at'])
         return Response(OrderSerializer(order).data)
 
 
-class PlaceOrderView(generics.CreateAPIView):
+class PlaceOrderView(BatchThrottleMixin, generics.CreateAPIView):
     serializer_class = PlaceOrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # its own budget, browsing doesnt use it up
+    throttle_classes = [ScopedThrottle]
+    throttle_scope = 'place_order'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, Review
+from .models import Category, Product, ProductImage, ProductImport, Review
 
 
 class ProductImageInline(admin.TabularInline):
@@ -9,22 +9,23 @@ class ProductImageInline(admin.TabularInline):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'parent', 'created_at']
+    list_display = ['name', 'parent', 'product_count', 'subtree_product_count', 'created_at']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
+    readonly_fields = ['path', 'depth', 'product_count', 'subtree_product_count']
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = [
-        'name', 'price', 'stock_quantity',
+        'name', 'price', 'stock_quantity', 'bucket_count',
         'category', 'seller', 'is_active', 'created_at'
     ]
     list_filter = ['is_active', 'category', 'created_at']
     search_fields = ['name', 'sku', 'description']
     prepopulated_fields = {'slug': ('name',)}
     inlines = [ProductImageInline]
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['bucket_count', 'created_at', 'updated_at']
 
 
 @admin.register(Review)
@@ -32,3 +33,17 @@ class ReviewAdmin(admin.ModelAdmin):
     list_display = ['product', 'user', 'rating', 'created_at']
     list_filter = ['rating']
     raw_id_fields = ['product', 'user']
+
+
+@admin.register(ProductImport)
+class ProductImportAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'seller', 'file_format', 'status', 'rows_processed',
+        'created_count', 'updated_count', 'error_count', 'created_at',
+    ]
+    list_filter = ['status', 'file_format']
+    raw_id_fields = ['seller']
+    readonly_fields = [
+        'status', 'file_size', 'bytes_read', 'rows_processed', 'created_count',
+        'updated_count', 'error_count', 'errors', 'error_report', 'message', 'finished_at',
+    ]
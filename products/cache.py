@@ -0,0 +1,206 @@
+"""
+Versioned cache for the catalog list endpoints.
+
+Every cached list response is keyed by the current version of the
+namespaces it depends on. Writes to Product, Category, ProductImage or
+Review bump those versions (signals for single saves/deletes,
+CatalogQuerySet for bulk writes), which orphans all the old entries at
+once - so the TTL can be long without ever serving stale data.
+
+The product detail cache (detail_cache.py) also has a version per product,
+so a write to one product only drops that product's entries. Bulk writes
+say which products they touch with CatalogQuerySet.touching(ids), a bulk
+write that doesnt bumps the DETAILS namespace and with it every detail.
+
+Users are in here for their names (seller_name, the review authors): a
+save that changes one of accounts.models.PUBLIC_FIELDS drops the lists and
+every detail. A queryset.update() of those fields has to call
+bump_for_model(User) itself.
+"""
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+DETAILS = 'product-details'
+
+# which namespaces a write to each model invalidates. products show the
+# category name and categories show product counts, so those two go together
+MODEL_NAMESPACES = {
+    'Product': (PRODUCTS, CATEGORIES, DETAILS),
+    'Category': (PRODUCTS, CATEGORIES, DETAILS),
+    'ProductImage': (PRODUCTS, DETAILS),
+    'Review': (PRODUCTS, DETAILS),
+    'StockBucket': (PRODUCTS, DETAILS),
+    'CustomUser': (PRODUCTS, DETAILS),
+}
+
+# bulk writes to only these columns dont change anything a product detail
+# shows (the counters move on every product create / delete)
+DETAIL_IGNORED_FIELDS = {
+    'Category': {'product_count', 'subtree_product_count'},
+}
+
+# a bulk write touching more products than this drops every detail instead
+DETAIL_BUMP_LIMIT = 500
+
+VERSION_KEY = 'catalog-version:{}'
+DETAIL_VERSION_KEY = 'product-detail-version:{}'
+
+
+def _new_version():
+    # random rather than incr(): a counter can hand out the same number twice
+    # (key evicted, or a bump whose transaction rolled back) and then old
+    # entries would come back to life. the bump time goes in front so the
+    # conditional GETs can use it as Last-Modified
+    return f'{time.time_ns() // 1_000_000:x}.{uuid.uuid4().hex[:12]}'
+
+
+def version_timestamp(version):
+    """Unix time (seconds) a version was created, None for an old style token."""
+    millis, dot, _ = version.partition('.')
+    if not dot:
+        return None
+    try:
+        return int(millis, 16) / 1000
+    except ValueError:
+        return None
+
+
+def _get_or_create(keys, timeout=None):
+    found = cache.get_many(keys)
+    for key in keys:
+        if found.get(key) is None:
+            cache.add(key, _new_version(), timeout)
+            found[key] = cache.get(key)
+    return found
+
+
+def get_versions(*namespaces):
+    found = _get_or_create([VERSION_KEY.format(ns) for ns in namespaces])
+    return {ns: found[VERSION_KEY.format(ns)] for ns in namespaces}
+
+
+def _detail_version_timeout():
+    # an expired token just means a miss, it never brings an entry back
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60) * 2
+
+
+def detail_version_keys(product_id):
+    return [DETAIL_VERSION_KEY.format(product_id), VERSION_KEY.format(DETAILS)]
+
+
+def get_detail_versions(product_id):
+    """{key: version} for one product's detail, created if missing."""
+    return _get_or_create(detail_version_keys(product_id), _detail_version_timeout())
+
+
+def _bump(namespaces):
+    cache.set_many({VERSION_KEY.format(ns): _new_version() for ns in namespaces}, None)
+
+
+def bump_versions(*namespaces):
+    """
+    Invalidate everything cached under the given namespaces.
+
+    Bumps right away so this request (and tests) see fresh data, and again
+    after commit so a reader that cached the pre-commit rows in between
+    doesnt keep them around.
+    """
+    _bump(namespaces)
+    transaction.on_commit(lambda: _bump(namespaces))
+
+
+def bump_details(product_ids):
+    """Drop the cached details of these products, now and after commit."""
+    product_ids = set(product_ids)
+    if len(product_ids) > DETAIL_BUMP_LIMIT:
+        bump_versions(DETAILS)
+        return
+    if not product_ids:
+        return
+
+    def bump():
+        cache.set_many(
+            {DETAIL_VERSION_KEY.format(pk): _new_version() for pk in product_ids},
+            _detail_version_timeout(),
+        )
+    bump()
+    transaction.on_commit(bump)
+
+
+def bump_for_model(model, fields=None, product_ids=None):
+    """
+    Invalidate what a write to model affects. fields is what a bulk update
+    changed, product_ids the products it touched (None = dont know).
+    """
+    name = model.__name__
+    namespaces = MODEL_NAMESPACES.get(name)
+    if not namespaces:
+        return
+    if DETAILS in namespaces and (
+        product_ids is not None
+        or (fields is not None and set(fields) <= DETAIL_IGNORED_FIELDS.get(name, set()))
+    ):
+        namespaces = tuple(ns for ns in namespaces if ns != DETAILS)
+        bump_details(product_ids or ())
+    bump_versions(*namespaces)
+
+
+def get_audience(request):
+    # sellers get inactive products in the list, everyone else shares one copy
+    user = request.user
+    if user.is_authenticated and getattr(user, 'is_seller', False):
+        return 'seller'
+    return 'public'
+
+
+def make_cache_key(request, view_name, namespaces, versions=None):
+    if versions is None:
+        versions = get_versions(*namespaces)
+    # sort the params so ?a=1&b=2 and ?b=2&a=1 share an entry
+    params = sorted(
+        (k, v) for k in request.query_params for v in request.query_params.getlist(k)
+    )
+    raw = '|'.join([
+        view_name,
+        get_audience(request),
+        request.get_host(),
+        ','.join(f'{ns}={versions[ns]}' for ns in namespaces),
+        repr(params),
+    ])
+    return 'catalog:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def cache_catalog_response(*namespaces, timeout=None):
+    """
+    Drop-in replacement for cache_page on viewset list methods. Caches the
+    response data (not the rendered page), per audience rather than per
+    Authorization header.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_method(self, request, *args, **kwargs)
+
+            view_name = f'{self.__class__.__name__}.{view_method.__name__}'
+            key = make_cache_key(request, view_name, namespaces)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                ttl = timeout or getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60)
+                cache.set(key, response.data, ttl)
+            return response
+        return wrapper
+    return decorator
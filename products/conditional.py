@@ -0,0 +1,148 @@
+"""
+Conditional GETs (ETag / Last-Modified) for the catalog read endpoints.
+
+Each endpoint gets a validators function that works out (etag,
+last_modified) from something cheap before the view runs, so a client
+revalidating with If-None-Match / If-Modified-Since gets its 304 without the
+heavy queryset or the serializer ever running:
+
+  lists            the catalog version tokens (see cache.py) + audience +
+                   query params, last modified = when they were bumped
+  product detail   one indexed row: updated_at and the live stock, plus the
+                   categories version for the nested category and the
+                   product's detail versions (seller / reviewer renames)
+  product reviews  updated_at (review and image writes touch it) and the
+                   detail versions, for the reviewer names
+
+Bucketed products only get an ETag - an order claiming from a bucket
+changes the stock without touching the product row, so updated_at alone
+would be wrong.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .cache import CATEGORIES, get_audience, get_detail_versions, get_versions, version_timestamp
+from .models import Product
+
+
+def _params(request):
+    return sorted(
+        (k, v) for k in request.query_params for v in request.query_params.getlist(k)
+    )
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def list_etag(view_name, action, request, versions):
+    """(etag, last_modified) of a list cached under these version tokens."""
+    etag = make_etag(
+        view_name, action, get_audience(request), request.get_host(), versions, _params(request),
+    )
+    timestamps = [version_timestamp(v) for v in versions]
+    last_modified = None if None in timestamps else int(max(timestamps))
+    return etag, last_modified
+
+
+def list_validators(*namespaces):
+    """Validators for a list endpoint cached under the given namespaces."""
+    def validators(view, request, *args, **kwargs):
+        versions = get_versions(*namespaces)
+        return list_etag(
+            type(view).__name__, view.action, request, [versions[ns] for ns in namespaces]
+        )
+    return validators
+
+
+PRODUCT_ROW = ('pk', 'updated_at', 'stock_quantity', 'bucket_stock_total')
+
+
+def _product_row(view, slug):
+    # same visibility rules as the view, so a hidden product still 404s
+    return view.filter_visible(
+        Product.objects.filter(slug=slug)
+    ).with_available_stock().values_list(*PRODUCT_ROW).first()
+
+
+def _last_modified(updated_at, versions):
+    timestamps = [version_timestamp(v) for v in versions]
+    if None in timestamps:
+        return None
+    return int(max(updated_at.timestamp(), *timestamps))
+
+
+def detail_versions(versions):
+    """A product's detail version tokens in key order, for the etags."""
+    return [versions[key] for key in sorted(versions)]
+
+
+def product_validators(view, request, slug=None, **kwargs):
+    row = _product_row(view, slug)
+    if row is None:
+        return None
+    pk, updated_at, stock, bucket_stock = row
+    versions = [get_versions(CATEGORIES)[CATEGORIES], *detail_versions(get_detail_versions(pk))]
+    etag = make_etag(
+        'product', pk, updated_at.isoformat(), stock, bucket_stock, versions, _params(request),
+    )
+    last_modified = None
+    if bucket_stock is None:
+        last_modified = _last_modified(updated_at, versions)
+    return etag, last_modified
+
+
+def reviews_etag(row, request, versions):
+    """(etag, last_modified) of a product's reviews, versions from detail_versions()."""
+    pk, updated_at, _, _ = row
+    etag = make_etag('reviews', pk, updated_at.isoformat(), versions, _params(request))
+    return etag, _last_modified(updated_at, versions)
+
+
+def product_reviews_validators(view, request, slug=None, **kwargs):
+    row = _product_row(view, slug)
+    if row is None:
+        return None
+    return reviews_etag(row, request, detail_versions(get_detail_versions(row[0])))
+
+
+def conditional_response(validators):
+    """
+    Answer If-None-Match / If-Modified-Since from validators(view, request,
+    *args, **kwargs) -> (etag, last_modified) before running the view, and
+    put the validators on 200s. validators returning None (eg. no such
+    product) just runs the view.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_method(self, request, *args, **kwargs)
+
+            found = validators(self, request, *args, **kwargs)
+            if found is None:
+                return view_method(self, request, *args, **kwargs)
+            etag, last_modified = found
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # sellers see a different catalog, and everyone should revalidate
+    # rather than guess a freshness lifetime
+    patch_vary_headers(response, ['Authorization'])
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,364 @@
+"""
+Scale data generator behind `seed_data --products N ...`.
+
+Everything comes off one random.Random(seed), so the same flags build the
+same database. The data is skewed the way a real store is:
+
+  - product popularity is Zipfian: a few products get most of the orders
+    and reviews, the long tail gets next to nothing
+  - sellers are Zipfian too (a handful of hot sellers own most products)
+  - categories are a deep tree (fanout ** depth leaves), leaf popularity
+    is Zipfian again
+  - prices are log-normal, ratings lean to 4 and 5 stars
+
+Rows go in batch_size at a time - bulk_create, or COPY on Postgres for the
+tables nothing else needs ids back from - and the only things kept in
+memory are compact arrays of the ids/prices later steps pick from. The
+denormalized counters (ratings, category counts) are rebuilt once at the
+end instead of per row.
+"""
+import io
+import math
+import random
+import time
+import uuid
+from array import array
+from bisect import bisect
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+
+from orders.models import Order, OrderItem
+from .importers import _copy_value
+from .models import Category, Product, Review
+from .ratings import rebuild_ratings
+from .tree import rebuild_category_tree
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+PASSWORD = 'GeneratedPass123!'
+
+ADJECTIVES = [
+    'wireless', 'portable', 'compact', 'premium', 'classic', 'organic', 'smart',
+    'heavy duty', 'slim', 'waterproof', 'ergonomic', 'vintage', 'foldable',
+    'insulated', 'adjustable', 'rechargeable', 'stainless', 'cotton', 'leather',
+]
+NOUNS = [
+    'headphones', 'speaker', 'charger', 'cable', 'keyboard', 'mouse', 'lamp',
+    'backpack', 'jacket', 'bottle', 'pan', 'kettle', 'chair', 'desk', 'mat',
+    'watch', 'camera', 'tripod', 'notebook', 'shoes', 'blender', 'router',
+]
+CATEGORY_WORDS = [
+    'Electronics', 'Audio', 'Computing', 'Home', 'Kitchen', 'Garden', 'Sports',
+    'Outdoor', 'Fashion', 'Books', 'Toys', 'Health', 'Office', 'Travel',
+]
+RATING_WEIGHTS = [5, 7, 15, 33, 40]  # 1..5 stars
+LINES_WEIGHTS = [45, 25, 15, 10, 5]  # 1..5 lines per order
+ORDER_STATUSES = ['delivered', 'shipped', 'confirmed', 'pending', 'cancelled']
+STATUS_WEIGHTS = [60, 10, 10, 12, 8]
+
+
+def product_name(i):
+    # a function of the index (not the rng) so order lines can rebuild it
+    return f'{ADJECTIVES[i * 7 % len(ADJECTIVES)]} {NOUNS[i * 13 % len(NOUNS)]} {i}'.title()
+
+
+class ZipfSampler:
+    """Indexes 0..n-1 with P(i) proportional to 1 / (i + 1) ** s."""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = array('d')
+        total = 0.0
+        for i in range(n):
+            total += 1.0 / (i + 1) ** s
+            self.cumulative.append(total)
+        self.total = total
+
+    def __call__(self):
+        return bisect(self.cumulative, self.rng.random() * self.total)
+
+
+def copy_objects(model, objs):
+    """INSERT objs with COPY ... FROM STDIN (Postgres only). No ids come back."""
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    buf = io.StringIO()
+    for obj in objs:
+        values = []
+        for f in fields:
+            value = f.get_db_prep_save(f.pre_save(obj, True), connection)
+            if isinstance(value, bool):
+                value = 't' if value else 'f'
+            values.append(_copy_value(value))
+        buf.write('\t'.join(values))
+        buf.write('\n')
+    buf.seek(0)
+    columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {model._meta.db_table} ({columns}) FROM STDIN", buf)
+
+
+class DataGenerator:
+    """
+    Builds the whole dataset, see module docstring. on_progress(label, done,
+    total) is called after every batch.
+    """
+
+    def __init__(self, products=0, users=0, reviews=0, orders=0, seed=42,
+                 sellers=None, category_depth=4, category_fanout=5,
+                 batch_size=BATCH_SIZE, use_copy=None, on_progress=None):
+        self.counts = {'products': products, 'users': users, 'reviews': reviews, 'orders': orders}
+        self.seed = seed
+        self.sellers = sellers if sellers is not None else max(1, users // 100)
+        self.category_depth = category_depth
+        self.category_fanout = category_fanout
+        self.batch_size = batch_size
+        if use_copy is None:
+            use_copy = connection.vendor == 'postgresql'
+        self.use_copy = use_copy
+        self.on_progress = on_progress
+        self.rng = random.Random(seed)
+        # everything generated is tagged with the seed, so runs with
+        # different seeds can share a database
+        self.tag = f'gen{seed}'
+
+        self.user_ids = array('q')
+        self.seller_ids = array('q')
+        self.leaf_ids = array('q')
+        self.product_ids = array('q')
+        self.product_cents = array('q')
+
+    def already_generated(self):
+        return User.objects.filter(username__startswith=f'{self.tag}-').exists()
+
+    def run(self):
+        started = time.monotonic()
+        self.make_users()
+        self.make_categories()
+        self.make_products()
+        self.make_reviews()
+        self.make_orders()
+
+        # bulk writes skip the signals that keep these up to date
+        if self.counts['reviews']:
+            rebuild_ratings()
+        if self.counts['products']:
+            rebuild_category_tree()
+        return time.monotonic() - started
+
+    def _progress(self, label, done, total):
+        if self.on_progress:
+            self.on_progress(label, done, total)
+
+    def _write(self, model, objs, need_ids=False):
+        if self.use_copy and not need_ids:
+            with transaction.atomic():
+                copy_objects(model, objs)
+        else:
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def _batches(self, label, total, make):
+        """Call make(i) for every i, yield lists of batch_size results."""
+        self._progress(label, 0, total)
+        batch = []
+        for i in range(total):
+            batch.append(make(i))
+            if len(batch) >= self.batch_size:
+                yield batch
+                self._progress(label, i + 1, total)
+                batch = []
+        if batch:
+            yield batch
+            self._progress(label, total, total)
+
+    # ---- users ----
+
+    def make_users(self):
+        total = self.counts['users'] + self.sellers
+        if not total:
+            return
+        # hashing is the slow part of creating a user, do it once
+        password = make_password(PASSWORD)
+        rng = self.rng
+
+        def make(i):
+            seller = i < self.sellers
+            kind = 'seller' if seller else 'user'
+            return User(
+                email=f'{self.tag}-{kind}{i}@example.com', username=f'{self.tag}-{kind}{i}',
+                password=password, is_seller=seller,
+                first_name=rng.choice(['Alex', 'Sam', 'Lerato', 'Chen', 'Maria', 'Tom', 'Aisha']),
+                last_name=rng.choice(['Smith', 'Naidoo', 'Garcia', 'Kim', 'Dlamini', 'Brown']),
+            )
+
+        for batch in self._batches('users', total, make):
+            self._write(User, batch)
+
+        rows = User.objects.filter(username__startswith=f'{self.tag}-').values_list('pk', 'is_seller')
+        for pk, is_seller in rows.order_by('pk').iterator(chunk_size=self.batch_size):
+            (self.seller_ids if is_seller else self.user_ids).append(pk)
+
+    # ---- categories ----
+
+    def make_categories(self):
+        if not self.counts['products']:
+            return
+        level_above = [(None, '')]
+        self._progress('categories', 0, self.category_depth)
+        for level in range(self.category_depth):
+            objs, positions = [], []
+            for parent, parent_position in level_above:
+                for n in range(self.category_fanout):
+                    # names and slugs are unique, so they carry the position
+                    position = f'{parent_position}-{n}' if parent else str(n)
+                    word = CATEGORY_WORDS[(level * 7 + n) % len(CATEGORY_WORDS)]
+                    objs.append(Category(
+                        name=f'{word} {self.tag}-{position}',
+                        slug=f'{self.tag}-{position}', parent=parent,
+                    ))
+                    positions.append(position)
+            # bulk_create hands back pks for the next level's parents
+            created = Category.objects.bulk_create(objs, batch_size=self.batch_size)
+            level_above = list(zip(created, positions))
+            self._progress('categories', level + 1, self.category_depth)
+        self.leaf_ids.extend(c.pk for c, _ in level_above)
+
+    # ---- products ----
+
+    def make_products(self):
+        total = self.counts['products']
+        if not total:
+            return
+        rng = self.rng
+        pick_seller = ZipfSampler(len(self.seller_ids), 1.2, rng) if self.seller_ids else None
+        pick_leaf = ZipfSampler(len(self.leaf_ids), 0.8, rng)
+        # a seller of last resort if no users were asked for
+        fallback = None if pick_seller else self._fallback_seller()
+
+        def make(i):
+            cents = min(max(int(math.exp(rng.gauss(3.3, 1.0)) * 100), 99), 500000)
+            price = Decimal(cents) / 100
+            return Product(
+                name=product_name(i), slug=f'{self.tag}-{i}', sku=f'{self.tag.upper()}-{i:08d}',
+                description=' '.join(rng.choices(ADJECTIVES + NOUNS, k=rng.randint(10, 40))),
+                price=price,
+                compare_at_price=(price * Decimal('1.25')).quantize(Decimal('0.01'))
+                if rng.random() < 0.2 else None,
+                stock_quantity=0 if rng.random() < 0.05 else rng.randint(1, 500),
+                category_id=self.leaf_ids[pick_leaf()],
+                seller_id=self.seller_ids[pick_seller()] if pick_seller else fallback,
+                is_active=rng.random() < 0.97,
+            )
+
+        for batch in self._batches('products', total, make):
+            self._write(Product, batch)
+
+        rows = Product.objects.filter(sku__startswith=f'{self.tag.upper()}-').order_by('sku')
+        for pk, price in rows.values_list('pk', 'price').iterator(chunk_size=self.batch_size):
+            self.product_ids.append(pk)
+            self.product_cents.append(int(price * 100))
+
+        # popularity rank -> product, so the hits arent just the oldest rows
+        self.popularity = array('q', range(len(self.product_ids)))
+        rng.shuffle(self.popularity)
+        self.pick_rank = ZipfSampler(len(self.product_ids), 1.1, rng)
+
+    def _fallback_seller(self):
+        seller, _ = User.objects.get_or_create(
+            username=f'{self.tag}-seller', defaults={
+                'email': f'{self.tag}-seller@example.com', 'is_seller': True,
+                'password': make_password(PASSWORD),
+            },
+        )
+        return seller.pk
+
+    def _pick_product(self):
+        return self.popularity[self.pick_rank()]
+
+    # ---- reviews ----
+
+    def make_reviews(self):
+        total = self.counts['reviews']
+        if not total or not self.product_ids or not self.user_ids:
+            return
+        rng = self.rng
+        users = len(self.user_ids)
+        # at most one review per (product, user): spread the total over the
+        # users and draw distinct products per user
+        per_user_cap = max(1, len(self.product_ids) // 2)
+        total = min(total, users * per_user_cap)
+
+        def reviews():
+            for u in range(users):
+                count = min((u + 1) * total // users - u * total // users, per_user_cap)
+                seen = set()
+                draws = 0
+                while len(seen) < count:
+                    draws += 1
+                    # the tail is too thin to fill a big count from, top up
+                    # uniformly once zipf stops finding new products
+                    if draws > count * 20:
+                        seen.add(rng.randrange(len(self.product_ids)))
+                    else:
+                        seen.add(self._pick_product())
+                for index in seen:
+                    yield Review(
+                        product_id=self.product_ids[index], user_id=self.user_ids[u],
+                        rating=rng.choices(range(1, 6), RATING_WEIGHTS)[0],
+                        comment=rng.choice(['', 'Great', 'As described', 'Would buy again',
+                                            'Not worth it', 'Arrived late but works']),
+                    )
+
+        stream = reviews()
+        for batch in self._batches('reviews', total, lambda i: next(stream)):
+            self._write(Review, batch)
+
+    # ---- orders ----
+
+    def make_orders(self):
+        total = self.counts['orders']
+        if not total or not self.product_ids or not self.user_ids:
+            return
+        rng = self.rng
+        done = 0
+        self._progress('orders', 0, total)
+        while done < total:
+            size = min(self.batch_size, total - done)
+            orders, lines = [], []
+            for _ in range(size):
+                items = []
+                for _ in range(rng.choices(range(1, 6), LINES_WEIGHTS)[0]):
+                    index = self._pick_product()
+                    items.append((index, rng.choices((1, 2, 3), (80, 15, 5))[0]))
+                orders.append(Order(
+                    order_number=uuid.UUID(int=rng.getrandbits(128), version=4),
+                    user_id=self.user_ids[rng.randrange(len(self.user_ids))],
+                    status=rng.choices(ORDER_STATUSES, STATUS_WEIGHTS)[0],
+                    total_amount=Decimal(sum(self.product_cents[i] * q for i, q in items)) / 100,
+                    shipping_address=f'{rng.randint(1, 999)} Generated Street',
+                ))
+                lines.append(items)
+
+            self._write(Order, orders, need_ids=True)
+            if orders[0].pk is None:
+                # backends without RETURNING on bulk inserts
+                ids = dict(Order.objects.filter(
+                    order_number__in=[o.order_number for o in orders]
+                ).values_list('order_number', 'pk'))
+                for order in orders:
+                    order.pk = ids[order.order_number]
+
+            self._write(OrderItem, [
+                OrderItem(
+                    order_id=order.pk, product_id=self.product_ids[index],
+                    product_name=product_name(index),
+                    product_price=Decimal(self.product_cents[index]) / 100, quantity=quantity,
+                )
+                for order, items in zip(orders, lines)
+                for index, quantity in items
+            ])
+            done += size
+            self._progress('orders', done, total)
@@ -0,0 +1,81 @@
+"""
+Read-through cache of the serialized product detail.
+
+Entries are keyed by slug, audience (sellers also see inactive products),
+host and query params, and remember the versions they were built under:
+
+  product-detail-version:<pk>   bumped by any write to that product - saves,
+                                stock taken or put back by orders, its
+                                reviews, images and rating counters
+  the DETAILS namespace         bumped by category edits and by bulk writes
+                                that dont say which products they touch
+
+A hit is only served while both still match, so a write never has to find
+the entries to delete them - including the ones under a slug the product
+has since been renamed from. A hit costs two cache reads and no queries,
+and answers If-None-Match / If-Modified-Since from the validators stored
+with it. On a miss the versions are read before the product is, so a write
+that lands in between leaves the new entry already stale.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from .cache import detail_version_keys, get_audience, get_detail_versions
+from .conditional import set_validators
+from .models import Product
+
+DETAIL_KEY = 'product-detail:{}'
+
+
+def detail_cache_key(request, slug):
+    params = sorted(
+        (k, v) for k in request.query_params for v in request.query_params.getlist(k)
+    )
+    raw = '|'.join([slug, get_audience(request), request.get_host(), repr(params)])
+    return DETAIL_KEY.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def cached_response(request, entry, response_class=Response):
+    last_modified = parse_http_date_safe(entry['last_modified'] or '')
+    response = get_conditional_response(request, etag=entry['etag'], last_modified=last_modified)
+    if response is None:
+        response = response_class(entry['data'])
+    return set_validators(response, entry['etag'], last_modified)
+
+
+def cache_product_detail(view_method):
+    """Goes outside conditional_response on ProductViewSet.retrieve."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_method(self, request, *args, **kwargs)
+
+        slug = kwargs[self.lookup_field]
+        key = detail_cache_key(request, slug)
+        entry = cache.get(key)
+        if entry is not None and cache.get_many(list(entry['versions'])) == entry['versions']:
+            return cached_response(request, entry)
+
+        product_id = self.filter_visible(
+            Product.objects.filter(slug=slug)
+        ).values_list('pk', flat=True).first()
+        if product_id is None:
+            return view_method(self, request, *args, **kwargs)  # the 404
+        versions = get_detail_versions(product_id)
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200 and response.has_header('ETag'):
+            cache.set(key, {
+                'data': response.data,
+                'etag': response['ETag'],
+                'last_modified': response.get('Last-Modified'),
+                'versions': {k: versions[k] for k in detail_version_keys(product_id)},
+            }, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60))
+        return response
+    return wrapper
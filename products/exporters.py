@@ -0,0 +1,161 @@
+"""
+Full catalog export as NDJSON or CSV.
+
+Rows come off a server-side cursor (.iterator) as plain tuples and are
+written out a chunk at a time, so memory stays flat however big the
+catalog is. Used by ProductExportView (streamed, optionally gzipped) and
+the export_products command. Under ASGI the view hands out aiter_chunks()
+- Django reads a plain iterator into a list there before sending anything.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime, time, timezone
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Product
+
+CHUNK_SIZE = 2000  # rows per cursor fetch
+ROWS_PER_WRITE = 500  # rows per chunk handed to the response
+
+# (output name, queryset expression)
+EXPORT_COLUMNS = [
+    ('id', 'pk'),
+    ('sku', 'sku'),
+    ('slug', 'slug'),
+    ('name', 'name'),
+    ('description', 'description'),
+    ('price', 'price'),
+    ('compare_at_price', 'compare_at_price'),
+    ('stock_quantity', 'available_stock'),
+    ('category', 'category__slug'),
+    ('seller_id', 'seller_id'),
+    ('image_url', 'image_url'),
+    ('rating_count', 'rating_count'),
+    ('rating_sum', 'rating_sum'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+]
+HEADER = [name for name, _ in EXPORT_COLUMNS]
+
+
+def parse_since(value):
+    """'2024-05-01' or an iso datetime -> aware datetime (UTC if naive), or None."""
+    try:
+        since = parse_datetime(value)
+        if since is None and parse_date(value):
+            since = datetime.combine(parse_date(value), time.min)
+    except ValueError:
+        return None
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip, q-values included."""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.lower()] = q
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def export_rows(updated_since=None, seller_id=None):
+    """Tuples in EXPORT_COLUMNS order for every active product, by id."""
+    qs = Product.objects.filter(is_active=True)
+    if updated_since is not None:
+        qs = qs.filter(updated_at__gte=updated_since)
+    if seller_id is not None:
+        qs = qs.filter(seller_id=seller_id)
+    qs = qs.with_available_stock().annotate(
+        # live bucket total for bucketed products, the column otherwise
+        available_stock=Coalesce('bucket_stock_total', F('stock_quantity')),
+    )
+    return qs.order_by('pk').values_list(
+        *[expr for _, expr in EXPORT_COLUMNS]
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _chunked(rows, buf, write_row):
+    """Write rows into buf, yielding its contents every ROWS_PER_WRITE rows."""
+    for count, row in enumerate(rows, 1):
+        write_row(row)
+        if count % ROWS_PER_WRITE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def iter_ndjson(rows):
+    buf = io.StringIO()
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    def write_row(row):
+        buf.write(encoder.encode(dict(zip(HEADER, row))))
+        buf.write('\n')
+
+    return _chunked(rows, buf, write_row)
+
+
+def iter_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(HEADER)
+    return _chunked(rows, buf, writer.writerow)
+
+
+RENDERERS = {'ndjson': iter_ndjson, 'csv': iter_csv}
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode()
+
+
+def gzip_stream(chunks):
+    """gzip a stream of bytes chunks as it goes."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(output, updated_since=None, seller_id=None, compress=False):
+    """bytes chunks of the export in the given format ('ndjson' or 'csv')."""
+    rows = export_rows(updated_since=updated_since, seller_id=seller_id)
+    chunks = encode(RENDERERS[output](rows))
+    return gzip_stream(chunks) if compress else chunks
+
+
+async def aiter_chunks(chunks):
+    """
+    chunks as an async iterator, each one produced on the sync thread - the
+    one with the request's connection and the server-side cursor.
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # client went away halfway, let go of the cursor
+        await sync_to_async(chunks.close, thread_sensitive=True)()
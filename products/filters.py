@@ -1,5 +1,8 @@
 import django_filters
+from rest_framework.filters import OrderingFilter, SearchFilter
+
 from .models import Product
+from .search import get_search_backend
 
 
 class ProductFilter(django_filters.FilterSet):
@@ -23,6 +26,28 @@ class ProductFilter(django_filters.FilterSet):
         fields = ['category', 'category_id', 'seller', 'is_active']
 
     def filter_in_stock(self, queryset, name, value):
-        if value:
-            return queryset.filter(stock_quantity__gt=0)
-        return queryset.filter(stock_quantity=0)
+        # goes through the stock buckets for products that use them
+        return queryset.in_stock(value)
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    ?search= backed by the ranked search engine in search.py instead of
+    ILIKE '%term%' over every search_field.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        queryset, request.search_limit = get_search_backend().search(queryset, query)
+        return queryset
+
+
+class ProductOrderingFilter(OrderingFilter):
+    """Leaves search results in relevance order unless ?ordering= is given."""
+
+    def get_default_ordering(self, view):
+        if view.request.query_params.get(ProductSearchFilter.search_param, '').strip():
+            return None
+        return super().get_default_ordering(view)
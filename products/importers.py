@@ -0,0 +1,378 @@
+"""
+Bulk product import from CSV or NDJSON.
+
+Rows are read straight off the file, never the whole thing at once, and
+handled BATCH_SIZE at a time: field checks per row, then one query for
+the batch's existing SKUs, then one INSERT ... ON CONFLICT (sku) DO UPDATE
+fed from
+
+  a multi-row VALUES list                   everywhere
+  COPY into a temp table                    on Postgres
+
+A SKU that belongs to another seller is a row error, never an update. The
+upsert itself only updates rows of this seller, so one taken in between is
+reported too. Existing products keep their slug and rating counters.
+Bucketed products get the new stock spread over their buckets. The upserts
+skip Product.save, so each batch drops the cached details of the products
+it wrote and adjusts the category counters and the search index itself.
+
+Columns: sku, name, description, price, compare_at_price, stock_quantity,
+category (slug), image_url, is_active. Anything else is ignored.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+from collections import defaultdict
+
+from django.core.files import File
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .cache import bump_for_model
+from .inventory import set_bucketed_stock
+from .models import Category, Product, ProductImport
+from .ratings import RATING_FIELDS
+from .search import products_saved
+from .serializers import ProductImportRowSerializer
+from .slugs import SLUG_RETRIES, assign_slugs
+from .tree import active_in, adjust_product_counts
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+ERROR_SAMPLE = 50  # errors kept on the job row, the rest are in the report
+OTHER_SELLER = 'This SKU belongs to another seller.'
+
+COLUMNS = list(ProductImportRowSerializer().fields)
+UPDATE_FIELDS = [
+    'name', 'description', 'price', 'compare_at_price', 'stock_quantity',
+    'category', 'image_url', 'is_active', 'updated_at',
+]
+# the values that come from the file (through the staging table on
+# Postgres), the other columns are the same for every row
+ROW_FIELDS = [
+    'sku', 'slug', 'name', 'description', 'price', 'compare_at_price',
+    'stock_quantity', 'category', 'image_url', 'is_active',
+]
+FIXED_FIELDS = ['seller', 'bucket_count', *RATING_FIELDS, 'created_at', 'updated_at']
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+def detect_format(filename):
+    return FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+
+def read_rows(fh, file_format):
+    """
+    Yield (line number, row) from a binary file object. row is None for an
+    NDJSON line that isnt valid JSON.
+    """
+    text = io.TextIOWrapper(fh, encoding='utf-8-sig', newline='')
+    try:
+        if file_format == 'csv':
+            reader = csv.DictReader(text)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError:
+                    yield line_num, None
+    finally:
+        # dont let the wrapper close the file under the caller
+        text.detach()
+
+
+def _copy_value(value):
+    """Encode one value for COPY ... FROM STDIN (text format)."""
+    if value is None:
+        return '\\N'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+class ProductImporter:
+    """
+    Upserts rows for one seller. on_error gets each row error as a dict,
+    on_progress gets the running stats after every batch.
+    """
+
+    def __init__(self, seller, batch_size=BATCH_SIZE, use_copy=None,
+                 on_error=None, on_progress=None):
+        self.seller = seller
+        self.batch_size = batch_size
+        if use_copy is None:
+            use_copy = connection.vendor == 'postgresql'
+        self.use_copy = use_copy
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'errors': 0}
+        self.error_sample = []
+        self.categories = {}
+        self.seen_skus = set()
+
+    def run(self, rows):
+        # categories are a small table, one lookup dict for the whole file
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        batch = []
+        for line_num, row in rows:
+            batch.append((line_num, row))
+            if len(batch) >= self.batch_size:
+                self._process(batch)
+                batch = []
+        if batch:
+            self._process(batch)
+
+        return self.stats
+
+    def _error(self, line_num, sku, errors):
+        self.stats['errors'] += 1
+        entry = {
+            'line': line_num, 'sku': sku,
+            'errors': {field: [str(e) for e in msgs] for field, msgs in errors.items()},
+        }
+        if len(self.error_sample) < ERROR_SAMPLE:
+            self.error_sample.append(entry)
+        if self.on_error:
+            self.on_error(entry)
+
+    def _clean(self, line_num, row):
+        if not isinstance(row, dict):
+            self._error(line_num, '', {'row': ['Not a valid JSON object.']})
+            return None
+        # csv gives '' for empty cells, treat them like missing ones
+        data = {k: v for k, v in row.items() if k in COLUMNS and v not in ('', None)}
+        serializer = ProductImportRowSerializer(data=data)
+        if not serializer.is_valid():
+            self._error(line_num, str(data.get('sku', '')), serializer.errors)
+            return None
+
+        values = dict(serializer.validated_data)
+        sku = values['sku']
+        if sku in self.seen_skus:
+            self._error(line_num, sku, {'sku': ['Duplicate SKU in this file.']})
+            return None
+        slug = values.pop('category', None)
+        if slug:
+            if slug not in self.categories:
+                self._error(line_num, sku, {'category': [f'Unknown category "{slug}".']})
+                return None
+            values['category_id'] = self.categories[slug]
+        self.seen_skus.add(sku)
+        return values
+
+    def _process(self, batch):
+        self.stats['rows'] += len(batch)
+        valid = []
+        for line_num, row in batch:
+            values = self._clean(line_num, row)
+            if values is not None:
+                valid.append((line_num, values))
+
+        existing = {
+            sku: rest
+            for sku, *rest in Product.objects.filter(
+                sku__in=[values['sku'] for _, values in valid]
+            ).values_list('sku', 'pk', 'seller_id', 'slug', 'bucket_count', 'category_id', 'is_active')
+        } if valid else {}
+
+        pending, bucketed = [], []
+        for line_num, values in valid:
+            current = existing.get(values['sku'])
+            if current and current[1] != self.seller.pk:
+                self._error(line_num, values['sku'], {'sku': [OTHER_SELLER]})
+                continue
+            product = Product(seller=self.seller, **values)
+            if current:
+                product.slug = current[2]
+                if current[3]:
+                    bucketed.append((product.sku, current[0], product.stock_quantity))
+            pending.append((line_num, product))
+
+        written = self._write(pending, bucketed, existing) if pending else {}
+        for _, product in pending:
+            if product.sku in written:
+                self.stats['updated' if product.sku in existing else 'created'] += 1
+        if self.on_progress:
+            self.on_progress(self.stats)
+
+    def _write(self, pending, bucketed, existing):
+        """Upsert pending, {sku: pk} of the rows that were written."""
+        products = [p for _, p in pending]
+        new = [p for p in products if not p.slug]
+        for attempt in range(1, SLUG_RETRIES + 1):
+            assign_slugs(new)
+            try:
+                with transaction.atomic():
+                    if self.use_copy:
+                        written = self._copy_upsert(products)
+                    else:
+                        written = self._values_upsert(products)
+                    for sku, pk, stock in bucketed:
+                        if sku in written:
+                            set_bucketed_stock(Product(pk=pk), stock)
+                    if written:
+                        self._after_write(products, written, existing)
+                break
+            except IntegrityError:
+                # most likely a slug someone else just took, allocate again
+                if attempt == SLUG_RETRIES:
+                    raise
+                for product in new:
+                    product.slug = ''
+
+        # skus the seller guard left alone belong to someone else by now
+        for line_num, product in pending:
+            if product.sku not in written:
+                self._error(line_num, product.sku, {'sku': [OTHER_SELLER]})
+        return written
+
+    def _after_write(self, products, written, existing):
+        # what Product.save's signals would have done, once for the batch
+        deltas = defaultdict(int)
+        for product in products:
+            if product.sku not in written:
+                continue
+            if product.sku in existing:
+                old = existing[product.sku]
+                old_category = active_in(old[4], old[5])
+                if old_category:
+                    deltas[old_category] -= 1
+            new_category = active_in(product.category_id, product.is_active)
+            if new_category:
+                deltas[new_category] += 1
+        adjust_product_counts(deltas)
+        pks = list(written.values())
+        bump_for_model(Product, product_ids=pks)
+        products_saved(pks)
+
+    def _upsert_sql(self, source):
+        """
+        (sql, params of one row's FIXED_FIELDS) inserting from source, a
+        SELECT or VALUES giving ROW_FIELDS then a %s per fixed field. An
+        existing sku is only updated if it's this seller's.
+        """
+        meta = Product._meta
+        columns = ', '.join(meta.get_field(name).column for name in ROW_FIELDS + FIXED_FIELDS)
+        updates = ', '.join(
+            f'{column} = excluded.{column}'
+            for column in (meta.get_field(name).column for name in UPDATE_FIELDS)
+        )
+        now = meta.get_field('updated_at').get_db_prep_save(timezone.now(), connection)
+        sql = (
+            f"INSERT INTO {meta.db_table} ({columns}) {source}"
+            f" ON CONFLICT (sku) DO UPDATE SET {updates}"
+            f" WHERE {meta.db_table}.seller_id = excluded.seller_id"
+            f" RETURNING sku, id"
+        )
+        return sql, [self.seller.pk, 0, *[0 for _ in RATING_FIELDS], now, now]
+
+    def _values_upsert(self, products):
+        fields = [Product._meta.get_field(name) for name in ROW_FIELDS]
+        width = len(ROW_FIELDS) + len(FIXED_FIELDS)
+        row = '(' + ', '.join(['%s'] * width) + ')'
+        size = connection.ops.bulk_batch_size([None] * width, products)
+        written = {}
+        with connection.cursor() as cursor:
+            for start in range(0, len(products), size):
+                chunk = products[start:start + size]
+                sql, fixed_params = self._upsert_sql('VALUES ' + ', '.join([row] * len(chunk)))
+                params = []
+                for product in chunk:
+                    params += [f.get_db_prep_save(getattr(product, f.attname), connection) for f in fields]
+                    params += fixed_params
+                cursor.execute(sql, params)
+                written.update(cursor.fetchall())
+        return written
+
+    def _copy_upsert(self, products):
+        """COPY into a staging table, then the same upsert from there."""
+        fields = [Product._meta.get_field(name) for name in ROW_FIELDS]
+        columns = ', '.join(f.column for f in fields)
+        buf = io.StringIO()
+        for product in products:
+            buf.write('\t'.join(_copy_value(getattr(product, f.attname)) for f in fields))
+            buf.write('\n')
+        buf.seek(0)
+
+        fixed = ', '.join(['%s'] * len(FIXED_FIELDS))
+        sql, params = self._upsert_sql(f"SELECT {columns}, {fixed} FROM product_import_staging")
+        with connection.cursor() as cursor:
+            # dropped again below rather than ON COMMIT, inside a caller's
+            # transaction that would only happen after the last batch
+            cursor.execute(
+                "CREATE TEMP TABLE product_import_staging ("
+                + ', '.join(f'{f.column} {f.db_type(connection)}' for f in fields)
+                + ")"
+            )
+            cursor.copy_expert(f"COPY product_import_staging ({columns}) FROM STDIN", buf)
+            cursor.execute(sql, params)
+            written = dict(cursor.fetchall())
+            cursor.execute("DROP TABLE product_import_staging")
+        return written
+
+
+def run_import(job):
+    """Process a ProductImport, keeping its progress columns up to date."""
+    ProductImport.objects.filter(pk=job.pk).update(status='running')
+    report = tempfile.TemporaryFile('w+', newline='')
+    writer = csv.writer(report)
+    writer.writerow(['line', 'sku', 'field', 'message'])
+
+    def on_error(entry):
+        for field, messages in entry['errors'].items():
+            for message in messages:
+                writer.writerow([entry['line'], entry['sku'], field, message])
+
+    try:
+        with job.file.open('rb') as fh:
+            def on_progress(stats):
+                ProductImport.objects.filter(pk=job.pk).update(
+                    rows_processed=stats['rows'], created_count=stats['created'],
+                    updated_count=stats['updated'], error_count=stats['errors'],
+                    bytes_read=fh.tell(),
+                )
+
+            importer = ProductImporter(job.seller, on_error=on_error, on_progress=on_progress)
+            stats = importer.run(read_rows(fh, job.file_format))
+
+        job.status = 'done'
+        job.rows_processed = stats['rows']
+        job.created_count = stats['created']
+        job.updated_count = stats['updated']
+        job.error_count = stats['errors']
+        job.bytes_read = job.file_size
+        job.errors = importer.error_sample
+        if stats['errors']:
+            report.seek(0)
+            job.error_report.save(f'import-{job.pk}-errors.csv', File(report), save=False)
+        fields = [
+            'status', 'rows_processed', 'created_count', 'updated_count',
+            'error_count', 'bytes_read', 'errors', 'error_report', 'finished_at',
+        ]
+    except Exception as e:
+        # batches written before the failure stay written, the counters
+        # from the last on_progress say how far it got
+        logger.exception(f"Product import {job.pk} failed")
+        job.status = 'failed'
+        job.message = str(e)
+        fields = ['status', 'message', 'finished_at']
+    finally:
+        report.close()
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=fields)
+    logger.info(
+        f"Product import {job.pk} {job.status}: {job.created_count} created, "
+        f"{job.updated_count} updated, {job.error_count} errors"
+    )
+    return job
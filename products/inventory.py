@@ -0,0 +1,191 @@
+"""
+Stock movements for order placement and cancellation.
+
+Everything here works on a {product_id: quantity} dict and issues a fixed
+number of queries no matter how many products are involved. Rows are always
+locked in pk order, so two carts touching the same products queue up
+behind each other instead of deadlocking.
+
+Bucketed products
+-----------------
+A flash sale on one SKU means every order waits for the lock on that one
+products row. Products with bucket_count > 0 keep their stock in that many
+StockBucket rows instead; an order claims from a random bucket that has
+enough (skipping buckets another order holds), so N orders can go through
+in parallel. Each claim is a guarded UPDATE on one bucket, so the total can
+never go below zero. While bucketed, products.stock_quantity is only a
+snapshot - refresh it with sync_bucketed_stock(); reads that need the real
+number go through Product.available_stock / with_available_stock().
+"""
+import random
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockBucket
+
+
+def lock_products(product_ids):
+    """SELECT ... FOR UPDATE the given products in a canonical (pk) order."""
+    return list(
+        Product.objects.select_for_update()
+        .filter(pk__in=product_ids)
+        .order_by('pk')
+    )
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+
+
+def decrement_stock(quantities):
+    """
+    Take stock for every product in one guarded UPDATE. The WHERE clause
+    only matches rows that still have enough, so returns False (and changes
+    nothing the caller shouldnt roll back) if any product would go negative.
+    """
+    if not quantities:
+        return True
+    enough = reduce(or_, [
+        Q(pk=pk, stock_quantity__gte=qty) for pk, qty in quantities.items()
+    ])
+    # .update() skips auto_now, the conditional GETs go by updated_at
+    rows = Product.objects.filter(enough).touching(quantities).update(
+        stock_quantity=F('stock_quantity') - _per_product(quantities),
+        updated_at=timezone.now(),
+    )
+    return rows == len(quantities)
+
+
+def increment_stock(quantities):
+    """
+    Put stock back: one UPDATE for all plain products, plus one per
+    bucketed product (into a random bucket). Returns products updated.
+    """
+    if not quantities:
+        return 0
+    bucketed = dict(
+        Product.objects.filter(pk__in=list(quantities), bucket_count__gt=0)
+        .values_list('pk', 'bucket_count')
+    )
+    plain = {pk: qty for pk, qty in quantities.items() if pk not in bucketed}
+
+    updated = 0
+    if plain:
+        updated += Product.objects.filter(pk__in=list(plain)).touching(plain).update(
+            stock_quantity=F('stock_quantity') + _per_product(plain),
+            updated_at=timezone.now(),
+        )
+    for pk, bucket_count in bucketed.items():
+        updated += StockBucket.objects.filter(
+            product_id=pk, bucket=random.randrange(bucket_count)
+        ).touching([pk]).update(quantity=F('quantity') + quantities[pk])
+    return updated
+
+
+def claim_from_buckets(product_id, quantity):
+    """
+    Take quantity units of a bucketed product. Must run inside a
+    transaction. Returns False if there isnt enough stock in total.
+    """
+    # fast path: any one bucket with enough that nobody else is holding
+    bucket = (
+        StockBucket.objects.select_for_update(skip_locked=True)
+        .filter(product_id=product_id, quantity__gte=quantity)
+        .order_by('?')
+        .values_list('pk', flat=True)
+        .first()
+    )
+    if bucket is not None:
+        return bool(StockBucket.objects.filter(
+            pk=bucket, quantity__gte=quantity
+        ).touching([product_id]).update(quantity=F('quantity') - quantity))
+
+    # slow path: stock is spread thin (or every bucket is busy), so wait for
+    # all of them and take what we need across several
+    buckets = list(
+        StockBucket.objects.select_for_update()
+        .filter(product_id=product_id, quantity__gt=0)
+        .order_by('bucket')
+    )
+    if sum(b.quantity for b in buckets) < quantity:
+        return False
+    remaining = quantity
+    for b in buckets:
+        take = min(b.quantity, remaining)
+        b.quantity -= take
+        remaining -= take
+        if not remaining:
+            break
+    StockBucket.objects.bulk_update(buckets, ['quantity'])
+    return True
+
+
+def _spread(total, bucket_count):
+    base, extra = divmod(total, bucket_count)
+    return [base + (1 if i < extra else 0) for i in range(bucket_count)]
+
+
+def set_bucket_count(product, bucket_count):
+    """
+    Switch a product between plain stock (bucket_count=0) and N buckets,
+    keeping the total. Locks the product and its buckets while it moves.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product.pk)
+        buckets = list(StockBucket.objects.select_for_update().filter(product=product))
+        if product.bucket_count:
+            total = sum(b.quantity for b in buckets)
+        else:
+            total = product.stock_quantity
+        StockBucket.objects.filter(product=product).delete()
+        if bucket_count:
+            StockBucket.objects.bulk_create([
+                StockBucket(product=product, bucket=i, quantity=qty)
+                for i, qty in enumerate(_spread(total, bucket_count))
+            ])
+        Product.objects.filter(pk=product.pk).touching([product.pk]).update(
+            bucket_count=bucket_count, stock_quantity=total, updated_at=timezone.now(),
+        )
+    return total
+
+
+def set_bucketed_stock(product, total):
+    """Seller set a new stock level on a bucketed product - redistribute it."""
+    with transaction.atomic():
+        buckets = list(
+            StockBucket.objects.select_for_update()
+            .filter(product=product).order_by('bucket')
+        )
+        for b, qty in zip(buckets, _spread(total, len(buckets))):
+            b.quantity = qty
+        StockBucket.objects.bulk_update(buckets, ['quantity'])
+        Product.objects.filter(pk=product.pk).touching([product.pk]).update(stock_quantity=total)
+
+
+def sync_bucketed_stock():
+    """Copy the bucket totals into products.stock_quantity, one UPDATE."""
+    totals = StockBucket.objects.filter(product=OuterRef('pk')).order_by().values(
+        'product'
+    ).annotate(total=Sum('quantity')).values('total')
+    # the detail shows the live bucket total, not this snapshot, so no
+    # cached detail goes stale
+    return Product.objects.filter(bucket_count__gt=0).touching([]).update(
+        stock_quantity=Coalesce(Subquery(totals), 0)
+    )
+
+
+def merge_quantities(items):
+    """[{'product_id': 1, 'quantity': 2}, ...] -> {1: 2, ...}"""
+    quantities = {}
+    for item in items:
+        pk = item['product_id']
+        quantities[pk] = quantities.get(pk, 0) + item['quantity']
+    return quantities
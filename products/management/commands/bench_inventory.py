@@ -0,0 +1,97 @@
+"""
+Benchmark stock claims on one hot SKU, single row vs stock buckets.
+Usage: python manage.py bench_inventory --concurrency 1,8,32 --buckets 16
+
+Runs the same claim code order placement uses, from N threads at once,
+against a throwaway product. Only meaningful on Postgres - SQLite lets one
+writer in at a time no matter what.
+"""
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+
+from products.inventory import claim_from_buckets, decrement_stock, lock_products, set_bucket_count
+from products.models import Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Orders per second vs concurrency for single-row and bucketed stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,4,16,32',
+                            help='comma separated thread counts')
+        parser.add_argument('--orders', type=int, default=200,
+                            help='orders per thread')
+        parser.add_argument('--buckets', type=int, default=16)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                "Not running on Postgres - expect lock errors and flat numbers."
+            ))
+
+        levels = [int(c) for c in options['concurrency'].split(',')]
+        seller = User.objects.create_user(
+            email='bench-inventory@example.com', username='bench-inventory',
+            password=None, is_seller=True,
+        )
+        product = Product.objects.create(
+            name='Benchmark hot SKU', description='benchmark', price='1.00',
+            sku='BENCH-HOT-SKU', stock_quantity=10 ** 9, seller=seller,
+        )
+
+        try:
+            self.stdout.write(
+                f"{'mode':<10}{'threads':>8}{'orders':>9}{'errors':>8}{'seconds':>9}{'orders/s':>10}"
+            )
+            for mode, buckets in (('single', 0), ('bucketed', options['buckets'])):
+                set_bucket_count(product, buckets)
+                for threads in levels:
+                    total, errors, elapsed = self._run(
+                        product.pk, bool(buckets), threads, options['orders']
+                    )
+                    self.stdout.write(
+                        f"{mode:<10}{threads:>8}{total:>9}{errors:>8}"
+                        f"{elapsed:>9.2f}{total / elapsed:>10.0f}"
+                    )
+        finally:
+            product.delete()
+            seller.delete()
+
+    def _run(self, product_id, bucketed, threads, orders):
+        start = threading.Barrier(threads + 1)
+        done = []
+
+        def worker():
+            start.wait()
+            count = errors = 0
+            try:
+                for _ in range(orders):
+                    try:
+                        with transaction.atomic():
+                            if bucketed:
+                                claim_from_buckets(product_id, 1)
+                            else:
+                                lock_products([product_id])
+                                decrement_stock({product_id: 1})
+                        count += 1
+                    except DatabaseError:
+                        errors += 1
+            finally:
+                connection.close()
+                done.append((count, errors))
+
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        start.wait()
+        began = time.monotonic()
+        for t in pool:
+            t.join()
+        elapsed = time.monotonic() - began
+        return sum(c for c, _ in done), sum(e for _, e in done), elapsed
@@ -0,0 +1,108 @@
+"""
+Compare DRF serializers against the compiled ones (core/compiled.py).
+Usage: python manage.py bench_serializers
+       python manage.py bench_serializers --sizes 12,100,1000 --repeat 20
+
+Builds throwaway products inside a transaction that gets rolled back, then
+times serializing 12 / 100 / 1000 of them both ways (rendered to JSON, like
+a real response) and checks the bytes match.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.compiled import compile_serializer
+from products.models import Category, Product, ProductImage
+from products.serializers import ProductDetailSerializer, ProductListSerializer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark DRF vs compiled product serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='12,100,1000')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        with transaction.atomic():
+            self._seed(max(sizes))
+            try:
+                self._run(sizes, options['repeat'])
+            finally:
+                transaction.set_rollback(True)
+
+    def _seed(self, count):
+        seller = User.objects.create_user(
+            email='bench-serializers@example.com', username='bench-serializers',
+            password=None, is_seller=True, first_name='Bench', last_name='Seller',
+        )
+        category = Category.objects.create(name='Bench serializers')
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Bench product {i}', slug=f'bench-serializers-{i}',
+                sku=f'BENCH-SER-{i}', description='benchmark product ' * 10,
+                price=f'{i % 500}.99', compare_at_price=f'{i % 500 + 10}.00',
+                stock_quantity=i % 20, category=category, seller=seller,
+                rating_count=i % 7, rating_sum=(i % 7) * 4,
+            )
+            for i in range(count)
+        ])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=p, image_url=f'https://img.example.com/{p.pk}.png')
+            for p in products
+        ])
+
+    def _run(self, sizes, repeat):
+        factory = APIRequestFactory()
+        render = JSONRenderer().render
+        cases = [
+            ('list', ProductListSerializer, ''),
+            ('list narrow', ProductListSerializer, '?fields=id,name,slug,price,image_url'),
+            ('detail', ProductDetailSerializer, ''),
+        ]
+        self.stdout.write(
+            f"{'case':<14}{'items':>7}{'drf ms':>10}{'compiled ms':>13}{'speedup':>9}"
+        )
+        for label, serializer_class, query in cases:
+            context = {'request': Request(factory.get(f'/api/v1/products/{query}'))}
+            for size in sizes:
+                qs = Product.objects.filter(sku__startswith='BENCH-SER-').order_by('pk')[:size]
+                qs = serializer_class.prune_queryset(
+                    qs, serializer_class.selected_fields(context['request'])
+                )
+                items = list(qs)
+                if len(items) < size:
+                    raise CommandError(f"only {len(items)} products to serialize")
+
+                drf_out = render(serializer_class(items, many=True, context=context).data)
+                compiled = compile_serializer(serializer_class(context=context))
+                if render(compiled.serialize(items)) != drf_out:
+                    raise CommandError(f"{label}: compiled output differs from DRF")
+
+                drf_ms = self._time(
+                    lambda: render(serializer_class(items, many=True, context=context).data), repeat
+                )
+                fast_ms = self._time(
+                    lambda: render(compile_serializer(serializer_class(context=context)).serialize(items)),
+                    repeat,
+                )
+                self.stdout.write(
+                    f"{label:<14}{size:>7}{drf_ms:>10.2f}{fast_ms:>13.2f}{drf_ms / fast_ms:>8.1f}x"
+                )
+
+    def _time(self, fn, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,58 @@
+"""
+Dump every active product to a file (or stdout) as NDJSON or CSV.
+Usage: python manage.py export_products --output csv --out products.csv
+       python manage.py export_products --updated-since 2024-05-01 --gzip --out delta.ndjson.gz
+
+Same rows as GET /api/v1/products/export/, see products/exporters.py.
+"""
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.exporters import RENDERERS, export_stream, parse_since
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Stream the active catalog out as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=sorted(RENDERERS), default='ndjson')
+        parser.add_argument('--out', help='file to write, default stdout')
+        parser.add_argument('--updated-since', help='iso date or datetime')
+        parser.add_argument('--seller', help='only this seller\'s products (email)')
+        parser.add_argument('--gzip', action='store_true')
+
+    def handle(self, *args, **options):
+        updated_since = None
+        if options['updated_since']:
+            updated_since = parse_since(options['updated_since'])
+            if updated_since is None:
+                raise CommandError(f"Cant parse --updated-since {options['updated_since']}")
+
+        seller_id = None
+        if options['seller']:
+            seller_id = User.objects.filter(email=options['seller']).values_list('pk', flat=True).first()
+            if seller_id is None:
+                raise CommandError(f"No user with email {options['seller']}")
+
+        chunks = export_stream(
+            options['output'], updated_since=updated_since,
+            seller_id=seller_id, compress=options['gzip'],
+        )
+        if options['out']:
+            written = 0
+            with open(options['out'], 'wb') as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+                    written += len(chunk)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['out']}"))
+        elif options['gzip']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
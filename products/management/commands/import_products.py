@@ -0,0 +1,78 @@
+"""
+Bulk import products from a CSV or NDJSON file on disk.
+Usage: python manage.py import_products catalog.csv --seller seller@store.com
+       python manage.py import_products catalog.ndjson --seller seller@store.com --errors errors.csv
+
+Same pipeline as the upload endpoint (see products/importers.py), run in
+the foreground. Rows that fail validation are skipped and listed in the
+error report.
+"""
+import csv
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importers import BATCH_SIZE, ProductImporter, detect_format, read_rows
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Bulk create / update products from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--seller', required=True, help='email of the owning seller')
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'ndjson'],
+                            help='defaults to the file extension')
+        parser.add_argument('--errors', help='write the per-row error report here (csv)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            seller = User.objects.get(email=options['seller'], is_seller=True)
+        except User.DoesNotExist:
+            raise CommandError(f"No seller with email {options['seller']}")
+
+        file_format = options['file_format'] or detect_format(options['path'])
+        if not file_format:
+            raise CommandError("Cant tell the format from the file name, pass --format")
+
+        report = open(options['errors'], 'w', newline='') if options['errors'] else None
+        writer = csv.writer(report) if report else None
+        if writer:
+            writer.writerow(['line', 'sku', 'field', 'message'])
+
+        def on_error(entry):
+            for field, messages in entry['errors'].items():
+                for message in messages:
+                    if writer:
+                        writer.writerow([entry['line'], entry['sku'], field, message])
+                    elif options['verbosity'] > 1:
+                        self.stderr.write(f"  line {entry['line']} ({entry['sku']}): {field}: {message}")
+
+        def on_progress(stats):
+            self.stdout.write(
+                f"\r  {stats['rows']} rows, {stats['created']} created, "
+                f"{stats['updated']} updated, {stats['errors']} errors", ending=''
+            )
+            self.stdout.flush()
+
+        try:
+            with open(options['path'], 'rb') as fh:
+                importer = ProductImporter(
+                    seller, batch_size=options['batch_size'],
+                    on_error=on_error, on_progress=on_progress,
+                )
+                stats = importer.run(read_rows(fh, file_format))
+        except FileNotFoundError:
+            raise CommandError(f"No such file: {options['path']}")
+        finally:
+            if report:
+                report.close()
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['rows']} rows: {stats['created']} created, "
+            f"{stats['updated']} updated, {stats['errors']} errors."
+        ))
@@ -0,0 +1,15 @@
+"""
+Recompute category paths and cached product counts.
+Usage: python manage.py rebuild_category_tree
+"""
+from django.core.management.base import BaseCommand
+
+from products.tree import rebuild_category_tree
+
+
+class Command(BaseCommand):
+    help = 'Rebuild category paths, depths and active product counts'
+
+    def handle(self, *args, **options):
+        count = rebuild_category_tree()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} categories."))
@@ -0,0 +1,18 @@
+"""
+Recompute the denormalized rating counters on every product.
+Usage: python manage.py rebuild_ratings [--batch-size 1000]
+"""
+from django.core.management.base import BaseCommand
+
+from products.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild rating_count / rating_sum / star counts from the reviews table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings for {count} products."))
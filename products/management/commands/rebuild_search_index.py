@@ -0,0 +1,18 @@
+"""
+Rebuild the product search index for the configured backend.
+Usage: python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Re-index every product for search'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} products with {backend.__class__.__name__}."
+        ))
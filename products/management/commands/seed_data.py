@@ -1,9 +1,16 @@
 """
 Quick way to populate the db with some test data.
 Usage: python manage.py seed_data
+       python manage.py seed_data --products 1000000 --users 200000 --reviews 5000000 --orders 2000000 --seed 42
+
+With any of --products/--users/--reviews/--orders it generates that much
+skewed, reproducible data instead (see products/datagen.py).
 """
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
+from products.datagen import BATCH_SIZE, DataGenerator
 from products.models import Category, Product, Review
 
 User = get_user_model()
@@ -12,7 +19,24 @@ User = get_user_model()
 class Command(BaseCommand):
     help = 'Populate database with sample products and categories'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=0)
+        parser.add_argument('--users', type=int, default=0)
+        parser.add_argument('--reviews', type=int, default=0)
+        parser.add_argument('--orders', type=int, default=0)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--sellers', type=int, default=None,
+                            help='defaults to 1%% of --users')
+        parser.add_argument('--category-depth', type=int, default=4)
+        parser.add_argument('--category-fanout', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='use bulk_create even on Postgres')
+
     def handle(self, *args, **options):
+        if any(options[k] for k in ('products', 'users', 'reviews', 'orders')):
+            return self._generate(options)
+
         self.stdout.write("Seeding database...")
 
         # two sellers so the data looks less empty
@@ -268,3 +292,32 @@ class Command(BaseCommand):
 
         total = Product.objects.count()
         self.stdout.write(self.style.SUCCESS(f"Done! {total} products in the db."))
+
+    def _generate(self, options):
+        generator = DataGenerator(
+            products=options['products'], users=options['users'],
+            reviews=options['reviews'], orders=options['orders'],
+            seed=options['seed'], sellers=options['sellers'],
+            category_depth=options['category_depth'],
+            category_fanout=options['category_fanout'],
+            batch_size=options['batch_size'],
+            use_copy=False if options['no_copy'] else None,
+            on_progress=self._progress,
+        )
+        if generator.already_generated():
+            raise CommandError(
+                f"Data for --seed {options['seed']} is already in the db, use another seed."
+            )
+        self._started = {}
+        elapsed = generator.run()
+        self.stdout.write(self.style.SUCCESS(f"Done in {elapsed:.0f}s."))
+
+    def _progress(self, label, done, total):
+        if not done:
+            self._started[label] = time.monotonic()
+        started = self._started[label]
+        rate = done / max(time.monotonic() - started, 1e-6)
+        line = f"  {label:<11}{done:>11,} / {total:,} ({done * 100 // max(total, 1)}%) {rate:,.0f}/s"
+        # redraw the same line until the step is finished
+        self.stdout.write(f"\r{line}", ending='\n' if done >= total else '')
+        self.stdout.flush()
@@ -0,0 +1,35 @@
+"""
+Turn bucketed inventory on or off for a hot product.
+Usage: python manage.py stock_buckets ELEC-001 --buckets 16
+       python manage.py stock_buckets ELEC-001 --off
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from products.inventory import set_bucket_count
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Split a product\'s stock over N buckets (or merge it back) for flash sales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sku')
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--buckets', type=int)
+        group.add_argument('--off', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(sku=options['sku'])
+        except Product.DoesNotExist:
+            raise CommandError(f"No product with SKU {options['sku']}")
+
+        count = 0 if options['off'] else options['buckets']
+        if count < 0 or count > 256:
+            raise CommandError("--buckets has to be between 1 and 256")
+
+        total = set_bucket_count(product, count)
+        mode = f"{count} buckets" if count else "a single row"
+        self.stdout.write(self.style.SUCCESS(
+            f"{product.sku}: {total} units now in {mode}."
+        ))
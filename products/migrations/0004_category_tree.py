@@ -0,0 +1,70 @@
+# Generated by Django 5.1.4 on 2026-10-17 05:54
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_tree(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+
+    categories = list(Category.objects.all())
+    children = defaultdict(list)
+    for category in categories:
+        children[category.parent_id].append(category)
+
+    counts = dict(
+        Product.objects.filter(is_active=True, category__isnull=False)
+        .order_by().values('category_id').annotate(n=Count('id'))
+        .values_list('category_id', 'n')
+    )
+
+    subtree = defaultdict(int)
+    stack = [(c, '') for c in children[None]]
+    while stack:
+        category, parent_path = stack.pop()
+        category.path = f'{parent_path}{category.pk}/'
+        category.depth = category.path.count('/') - 1
+        category.product_count = counts.get(category.pk, 0)
+        for pk in category.path.strip('/').split('/'):
+            subtree[int(pk)] += category.product_count
+        stack.extend((child, category.path) for child in children[category.pk])
+
+    for category in categories:
+        category.subtree_product_count = subtree[category.pk]
+    Category.objects.bulk_update(
+        categories, ['path', 'depth', 'product_count', 'subtree_product_count']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='subtree_product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_tree, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-17 05:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+# the tsvector column, trigger and GIN index only exist on Postgres. on
+# SQLite search.py falls back to the in-process inverted index instead
+FORWARD_SQL = [
+    "ALTER TABLE products ADD COLUMN search_vector tsvector",
+    """
+    CREATE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.sku, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'D');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER products_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF sku, name, description ON products
+    FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """,
+    "UPDATE products SET sku = sku",
+    "CREATE INDEX products_search_vector_idx ON products USING GIN (search_vector)",
+]
+
+REVERSE_SQL = [
+    "DROP INDEX IF EXISTS products_search_vector_idx",
+    "DROP TRIGGER IF EXISTS products_search_vector_trigger ON products",
+    "DROP FUNCTION IF EXISTS products_search_vector_update()",
+    "ALTER TABLE products DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run_on_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_category_tree'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='products_updated_b2f96c_idx'),
+        ),
+        migrations.RunPython(_run_on_postgres(FORWARD_SQL), _run_on_postgres(REVERSE_SQL)),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# postgres' parser reads "KB-2" as kb and -2, so a search for KB-2 (kb:* &
+# 2:*) never matched. split on non word characters first, the same way
+# search.tokenize() does
+FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', regexp_replace(coalesce(NEW.sku, ''), '\\W+', ' ', 'g')), 'A') ||
+            setweight(to_tsvector('english', regexp_replace(coalesce(NEW.name, ''), '\\W+', ' ', 'g')), 'B') ||
+            setweight(to_tsvector('english', regexp_replace(coalesce(NEW.description, ''), '\\W+', ' ', 'g')), 'D');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+OLD_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.sku, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'D');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+REINDEX_SQL = "UPDATE products SET sku = sku"
+
+
+def _run_on_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_review_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run_on_postgres([FUNCTION_SQL, REINDEX_SQL]),
+            _run_on_postgres([OLD_FUNCTION_SQL, REINDEX_SQL]),
+        ),
+    ]
@@ -1,7 +1,102 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.conf import settings
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 
+from .cache import bump_for_model
+from .ratings import RATING_FIELDS, STAR_FIELDS, adjust_rating
+from .slugs import SLUG_RETRIES, allocate_slug, slug_taken
+from .tree import TREE_FIELDS, active_in, adjust_category_counts, rollup_subtree_counts
+
+# reviews embedded in the product detail, the rest are paged at /reviews/
+REVIEW_PREVIEW_SIZE = 5
+
+
+class CatalogQuerySet(models.QuerySet):
+    """
+    Bulk writes dont send post_save, so bump the catalog cache here instead.
+    (queryset.delete() does send post_delete, the signals handle that one)
+    """
+    _product_ids = None
+
+    def touching(self, product_ids):
+        """
+        Say which products an update() on this queryset changes, so only
+        their cached details get dropped rather than all of them.
+        """
+        clone = self._chain()
+        clone._product_ids = list(product_ids)
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._product_ids = self._product_ids
+        return clone
+
+    def _objs_product_ids(self, objs):
+        # products, or rows that belong to one (stock buckets)
+        if self.model.__name__ == 'Product':
+            return [obj.pk for obj in objs if obj.pk is not None]
+        if hasattr(self.model, 'product_id'):
+            return [obj.product_id for obj in objs]
+        return None
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            bump_for_model(self.model, fields=kwargs, product_ids=self._product_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        if created:
+            # new products have no cached detail, upserted ones get their pk back
+            bump_for_model(self.model, product_ids=self._objs_product_ids(created))
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if rows:
+            bump_for_model(self.model, fields=fields, product_ids=self._objs_product_ids(objs))
+        return rows
+
+
+class ProductQuerySet(CatalogQuerySet):
+
+    def visible_to(self, user):
+        # regular users should only see active products
+        if user.is_authenticated and user.is_seller:
+            return self
+        return self.filter(is_active=True)
+
+    def with_available_stock(self):
+        """
+        Annotate bucket_stock_total for products using stock buckets, so
+        available_stock / in_stock dont need a query per product.
+        """
+        bucket_total = StockBucket.objects.filter(
+            product=models.OuterRef('pk')
+        ).order_by().values('product').annotate(
+            total=models.Sum('quantity')
+        ).values('total')
+        return self.annotate(bucket_stock_total=models.Case(
+            models.When(bucket_count=0, then=None),
+            default=Coalesce(models.Subquery(bucket_total), 0),
+            output_field=models.PositiveIntegerField(),
+        ))
+
+    def in_stock(self, value=True):
+        has_bucket_stock = models.Exists(
+            StockBucket.objects.filter(product=models.OuterRef('pk'), quantity__gt=0)
+        )
+        available = (
+            models.Q(bucket_count=0, stock_quantity__gt=0)
+            | (models.Q(bucket_count__gt=0) & has_bucket_stock)
+        )
+        return self.filter(available if value else ~available)
+
 
 class Category(models.Model):
     name = models.CharField(max_length=150, unique=True)
@@ -12,8 +107,16 @@ class Category(models.Model):
         'self', on_delete=models.CASCADE,
         null=True, blank=True, related_name='subcategories'
     )
+    # materialized path of ancestor ids incl. this one, eg. "1/4/9/"
+    path = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # active products directly in this category / in it and all descendants
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    subtree_product_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CatalogQuerySet.as_manager()
+
     class Meta:
         db_table = 'categories'
         verbose_name_plural = 'categories'
@@ -22,7 +125,47 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+
+        # path and counters are maintained with targeted updates below and
+        # in tree.py, a stale instance shouldnt write them back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in TREE_FIELDS
+            ]
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._update_path()
+
+    def _update_path(self):
+        old_path = Category.objects.filter(pk=self.pk).values_list('path', flat=True).get()
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(
+                pk=self.parent_id
+            ).values_list('path', flat=True).get()
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError("A category cant be moved under its own subcategory.")
+
+        new_path = f'{parent_path}{self.pk}/'
+        if new_path == old_path:
+            self.path = old_path
+            return
+
+        new_depth = new_path.count('/') - 1
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        if old_path:
+            # moved - rewrite the prefix of every descendant's path too
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - (old_path.count('/') - 1)),
+            )
+            rollup_subtree_counts()
+        self.path, self.depth = new_path, new_depth
+
+    def is_descendant_of(self, other):
+        return bool(other.path) and self.path.startswith(other.path) and self.pk != other.pk
 
     def __str__(self):
         return self.name
@@ -39,6 +182,10 @@ class Product(models.Model):
     )
     sku = models.CharField(max_length=50, unique=True)
     stock_quantity = models.PositiveIntegerField(default=0)
+    # hot SKUs can spread their stock over this many StockBucket rows so
+    # orders dont all queue on this one row. 0 = plain stock_quantity.
+    # while it's on, stock_quantity is only a snapshot (see inventory.py)
+    bucket_count = models.PositiveSmallIntegerField(default=0, editable=False)
     category = models.ForeignKey(
         Category, on_delete=models.SET_NULL,
         null=True, related_name='products'
@@ -50,38 +197,125 @@ class Product(models.Model):
     image_url = models.URLField(blank=True, null=True)
     # might switch to ImageField later if we add file uploads
     is_active = models.BooleanField(default=True)
+
+    # denormalized review stats, kept up to date by Review.save / delete
+    # (see ratings.py) so list pages dont have to touch the reviews table
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         db_table = 'products'
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['category', 'is_active']),
-            models.Index(fields=['price']),
             models.Index(fields=['seller']),
-            models.Index(fields=['-created_at']),
             models.Index(fields=['sku']),
+            # (field, id) pairs back the keyset pagination on every
+            # ordering the list endpoint allows
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['name', 'id']),
+            models.Index(fields=['stock_quantity', 'id']),
+            # incremental search re-indexing and catalog exports
+            models.Index(fields=['updated_at']),
         ]
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.name)
-            slug = base_slug
-            n = 1
-            # keep incrementing until we find a unique slug
-            while Product.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{n}"
-                n += 1
-            self.slug = slug
-        super().save(*args, **kwargs)
+        auto_slug = not self.slug
+        if auto_slug:
+            self.slug = allocate_slug(self.name, exclude_pk=self.pk)
+
+        # the rating counters are only ever written with F() updates, so a
+        # normal save of a stale instance must not overwrite them
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in RATING_FIELDS
+            ]
+
+        if self._state.adding:
+            counted_before = None
+        elif hasattr(self, '_counted_category'):
+            counted_before = self._counted_category
+        else:
+            # loaded with .only()/.defer() - have to ask the db
+            row = Product.objects.filter(pk=self.pk).values_list('category_id', 'is_active').first()
+            counted_before = active_in(*row) if row else None
+
+        for attempt in range(1, SLUG_RETRIES + 1):
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                    counted_now = active_in(self.category_id, self.is_active)
+                    if counted_now != counted_before:
+                        if counted_before:
+                            adjust_category_counts(counted_before, -1)
+                        if counted_now:
+                            adjust_category_counts(counted_now, 1)
+                break
+            except IntegrityError:
+                # someone else took the same slug between allocate and insert,
+                # pick the next one. anything else (eg. duplicate sku) goes up
+                if (not auto_slug or attempt == SLUG_RETRIES
+                        or not slug_taken(self.slug, exclude_pk=self.pk)):
+                    raise
+                self.slug = allocate_slug(self.name, exclude_pk=self.pk)
+        self._counted_category = counted_now
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember which category this row counted towards when it was
+        # loaded, so save() only touches the category counters on a change
+        if 'category_id' in field_names and 'is_active' in field_names:
+            instance._counted_category = active_in(instance.category_id, instance.is_active)
+        return instance
 
     def __str__(self):
         return self.name
 
+    @property
+    def avg_rating(self):
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 1)
+
+    @cached_property
+    def recent_reviews(self):
+        # reads set this with serializers.recent_reviews_prefetch() instead
+        return list(
+            self.reviews.select_related('user').order_by('-created_at', '-id')[:REVIEW_PREVIEW_SIZE]
+        )
+
+    @property
+    def rating_distribution(self):
+        return {
+            str(star): getattr(self, field)
+            for star, field in STAR_FIELDS.items()
+        }
+
+    @property
+    def available_stock(self):
+        if not self.bucket_count:
+            return self.stock_quantity
+        total = getattr(self, 'bucket_stock_total', None)
+        if total is None:
+            total = self.buckets.aggregate(total=models.Sum('quantity'))['total'] or 0
+        return total
+
     @property
     def in_stock(self):
-        return self.stock_quantity > 0
+        return self.available_stock > 0
 
     @property
     def discount_percent(self):
@@ -90,6 +324,24 @@ class Product(models.Model):
         return 0
 
 
+class StockBucket(models.Model):
+    """One slice of a bucketed product's stock, see inventory.py"""
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='buckets'
+    )
+    bucket = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    objects = CatalogQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'stock_buckets'
+        unique_together = ['product', 'bucket']
+
+    def __str__(self):
+        return f"{self.product_id} bucket {self.bucket}: {self.quantity}"
+
+
 class ProductImage(models.Model):
     """Additional images for a product beyond the main image_url"""
     product = models.ForeignKey(
@@ -99,6 +351,8 @@ class ProductImage(models.Model):
     alt_text = models.CharField(max_length=200, blank=True)
     sort_order = models.PositiveSmallIntegerField(default=0)
 
+    objects = CatalogQuerySet.as_manager()
+
     class Meta:
         db_table = 'product_images'
         ordering = ['sort_order']
@@ -118,10 +372,85 @@ class Review(models.Model):
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CatalogQuerySet.as_manager()
+
     class Meta:
         db_table = 'reviews'
         ordering = ['-created_at']
         unique_together = ['product', 'user']
+        indexes = [
+            # keyset pages of one product's reviews, by recency or rating
+            models.Index(fields=['product', 'created_at', 'id']),
+            models.Index(fields=['product', 'rating', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.product.name} ({self.rating}/5)"
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding and self.pk:
+                # lock the old row so two edits of the same review cant
+                # both subtract the same old rating
+                previous = Review.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values_list('product_id', 'rating').first()
+
+            super().save(*args, **kwargs)
+
+            if previous is None:
+                adjust_rating(self.product_id, self.rating, 1)
+            elif previous != (self.product_id, self.rating):
+                adjust_rating(previous[0], previous[1], -1)
+                adjust_rating(self.product_id, self.rating, 1)
+
+
+class ProductImport(models.Model):
+    """A bulk CSV / NDJSON upload, processed by tasks.import_products"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+
+    seller = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+        related_name='product_imports'
+    )
+    file = models.FileField(upload_to='imports/%Y/%m/')
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # bytes of the file read so far, for a rough progress bar
+    file_size = models.PositiveBigIntegerField(default=0)
+    bytes_read = models.PositiveBigIntegerField(default=0)
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    # first few row errors inline, the full list goes into error_report
+    errors = models.JSONField(default=list, blank=True)
+    error_report = models.FileField(upload_to='imports/errors/%Y/%m/', blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'product_imports'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.status}) by {self.seller_id}"
+
+    @property
+    def progress(self):
+        if self.status == 'done':
+            return 100
+        if not self.file_size:
+            return 0
+        return min(99, int(self.bytes_read * 100 / self.file_size))
@@ -0,0 +1,82 @@
+"""
+Denormalized rating counters on Product.
+
+Review writes adjust the counters with F() expressions so concurrent
+reviews never lose an update. rebuild_ratings() recomputes everything from
+the reviews table in case the counters ever drift (raw SQL, fixtures etc).
+"""
+import logging
+
+from django.db.models import Count, F, Q, Sum
+
+logger = logging.getLogger(__name__)
+
+STAR_FIELDS = {star: f'rating_{star}' for star in range(1, 6)}
+RATING_FIELDS = ['rating_count', 'rating_sum', *STAR_FIELDS.values()]
+
+
+def adjust_rating(product_id, rating, delta):
+    """Add (delta=1) or remove (delta=-1) a single rating from a product."""
+    from .models import Product
+
+    updates = {
+        'rating_count': F('rating_count') + delta,
+        'rating_sum': F('rating_sum') + delta * rating,
+    }
+    star_field = STAR_FIELDS.get(rating)
+    if star_field:
+        updates[star_field] = F(star_field) + delta
+    Product.objects.filter(pk=product_id).touching([product_id]).update(**updates)
+
+
+def rebuild_ratings(product_ids=None, batch_size=1000):
+    """
+    Recompute the rating counters from scratch, batch_size products at a time.
+    Returns the number of products that were written.
+    """
+    from .models import Product, Review
+
+    products = Product.objects.order_by('pk')
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    aggregates = {
+        'count': Count('id'),
+        'total': Sum('rating'),
+    }
+    for star, field in STAR_FIELDS.items():
+        aggregates[field] = Count('id', filter=Q(rating=star))
+
+    updated = 0
+    last_pk = 0
+    while True:
+        chunk = list(
+            products.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1]
+
+        stats = {
+            row['product_id']: row
+            for row in Review.objects.filter(product_id__in=chunk)
+            .order_by()
+            .values('product_id')
+            .annotate(**aggregates)
+        }
+
+        objs = []
+        for pk in chunk:
+            row = stats.get(pk, {})
+            obj = Product(pk=pk)
+            obj.rating_count = row.get('count', 0)
+            obj.rating_sum = row.get('total') or 0
+            for field in STAR_FIELDS.values():
+                setattr(obj, field, row.get(field, 0))
+            objs.append(obj)
+
+        Product.objects.bulk_update(objs, RATING_FIELDS)
+        updated += len(objs)
+        logger.info(f"Rebuilt ratings for {updated} products")
+
+    return updated
@@ -0,0 +1,308 @@
+"""
+Ranked product search.
+
+Two interchangeable backends sit behind ProductSearchFilter:
+
+  PostgresSearchBackend  - a trigger-maintained tsvector column with a GIN
+                           index (see migration 0005), ranked with ts_rank
+  InvertedIndexBackend   - an in-process token -> postings index, used on
+                           SQLite and handy for offline benchmarking
+
+Both weight an exact SKU match above the SKU/name tokens, the name above
+the description, treat every search term as a prefix and require all
+terms to match (like SearchFilter did).
+
+search() returns (queryset, limit). The in-memory index ranks at most
+SEARCH_MAX_RESULTS matches - ranking is one CASE branch per row - so for a broad
+query limit says where the results were cut, and the product list shows
+it as search_limit next to the count. Postgres ranks every match.
+"""
+import bisect
+import logging
+import re
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import BooleanField, Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+WEIGHTS = {'sku': 1.0, 'name': 0.4, 'description': 0.1}
+EXACT_SKU_BOOST = 10.0
+PREFIX_PENALTY = 0.5  # a prefix hit counts for half an exact token hit
+
+logger = logging.getLogger(__name__)
+
+_token_re = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _token_re.findall((text or '').lower())
+
+
+class PostgresSearchBackend:
+    """Full text search on products.search_vector (Postgres only)."""
+
+    config = 'english'
+
+    def search(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none(), None
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        table = queryset.model._meta.db_table
+        return queryset.annotate(
+            search_match=RawSQL(
+                f"{table}.search_vector @@ to_tsquery(%s, %s)",
+                (self.config, tsquery), output_field=BooleanField(),
+            ),
+            search_rank=RawSQL(
+                f"ts_rank({table}.search_vector, to_tsquery(%s, %s))"
+                f" + CASE WHEN UPPER({table}.sku) = UPPER(%s) THEN %s ELSE 0 END",
+                (self.config, tsquery, query.strip(), EXACT_SKU_BOOST),
+                output_field=FloatField(),
+            ),
+        ).filter(search_match=True).order_by('-search_rank', '-pk'), None
+
+    def product_saved(self, product):
+        pass  # the trigger takes care of it
+
+    def product_deleted(self, pk):
+        pass
+
+    def products_saved(self, pks):
+        pass
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            # touching a column fires the update trigger for every row
+            cursor.execute("UPDATE products SET sku = sku")
+            return cursor.rowcount
+
+
+class InvertedIndexBackend:
+    """
+    In-memory inverted index.
+
+    Each process keeps its own copy, built in a thread on the first search
+    - searches fall back to an unranked ILIKE until it's ready. Saves in this process update it
+    directly; changes from other processes are picked up lazily - when the
+    catalog cache version moves, rows with a recent updated_at get
+    re-indexed. Deleted or deactivated products can linger in the index but
+    never show up, since results are always intersected with the view's
+    queryset.
+    """
+
+    # re-read this far back on each refresh, updated_at is set before commit
+    refresh_overlap = timedelta(minutes=5)
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings = defaultdict(dict)  # token -> {pk: weight}
+        self.doc_tokens = {}  # pk -> tokens, so a re-index can remove them
+        self.skus = {}  # lowered sku -> pk
+        self.sorted_tokens = []
+        self.dirty = False
+        self.built = False
+        self.building = False
+        self.synced_at = None
+        self.version = None
+
+    # -- indexing --
+
+    def _index(self, pk, sku, name, description):
+        self._remove(pk)
+        weights = defaultdict(float)
+        for token in tokenize(sku) + [sku.lower()]:
+            weights[token] = max(weights[token], WEIGHTS['sku'])
+        for token in tokenize(name):
+            weights[token] = max(weights[token], WEIGHTS['name'])
+        for token in tokenize(description):
+            weights[token] = max(weights[token], WEIGHTS['description'])
+
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self.dirty = True
+            self.postings[token][pk] = weight
+        self.doc_tokens[pk] = list(weights)
+        self.skus[sku.lower()] = pk
+
+    def _remove(self, pk):
+        for token in self.doc_tokens.pop(pk, ()):
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.pop(pk, None)
+                if not docs:
+                    del self.postings[token]
+                    self.dirty = True
+
+    def product_saved(self, product):
+        with self.lock:
+            if self.built:
+                self._index(product.pk, product.sku, product.name, product.description)
+
+    def product_deleted(self, pk):
+        with self.lock:
+            self._remove(pk)
+
+    def products_saved(self, pks):
+        """product_saved() for a bulk write that only has the pks."""
+        from .models import Product
+
+        with self.lock:
+            if not self.built:
+                return
+            rows = Product.objects.filter(pk__in=pks).values_list('pk', 'sku', 'name', 'description')
+            for row in rows.iterator(chunk_size=2000):
+                self._index(*row)
+
+    def rebuild(self):
+        from .models import Product
+
+        with self.lock:
+            self.postings.clear()
+            self.doc_tokens.clear()
+            self.skus.clear()
+            self.synced_at = timezone.now()
+            rows = Product.objects.values_list('pk', 'sku', 'name', 'description')
+            count = 0
+            for row in rows.iterator(chunk_size=2000):
+                self._index(*row)
+                count += 1
+            self.dirty = True
+            self.built = True
+            return count
+
+    def build_in_background(self):
+        with self.lock:
+            if self.built or self.building:
+                return
+            self.building = True
+        threading.Thread(target=self._background_build, daemon=True).start()
+
+    def _background_build(self):
+        try:
+            self.rebuild()
+        except DatabaseError:
+            logger.exception("Couldnt build the search index")
+        finally:
+            self.building = False
+            connection.close()  # this thread's own connection
+
+    def refresh(self):
+        from .cache import PRODUCTS, get_versions
+        from .models import Product
+
+        version = get_versions(PRODUCTS)[PRODUCTS]
+        with self.lock:
+            if not self.built:
+                self.rebuild()
+            elif version != self.version:
+                since = self.synced_at - self.refresh_overlap
+                self.synced_at = timezone.now()
+                rows = Product.objects.filter(updated_at__gte=since).values_list(
+                    'pk', 'sku', 'name', 'description'
+                )
+                for row in rows.iterator(chunk_size=2000):
+                    self._index(*row)
+            self.version = version
+            if self.dirty:
+                self.sorted_tokens = sorted(self.postings)
+                self.dirty = False
+
+    # -- querying --
+
+    def _term_scores(self, term):
+        scores = defaultdict(float)
+        start = bisect.bisect_left(self.sorted_tokens, term)
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(term):
+                break
+            factor = 1.0 if token == term else PREFIX_PENALTY
+            for pk, weight in self.postings[token].items():
+                scores[pk] = max(scores[pk], weight * factor)
+        return scores
+
+    def rank(self, query):
+        """[(pk, score)] best first, every match. Needs a built index."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self.refresh()
+        with self.lock:
+            totals = None
+            for term in terms:
+                scores = self._term_scores(term)
+                if totals is None:
+                    totals = scores
+                else:
+                    # every term has to match something
+                    totals = {pk: totals[pk] + s for pk, s in scores.items() if pk in totals}
+                if not totals:
+                    return []
+
+            exact = self.skus.get(query.strip().lower())
+            if exact in totals:
+                totals[exact] += EXACT_SKU_BOOST
+
+        return sorted(totals.items(), key=lambda item: (-item[1], -item[0]))
+
+    def unranked(self, queryset, query):
+        """SearchFilter's ILIKE, for while the index is being built."""
+        for term in tokenize(query):
+            queryset = queryset.filter(
+                Q(sku__icontains=term) | Q(name__icontains=term) | Q(description__icontains=term)
+            )
+        return queryset.order_by('-pk')
+
+    def search(self, queryset, query):
+        if not self.built:
+            self.build_in_background()
+            return self.unranked(queryset, query), None
+        ranked = self.rank(query)
+        if not ranked:
+            return queryset.none(), None
+        max_results = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+        limit = max_results if len(ranked) > max_results else None
+        ranked = ranked[:max_results]
+        return queryset.filter(pk__in=[pk for pk, _ in ranked]).annotate(
+            search_rank=Case(
+                *[When(pk=pk, then=Value(score)) for pk, score in ranked],
+                default=Value(0.0), output_field=FloatField(),
+            )
+        ).order_by('-search_rank', '-pk'), limit
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        else:
+            _backend = InvertedIndexBackend()
+    return _backend
+
+
+def product_saved(product):
+    backend = get_search_backend()
+    transaction.on_commit(lambda: backend.product_saved(product))
+
+
+def products_saved(pks):
+    backend = get_search_backend()
+    transaction.on_commit(lambda: backend.products_saved(pks))
+
+
+def product_deleted(pk):
+    backend = get_search_backend()
+    transaction.on_commit(lambda: backend.product_deleted(pk))
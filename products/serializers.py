@@ -1,29 +1,63 @@
+from decimal import Decimal
+
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Category, Product, ProductImage, Review
+
+from core.fieldsets import SparseFieldsetMixin
+from .models import REVIEW_PREVIEW_SIZE, Category, Product, ProductImage, ProductImport, Review
+from .tree import build_children_map
 
 
 class CategorySerializer(serializers.ModelSerializer):
-    product_count = serializers.SerializerMethodField()
+    product_count = serializers.ReadOnlyField()
+    subtree_product_count = serializers.ReadOnlyField()
     subcategories = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
         fields = [
-            'id', 'name', 'slug', 'description',
-            'parent', 'product_count', 'subcategories',
+            'id', 'name', 'slug', 'description', 'parent', 'depth',
+            'product_count', 'subtree_product_count', 'subcategories',
         ]
-        read_only_fields = ['slug']
-
-    def get_product_count(self, obj):
-        return obj.products.filter(is_active=True).count()
+        read_only_fields = ['slug', 'depth']
+
+    def validate_parent(self, parent):
+        if parent and self.instance and (
+            parent.pk == self.instance.pk or parent.is_descendant_of(self.instance)
+        ):
+            raise serializers.ValidationError(
+                "A category cant be moved under itself or one of its subcategories."
+            )
+        return parent
+
+    def _children_map(self, obj):
+        # one query for the tree, shared by every nested serializer through
+        # the context dict
+        children = self.context.get('category_children')
+        if children is None:
+            categories = Category.objects.all()
+            if not isinstance(self.parent, serializers.ListSerializer) and obj.path:
+                # a single category only needs its own subtree
+                categories = categories.filter(path__startswith=obj.path)
+            children = build_children_map(categories)
+            self.context['category_children'] = children
+        return children
 
     def get_subcategories(self, obj):
-        subs = obj.subcategories.all()
-        if subs.exists():
-            return CategorySerializer(subs, many=True).data
+        subs = self._children_map(obj).get(obj.pk)
+        if subs:
+            return CategorySerializer(subs, many=True, context=self.context).data
         return []
 
 
+class CategorySummarySerializer(serializers.ModelSerializer):
+    """Flat category for product payloads, off the joined row."""
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'parent', 'depth']
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
@@ -48,13 +82,52 @@ class ReviewSerializer(serializers.ModelSerializer):
         return value
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+# everything ReviewSerializer reads, the user comes in the same query
+REVIEW_COLUMNS = [
+    'id', 'product_id', 'rating', 'comment', 'created_at',
+    'user__email', 'user__username', 'user__first_name', 'user__last_name',
+]
+
+
+def recent_reviews_prefetch():
+    """Product.recent_reviews for a whole queryset, one windowed query."""
+    reviews = Review.objects.select_related('user').only(*REVIEW_COLUMNS)
+    return Prefetch(
+        'reviews',
+        queryset=reviews.order_by('-created_at', '-id')[:REVIEW_PREVIEW_SIZE],
+        to_attr='recent_reviews',
+    )
+
+
+# what the computed product fields read, for SparseFieldsetMixin.prune_queryset
+PRODUCT_FIELD_QUERIES = {
+    'seller_name': {
+        'select': ['seller'],
+        'only': ['seller__first_name', 'seller__last_name', 'seller__username'],
+    },
+    'in_stock': {
+        'only': ['stock_quantity', 'bucket_count'],
+        'annotate': ['with_available_stock'],
+    },
+    'stock_quantity': {
+        'only': ['stock_quantity', 'bucket_count'],
+        'annotate': ['with_available_stock'],
+    },
+    'discount_percent': {'only': ['price', 'compare_at_price']},
+    'avg_rating': {'only': ['rating_count', 'rating_sum']},
+    'recent_reviews': {'prefetch': [recent_reviews_prefetch()]},
+    'rating_distribution': {'only': ['rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']},
+}
+
+
+class ProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Lighter version for list view - skips nested reviews/images."""
     category_name = serializers.ReadOnlyField(source='category.name')
     seller_name = serializers.ReadOnlyField(source='seller.full_name')
     in_stock = serializers.ReadOnlyField()
     discount_percent = serializers.ReadOnlyField()
-    avg_rating = serializers.SerializerMethodField()
+    avg_rating = serializers.ReadOnlyField()
+    images = ProductImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
@@ -62,29 +135,31 @@ class ProductListSerializer(serializers.ModelSerializer):
             'id', 'name', 'slug', 'price', 'compare_at_price',
             'image_url', 'category_name', 'seller_name',
             'in_stock', 'discount_percent', 'avg_rating', 'created_at',
+            'description', 'images',
         ]
-
-    def get_avg_rating(self, obj):
-        reviews = obj.reviews.all()
-        if not reviews:
-            return None
-        total = sum(r.rating for r in reviews)
-        return round(total / len(reviews), 1)
-
-
-class ProductDetailSerializer(serializers.ModelSerializer):
-    """Full serializer with nested reviews, images, etc."""
-    category = CategorySerializer(read_only=True)
+        # only with ?expand=description,images
+        expandable_fields = ['description', 'images']
+        field_queries = PRODUCT_FIELD_QUERIES
+
+
+class ProductDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Full serializer for one product. Its size doesnt grow with the product's
+    popularity: a few recent reviews and the star counts, the full list is
+    paged at /reviews/.
+    """
+    category = CategorySummarySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(), source='category', write_only=True
     )
     images = ProductImageSerializer(many=True, read_only=True)
-    reviews = ReviewSerializer(many=True, read_only=True)
+    recent_reviews = ReviewSerializer(many=True, read_only=True)
     seller_name = serializers.ReadOnlyField(source='seller.full_name')
     in_stock = serializers.ReadOnlyField()
     discount_percent = serializers.ReadOnlyField()
-    avg_rating = serializers.SerializerMethodField()
-    review_count = serializers.SerializerMethodField()
+    avg_rating = serializers.ReadOnlyField()
+    review_count = serializers.ReadOnlyField(source='rating_count')
+    rating_distribution = serializers.ReadOnlyField()
 
     class Meta:
         model = Product
@@ -93,17 +168,65 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'sku', 'stock_quantity', 'category', 'category_id',
             'seller', 'seller_name', 'image_url', 'images',
             'is_active', 'in_stock', 'discount_percent',
-            'avg_rating', 'review_count', 'reviews',
+            'avg_rating', 'review_count', 'rating_distribution', 'recent_reviews',
             'created_at', 'updated_at',
         ]
         read_only_fields = ['slug', 'seller', 'created_at', 'updated_at']
+        field_queries = PRODUCT_FIELD_QUERIES
+
+    def to_representation(self, instance):
+        return self.adjust_representation(instance, super().to_representation(instance))
+
+    def adjust_representation(self, instance, data):
+        # shared with the compiled serializer (core/compiled.py)
+        if 'stock_quantity' in data and instance.bucket_count:
+            # stock_quantity is only a snapshot for bucketed products
+            data['stock_quantity'] = instance.available_stock
+        return data
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    """One row of a bulk import file, see importers.py"""
+    sku = serializers.CharField(max_length=50)
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    compare_at_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False, allow_null=True
+    )
+    stock_quantity = serializers.IntegerField(min_value=0, default=0)
+    # category slug, looked up in bulk by the importer
+    category = serializers.SlugField(required=False, allow_null=True)
+    image_url = serializers.URLField(required=False, allow_null=True)
+    is_active = serializers.BooleanField(default=True)
 
-    def get_avg_rating(self, obj):
-        reviews = obj.reviews.all()
-        if not reviews:
-            return None
-        total = sum(r.rating for r in reviews)
-        return round(total / len(reviews), 1)
 
-    def get_review_count(self, obj):
-        return len(obj.reviews.all())
+class ProductImportSerializer(serializers.ModelSerializer):
+    progress = serializers.ReadOnlyField()
+
+    class Meta:
+        model = ProductImport
+        fields = [
+            'id', 'file', 'file_format', 'status', 'progress',
+            'rows_processed', 'created_count', 'updated_count',
+            'error_count', 'errors', 'message', 'created_at', 'finished_at',
+        ]
+        read_only_fields = [
+            'status', 'rows_processed', 'created_count', 'updated_count',
+            'error_count', 'errors', 'message', 'created_at', 'finished_at',
+        ]
+        extra_kwargs = {
+            'file': {'write_only': True},
+            'file_format': {'required': False},
+        }
+
+    def validate(self, attrs):
+        from .importers import detect_format
+
+        if not attrs.get('file_format'):
+            attrs['file_format'] = detect_format(attrs['file'].name)
+            if not attrs['file_format']:
+                raise serializers.ValidationError(
+                    {'file_format': "Cant tell the format from the file name, pass csv or ndjson."}
+                )
+        return attrs
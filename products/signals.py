@@ -0,0 +1,104 @@
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from accounts.models import PUBLIC_FIELDS
+
+from .cache import bump_for_model
+from .models import Category, Product, ProductImage, Review
+from .ratings import adjust_rating
+from .search import product_deleted, product_saved
+from .tree import active_in, adjust_category_counts, rollup_subtree_counts
+
+User = get_user_model()
+
+
+def deleting_products(origin):
+    """
+    Whether a delete started from products (a product or a queryset of
+    them). Their reviews and images only go with them as a cascade, and
+    there is no product left to update.
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is Product
+    return isinstance(origin, Product)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, origin=None, **kwargs):
+    # post_delete also fires for cascades and queryset.delete(), which
+    # Review.delete() alone wouldnt catch
+    if not deleting_products(origin):
+        adjust_rating(instance.product_id, instance.rating, -1)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=Review)
+def touch_product(sender, instance, origin=None, **kwargs):
+    # the product's ETag / Last-Modified come from updated_at, and its
+    # reviews and images are part of the detail payload
+    if deleting_products(origin):
+        return
+    Product.objects.filter(pk=instance.product_id).touching([instance.product_id]).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_category_counts(sender, instance, **kwargs):
+    category_id = active_in(instance.category_id, instance.is_active)
+    if category_id:
+        adjust_category_counts(category_id, -1)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    product_saved(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    product_deleted(instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+def rollup_after_category_delete(sender, instance, **kwargs):
+    # its products were moved to no category by SET_NULL, which is a bulk
+    # update, so just recompute the ancestors' subtree totals
+    rollup_subtree_counts()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=Review)
+def invalidate_catalog_cache(sender, instance, origin=None, **kwargs):
+    # a product (or its review / image) only drops its own cached detail,
+    # a category drops them all. the product's own delete covers its
+    # cascaded reviews and images
+    if sender in (Review, ProductImage) and deleting_products(origin):
+        return
+    product_id = instance.pk if sender is Product else getattr(instance, 'product_id', None)
+    bump_for_model(sender, product_ids=None if product_id is None else [product_id])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_names(sender, instance, created, update_fields=None, **kwargs):
+    # products and reviews show the seller's / author's name. a new user
+    # has neither yet, and last_login saves dont change what's shown
+    if created:
+        return
+    if update_fields is not None and not set(update_fields) & set(PUBLIC_FIELDS):
+        return
+    values = instance.public_values()
+    if getattr(instance, '_public_values', None) != values:
+        bump_for_model(sender)
+        instance._public_values = values
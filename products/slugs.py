@@ -0,0 +1,98 @@
+"""
+Product slug allocation.
+
+Instead of probing slug, slug-1, slug-2 ... one query at a time, fetch every
+slug already taken for the base in one go and hand out the next suffix.
+Two requests can still pick the same one at the same moment, so
+Product.save retries on the unique index (see SLUG_RETRIES).
+
+Slugs that products/urls.py routes under /products/ (RESERVED_SLUGS) are
+never handed out bare, a product named "Export" gets export-1.
+"""
+import re
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from django.utils.text import slugify
+
+SLUG_RETRIES = 5
+QUERY_BATCH = 500  # bases per query in assign_slugs
+RESERVED_SLUGS = {'export'}
+
+_suffix_re = re.compile(r'^(.*)-(\d+)$')
+
+
+def base_slug(name, max_length=255):
+    # leave room for a -NNNNN suffix under the 270 char column
+    return slugify(name)[:max_length].strip('-') or 'product'
+
+
+def _highest_suffixes(bases, exclude_pk=None):
+    """
+    {base: highest suffix in use} for the given bases, with the bare base
+    counting as 0. Bases that arent taken at all are left out, reserved
+    ones always count as taken.
+    """
+    from .models import Product
+
+    bases = set(bases)
+    highest = {}
+    base_list = sorted(bases)
+    for i in range(0, len(base_list), QUERY_BATCH):
+        chunk = base_list[i:i + QUERY_BATCH]
+        # startswith can use the slug index (the _like one on Postgres)
+        taken = Product.objects.filter(reduce(or_, [
+            Q(slug=base) | Q(slug__startswith=f'{base}-') for base in chunk
+        ]))
+        if exclude_pk is not None:
+            taken = taken.exclude(pk=exclude_pk)
+
+        for slug in taken.values_list('slug', flat=True).iterator():
+            if slug in bases:
+                highest[slug] = max(highest.get(slug, 0), 0)
+            match = _suffix_re.match(slug)
+            if match and match.group(1) in bases:
+                base, n = match.group(1), int(match.group(2))
+                highest[base] = max(highest.get(base, 0), n)
+    for base in bases & RESERVED_SLUGS:
+        highest.setdefault(base, 0)
+    return highest
+
+
+def allocate_slug(name, exclude_pk=None):
+    """Next free slug for name, in one query."""
+    base = base_slug(name)
+    highest = _highest_suffixes([base], exclude_pk=exclude_pk).get(base)
+    return base if highest is None else f'{base}-{highest + 1}'
+
+
+def slug_taken(slug, exclude_pk=None):
+    from .models import Product
+
+    return Product.objects.filter(slug=slug).exclude(pk=exclude_pk).exists()
+
+
+def assign_slugs(products):
+    """
+    Give every unsaved product without a slug a unique one, for bulk_create
+    paths. One query per QUERY_BATCH distinct names rather than one (or
+    many) per product. Products in the same batch with the same name get
+    consecutive suffixes.
+    """
+    pending = [p for p in products if not p.slug]
+    if not pending:
+        return products
+
+    bases = {id(p): base_slug(p.name) for p in pending}
+    highest = _highest_suffixes(set(bases.values()))
+
+    for product in pending:
+        base = bases[id(product)]
+        if base not in highest:
+            product.slug = base
+            highest[base] = 0
+        else:
+            highest[base] += 1
+            product.slug = f'{base}-{highest[base]}'
+    return products
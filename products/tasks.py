@@ -35,17 +35,40 @@ def notify_low_stock(product_id):
 @shared_task
 def update_product_ratings():
     """
-    Batch job to recompute average ratings.
-    Would be scheduled with celery beat in production (eg. every hour).
+    Repair job for the denormalized rating counters on Product.
+    Reviews keep them up to date incrementally, this just catches any drift.
+    Would be scheduled with celery beat in production (eg. once a night).
     """
-    from django.db.models import Avg
-    from .models import Product
-
-    products = Product.objects.annotate(avg=Avg('reviews__rating'))
-    count = 0
-    for p in products:
-        if p.avg is not None:
-            logger.info(f"{p.name}: avg rating = {p.avg:.1f}")
-            count += 1
+    from .ratings import rebuild_ratings
 
+    count = rebuild_ratings()
     return f"Updated ratings for {count} products"
+
+
+@shared_task
+def sync_bucketed_stock():
+    """
+    Refresh products.stock_quantity from the stock buckets of hot products.
+    The api reads the live bucket totals, this just keeps the column (admin,
+    low stock checks, exports) close. Every minute or so is plenty.
+    """
+    from .inventory import sync_bucketed_stock as sync
+
+    count = sync()
+    return f"Synced stock for {count} bucketed products"
+
+
+@shared_task
+def import_products(import_id):
+    """Run a bulk product import uploaded through the api."""
+    from .importers import run_import
+    from .models import ProductImport
+
+    try:
+        job = ProductImport.objects.select_related('seller').get(pk=import_id)
+    except ProductImport.DoesNotExist:
+        logger.warning(f"Product import {import_id} not found")
+        return
+
+    job = run_import(job)
+    return f"Import {import_id} {job.status}: {job.created_count} created, {job.updated_count} updated"
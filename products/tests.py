@@ -1,14 +1,52 @@
-from django.test import TestCase
-from rest_framework.test import APIClient
+import csv
+import gzip
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
 from django.contrib.auth import get_user_model
 
-from .models import Category, Product
+from core.compiled import compile_serializer
+from core.metrics import install_sql_hook
+from core.querybudget import QueryBudgetExceeded, QueryBudgetMixin, check, query_budget
+from orders.models import OrderItem
+
+from .cache import get_detail_versions
+from .importers import OTHER_SELLER, ProductImporter, read_rows, run_import
+from .models import Category, Product, ProductImage, ProductImport, Review
+from .inventory import decrement_stock, increment_stock, set_bucket_count
+from .ratings import rebuild_ratings
+from .search import InvertedIndexBackend, get_search_backend
+from .serializers import (
+    CategorySerializer, ProductDetailSerializer, ProductListSerializer, recent_reviews_prefetch,
+)
+from .slugs import allocate_slug, assign_slugs
+from .tree import rebuild_category_tree
 
 User = get_user_model()
 
 
-class CategoryTests(TestCase):
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class CategoryTests(QueryBudgetMixin, TestCase):
 
     def setUp(self):
         self.client = APIClient()
@@ -38,7 +76,74 @@ class CategoryTests(TestCase):
         self.assertEqual(resp.status_code, 201)
 
 
-class ProductTests(TestCase):
+    def test_tree_counts_and_constant_queries(self):
+        seller = User.objects.create_user(
+            email='treeseller@test.com', username='treeseller',
+            password='SellerPass123!', is_seller=True,
+        )
+        root = Category.objects.create(name='Electronics')
+        phones = Category.objects.create(name='Phones', parent=root)
+        android = Category.objects.create(name='Android', parent=phones)
+        for i in range(3):
+            Product.objects.create(
+                name=f'Phone {i}', description='phone', price='100.00',
+                sku=f'PH-{i}', category=android, seller=seller,
+            )
+        Product.objects.create(
+            name='Old phone', description='phone', price='10.00',
+            sku='PH-OLD', category=phones, seller=seller, is_active=False,
+        )
+
+        root.refresh_from_db()
+        android.refresh_from_db()
+        self.assertEqual(android.path, f'{root.pk}/{phones.pk}/{android.pk}/')
+        self.assertEqual(android.product_count, 3)
+        self.assertEqual(root.product_count, 0)
+        self.assertEqual(root.subtree_product_count, 3)
+
+        # page + count + one query for the whole tree, however deep it is
+        with self.assertNumQueries(3):
+            resp = self.client.get('/api/v1/categories/')
+        by_slug = {c['slug']: c for c in resp.data['results']}
+        self.assertEqual(by_slug['electronics']['subtree_product_count'], 3)
+        nested = by_slug['electronics']['subcategories'][0]['subcategories'][0]
+        self.assertEqual(nested['slug'], 'android')
+        self.assertEqual(nested['product_count'], 3)
+
+    def test_moving_category_updates_paths_and_counts(self):
+        seller = User.objects.create_user(
+            email='moveseller@test.com', username='moveseller',
+            password='SellerPass123!', is_seller=True,
+        )
+        a = Category.objects.create(name='A')
+        b = Category.objects.create(name='B')
+        child = Category.objects.create(name='Child', parent=a)
+        leaf = Category.objects.create(name='Leaf', parent=child)
+        Product.objects.create(
+            name='Thing', description='x', price='1.00', sku='TH-1',
+            category=leaf, seller=seller,
+        )
+
+        child.parent = b
+        child.save()
+
+        leaf.refresh_from_db()
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual(leaf.path, f'{b.pk}/{child.pk}/{leaf.pk}/')
+        self.assertEqual(leaf.depth, 2)
+        self.assertEqual(a.subtree_product_count, 0)
+        self.assertEqual(b.subtree_product_count, 1)
+
+        self.client.force_authenticate(user=self.admin)
+        resp = self.client.patch(
+            f'/api/v1/categories/{b.slug}/', {'parent': leaf.pk}, format='json'
+        )
+        self.assertEqual(resp.status_code, 400)
+
+
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class ProductTests(QueryBudgetMixin, TestCase):
 
     def setUp(self):
         self.client = APIClient()
@@ -51,6 +156,8 @@ class ProductTests(TestCase):
             password='BuyerPass123!', is_seller=False,
         )
         self.category = Category.objects.create(name='Electronics')
+        # the first search would build it in a thread and answer unranked
+        get_search_backend().rebuild()
 
         self.product_data = {
             'name': 'Wireless Mouse',
@@ -128,9 +235,533 @@ class ProductTests(TestCase):
         self.assertLessEqual(float(results[0]['price']), float(results[1]['price']))
 
 
-class ReviewTests(TestCase):
+    def test_cursor_pagination_walks_every_product(self):
+        # lots of price ties so the pk tiebreaker actually matters
+        for i in range(30):
+            Product.objects.create(
+                name=f'Cable {i}', description='cable', sku=f'CB-{i:03d}',
+                price='5.00' if i % 2 else '7.50', stock_quantity=1,
+                category=self.category, seller=self.seller,
+            )
+
+        seen = []
+        url = '/api/v1/products/?ordering=price&pagination=cursor'
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn('count', resp.data)
+            seen.extend(p['id'] for p in resp.data['results'])
+            url = resp.data['next']
+
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+
+        # and back again from the last page
+        resp = self.client.get(resp.data['previous'])
+        self.assertEqual(
+            [p['id'] for p in resp.data['results']], seen[12:24]
+        )
+
+    def test_bad_cursor_is_404(self):
+        resp = self.client.get('/api/v1/products/?cursor=garbage')
+        self.assertEqual(resp.status_code, 404)
+
+
+    def test_list_cache_invalidated_by_writes(self):
+        self._create_product()
+        self.client.logout()
+        resp = self.client.get('/api/v1/products/?ordering=price')
+        self.assertEqual(resp.data['results'][0]['price'], '29.99')
+
+        # bulk update skips post_save, the queryset still has to invalidate
+        Product.objects.filter(sku='WM-001').update(price='19.99')
+        resp = self.client.get('/api/v1/products/?ordering=price')
+        self.assertEqual(resp.data['results'][0]['price'], '19.99')
+
+        Category.objects.filter(pk=self.category.pk).update(name='Gadgets')
+        resp = self.client.get('/api/v1/products/?ordering=price')
+        self.assertEqual(resp.data['results'][0]['category_name'], 'Gadgets')
+
+    def test_seller_rename_drops_cached_names(self):
+        slug = self._create_product().data['slug']
+        self.client.logout()
+        self.client.get('/api/v1/products/')
+        self.client.get(f'/api/v1/products/{slug}/')
+
+        seller = User.objects.get(pk=self.seller.pk)
+        seller.last_login = timezone.now()
+        seller.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/products/')
+
+        seller.first_name, seller.last_name = 'Ada', 'Lovelace'
+        seller.save()
+        resp = self.client.get('/api/v1/products/')
+        self.assertEqual(resp.data['results'][0]['seller_name'], 'Ada Lovelace')
+        resp = self.client.get(f'/api/v1/products/{slug}/')
+        self.assertEqual(resp.data['seller_name'], 'Ada Lovelace')
+
+    def test_renames_change_the_validators(self):
+        slug = self._create_product().data['slug']
+        Review.objects.create(product=Product.objects.get(slug=slug), user=self.buyer, rating=4)
+        self.client.logout()
+        url, reviews_url = f'/api/v1/products/{slug}/', f'/api/v1/products/{slug}/reviews/'
+        detail, reviews = self.client.get(url), self.client.get(reviews_url)
+
+        seller = User.objects.get(pk=self.seller.pk)
+        seller.first_name = 'Ada'
+        seller.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['seller_name'], 'Ada')
+        self.assertNotEqual(resp['ETag'], detail['ETag'])
+
+        buyer = User.objects.get(pk=self.buyer.pk)
+        buyer.first_name = 'Grace'
+        buyer.save()
+        resp = self.client.get(reviews_url, HTTP_IF_NONE_MATCH=reviews['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['results'][0]['user_name'], 'Grace')
+        resp = self.client.get(reviews_url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_list_cache_shared_across_buyers(self):
+        self._create_product()
+        self.client.force_authenticate(user=self.buyer)
+        self.client.get('/api/v1/products/?search=mouse&ordering=price')
+
+        # same params in a different order, different user - no queries
+        other = User.objects.create_user(
+            email='other@test.com', username='other', password='OtherPass123!',
+        )
+        self.client.force_authenticate(user=other)
+        with self.assertNumQueries(0):
+            resp = self.client.get('/api/v1/products/?ordering=price&search=mouse')
+        self.assertEqual(len(resp.data['results']), 1)
+
+
+    def test_conditional_get(self):
+        self._create_product()
+        product = Product.objects.get(sku='WM-001')
+        self.client.logout()
+        url = f'/api/v1/products/{product.slug}/'
+
+        resp = self.client.get(url)
+        etag, last_modified = resp['ETag'], resp['Last-Modified']
+        self.assertIn('Authorization', resp['Vary'])
+
+        # the cached detail answers with its stored validators, no queries
+        with self.assertNumQueries(0):
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], etag)
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(resp.status_code, 304)
+
+        # an order took stock -> new validators
+        decrement_stock({product.pk: 1})
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['stock_quantity'], 49)
+
+        reviews_url = f'{url}reviews/'
+        etag = self.client.get(reviews_url)['ETag']
+        Review.objects.create(product=product, user=self.buyer, rating=5, comment='Good')
+        resp = self.client.get(reviews_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data['results']), 1)
+
+        # lists only need the version tokens
+        etag = self.client.get('/api/v1/products/')['ETag']
+        with self.assertNumQueries(0):
+            resp = self.client.get('/api/v1/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        Product.objects.filter(pk=product.pk).update(price='19.99')
+        resp = self.client.get('/api/v1/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['results'][0]['price'], '19.99')
+
+        # sellers get a different list
+        self.client.force_authenticate(user=self.seller)
+        resp = self.client.get('/api/v1/products/', HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 200)
+
+    def test_detail_cache(self):
+        self._create_product()
+        product = Product.objects.get(sku='WM-001')
+        url = f'/api/v1/products/{product.slug}/'
+        self.client.logout()
+
+        self.assertEqual(self.client.get(url).data['price'], '29.99')
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+        self.assertEqual(resp.data['stock_quantity'], 50)
+
+        # every write to the product drops its entry
+        self.client.force_authenticate(user=self.seller)
+        self.client.patch(url, {'price': '24.99'}, format='json')
+        self.client.logout()
+        self.assertEqual(self.client.get(url).data['price'], '24.99')
+        decrement_stock({product.pk: 5})
+        self.assertEqual(self.client.get(url).data['stock_quantity'], 45)
+        increment_stock({product.pk: 2})
+        self.assertEqual(self.client.get(url).data['stock_quantity'], 47)
+        Review.objects.create(product=product, user=self.buyer, rating=2, comment='meh')
+        self.assertEqual(self.client.get(url).data['recent_reviews'][0]['comment'], 'meh')
+        ProductImage.objects.create(product=product, image_url='https://img.test/m.png')
+        self.assertEqual(len(self.client.get(url).data['images']), 1)
+        Category.objects.filter(pk=self.category.pk).update(name='Gadgets')
+        self.assertEqual(self.client.get(url).data['category']['name'], 'Gadgets')
+
+        # ...but not anyone else's
+        other = Product.objects.create(
+            name='Cable', description='cable', price='5.00', sku='CB-1',
+            stock_quantity=3, category=self.category, seller=self.seller,
+        )
+        self.client.get(url)
+        decrement_stock({other.pk: 1})
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        # a renamed product is gone from its old slug
+        product.refresh_from_db()
+        product.slug = 'renamed-mouse'
+        product.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = '/api/v1/products/renamed-mouse/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # the seller's copy of a hidden product never reaches the public
+        Product.objects.filter(pk=product.pk).update(is_active=False)
+        self.client.force_authenticate(user=self.seller)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_server_timing_and_metrics(self):
+        self._create_product()
+        staff = User.objects.create_user(
+            email='staff@test.com', username='staff', password='StaffPass123!', is_staff=True,
+        )
+
+        self.client.logout()
+        resp = self.client.get('/api/v1/products/')
+        self.assertNotIn('Server-Timing', resp)
+
+        self.client.force_authenticate(user=staff)
+        resp = self.client.get('/api/v1/products/?ordering=price')
+        timing = resp['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r'cache;dur=[\d.]+;desc="\d+ hits [1-9]\d* misses"')
+        self.assertIn('serialize;dur=', timing)
+        # served from the response cache this time
+        resp = self.client.get('/api/v1/products/?ordering=price')
+        self.assertIn('db;dur=0.0;desc="0 queries"', resp['Server-Timing'])
+
+        with override_settings(METRICS_TOKEN='scrape-me'):
+            self.client.logout()
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            resp = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(resp.status_code, 200)
+        body = resp.content.decode()
+        self.assertIn('http_request_duration_seconds_bucket{view="ProductViewSet.list",le="+Inf"}', body)
+        self.assertIn('http_requests_total{view="ProductViewSet.create",status="201"}', body)
+        self.assertRegex(body, r'db_queries_total\{view="ProductViewSet.list"\} [1-9]')
+
+    def test_search_ranking(self):
+        def make(name, sku, description):
+            return Product.objects.create(
+                name=name, sku=sku, description=description, price='10.00',
+                stock_quantity=5, category=self.category, seller=self.seller,
+            )
+
+        in_description = make('Desk Lamp', 'LMP-1', 'bright enough to read a keyboard manual')
+        in_name = make('Mechanical Keyboard', 'KB-2', 'clicky switches')
+        by_sku = make('Something Else', 'KEYB-9', 'not related')
+
+        # prefix match, name beats description
+        resp = self.client.get('/api/v1/products/?search=keyb')
+        slugs = [p['slug'] for p in resp.data['results']]
+        self.assertEqual(slugs[:2], [by_sku.slug, in_name.slug])
+        self.assertEqual(slugs[-1], in_description.slug)
+
+        # exact sku wins outright, and all terms have to match
+        resp = self.client.get('/api/v1/products/?search=KB-2')
+        self.assertEqual(resp.data['results'][0]['slug'], in_name.slug)
+        resp = self.client.get('/api/v1/products/?search=keyboard lamp')
+        self.assertEqual([p['slug'] for p in resp.data['results']], [in_description.slug])
+
+        # picks up renames
+        in_name.name = 'Trackball'
+        in_name.save()
+        resp = self.client.get('/api/v1/products/?search=mechanical')
+        self.assertEqual(resp.data['results'], [])
+
+    def _in_memory_search(self):
+        # the cap and the background build are the in-memory index's, on
+        # postgres too
+        backend = InvertedIndexBackend()
+        swap = patch('products.search._backend', backend)
+        swap.start()
+        self.addCleanup(swap.stop)
+        backend.rebuild()
+        return backend
+
+    def test_search_limit(self):
+        self._in_memory_search()
+        for i in range(3):
+            Product.objects.create(
+                name=f'Cable {i}', sku=f'CBL-{i}', description='usb', price='1.00',
+                stock_quantity=5, category=self.category, seller=self.seller,
+            )
+
+        with override_settings(SEARCH_MAX_RESULTS=2):
+            resp = self.client.get('/api/v1/products/?search=cable')
+        self.assertEqual((resp.data['count'], resp.data['search_limit']), (2, 2))
+        self.assertEqual(len(resp.data['results']), 2)
+
+        with override_settings(SEARCH_MAX_RESULTS=3):
+            resp = self.client.get('/api/v1/products/?search=usb cable')
+        self.assertEqual(resp.data['count'], 3)
+        self.assertNotIn('search_limit', resp.data)
+
+    def test_search_before_the_index_is_built(self):
+        backend = self._in_memory_search()
+        self._create_product()
+        backend.built = False
+
+        with patch.object(type(backend), 'build_in_background') as build:
+            resp = self.client.get('/api/v1/products/?search=wireless mou')
+        build.assert_called_once_with()
+        self.assertEqual([p['name'] for p in resp.data['results']], ['Wireless Mouse'])
+
+    def test_export_streams_active_products(self):
+        old = Product.objects.create(
+            name='Old', sku='OLD-1', description='x', price='3.50',
+            stock_quantity=4, category=self.category, seller=self.seller,
+        )
+        Product.objects.filter(pk=old.pk).update(updated_at=timezone.now() - timedelta(days=30))
+        Product.objects.create(
+            name='New', sku='NEW-1', description='line one\nline two', price='9.99',
+            stock_quantity=2, category=self.category, seller=self.seller,
+        )
+        Product.objects.create(
+            name='Hidden', sku='HID-1', description='x', price='1.00',
+            seller=self.seller, is_active=False,
+        )
+
+        self.client.force_authenticate(user=self.buyer)
+        # the stream is consumed after the view returns, one query for all rows
+        resp = self.client.get('/api/v1/products/export/')
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        with self.assertNumQueries(1):
+            rows = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+        self.assertEqual([r['sku'] for r in rows], ['OLD-1', 'NEW-1'])
+        self.assertEqual(rows[1]['price'], '9.99')
+        self.assertEqual(rows[1]['category'], 'electronics')
+
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        resp = self.client.get(
+            f'/api/v1/products/export/?output=csv&updated_since={since}',
+            HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(resp.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([r['sku'] for r in rows], ['NEW-1'])
+        self.assertEqual(rows[0]['description'], 'line one\nline two')
+
+        resp = self.client.get('/api/v1/products/export/?updated_since=yesterday')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_export_honours_gzip_q_values(self):
+        self.client.force_authenticate(user=self.buyer)
+        for header, gzipped in [('gzip;q=0', False), ('br, gzip; q=0.0', False),
+                                ('identity, *;q=0.5', True), ('GZIP;q=1', True), ('br', False)]:
+            resp = self.client.get('/api/v1/products/export/', HTTP_ACCEPT_ENCODING=header)
+            b''.join(resp.streaming_content)
+            self.assertEqual(resp.has_header('Content-Encoding'), gzipped, header)
+
+    def test_export_slug_is_reserved(self):
+        self.product_data['name'] = 'Export'
+        resp = self._create_product()
+        self.assertEqual(resp.data['slug'], 'export-1')
+        self.assertEqual(self.client.get('/api/v1/products/export-1/').data['name'], 'Export')
+        # bulk writes (the importer) skip it too
+        [product] = assign_slugs([Product(name='export', sku='EXP-2', price='1.00', seller=self.seller)])
+        self.assertEqual(product.slug, 'export-2')
+
+    def test_sparse_fieldsets_prune_the_query(self):
+        for i in range(3):
+            product = Product.objects.create(
+                name=f'Mouse {i}', sku=f'M-{i}', description='x', price='10.00',
+                stock_quantity=3, category=self.category, seller=self.seller,
+            )
+            ProductImage.objects.create(product=product, image_url=f'https://img.test/{i}.png')
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get('/api/v1/products/?fields=id,name,slug,price,image_url')
+        self.assertEqual(
+            list(resp.data['results'][0]), ['id', 'name', 'slug', 'price', 'image_url']
+        )
+        page_sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('JOIN', page_sql)
+        self.assertNotIn('"description"', page_sql)
+
+        # full default set: still a fixed number of queries, no lazy loads
+        with self.assertNumQueries(2):
+            resp = self.client.get('/api/v1/products/?ordering=name')
+        self.assertNotIn('images', resp.data['results'][0])
+        self.assertEqual(resp.data['results'][0]['seller_name'], 'seller')
+        self.assertTrue(resp.data['results'][0]['in_stock'])
+
+        with self.assertNumQueries(3):
+            resp = self.client.get('/api/v1/products/?fields=name,avg_rating&expand=images')
+        self.assertEqual(list(resp.data['results'][0]), ['name', 'avg_rating', 'images'])
+        self.assertEqual(len(resp.data['results'][0]['images']), 1)
+
+        resp = self.client.get(f'/api/v1/products/{product.slug}/?fields=name,stock_quantity')
+        self.assertEqual(resp.data, {'name': 'Mouse 2', 'stock_quantity': 3})
+
+        resp = self.client.get('/api/v1/products/?fields=name,password')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_compiled_serializers_match_drf(self):
+        buyer = User.objects.create_user(
+            email='reviewer@test.com', username='reviewer', password='Pass123!',
+            first_name='Ann', last_name='Lee',
+        )
+        with_everything = Product.objects.create(
+            name='Keyboard', sku='KB-1', description='x', price='49.90',
+            compare_at_price='59.95', stock_quantity=8, category=self.category,
+            seller=self.seller, image_url='https://img.test/kb.png',
+        )
+        ProductImage.objects.create(product=with_everything, image_url='https://img.test/1.png')
+        Review.objects.create(product=with_everything, user=buyer, rating=4, comment='ok')
+        Product.objects.create(
+            name='No category', sku='NC-1', description='x', price='0.50', seller=self.seller,
+        )
+        set_bucket_count(with_everything, 4)
+
+        def request(query=''):
+            return Request(APIRequestFactory().get(f'/api/v1/products/{query}'))
+
+        def render(data):
+            return JSONRenderer().render(data)
+
+        products = list(Product.objects.select_related('category', 'seller').prefetch_related(
+            'images', recent_reviews_prefetch()).with_available_stock())
+        for serializer_class, query in [
+            (ProductListSerializer, ''),
+            (ProductListSerializer, '?expand=images,description'),
+            (ProductDetailSerializer, ''),
+        ]:
+            context = {'request': request(query)}
+            drf = serializer_class(products, many=True, context=context).data
+            compiled = compile_serializer(serializer_class(context=context))
+            self.assertEqual(render(compiled.serialize(products)), render(drf))
+
+        # narrow requests read straight off .values() rows
+        context = {'request': request('?fields=id,name,price,category_name,created_at')}
+        compiled = compile_serializer(ProductListSerializer(context=context))
+        self.assertIsNotNone(compiled.value_columns)
+        rows = Product.objects.order_by('pk').values(*compiled.value_columns)
+        drf = ProductListSerializer(Product.objects.order_by('pk'), many=True, context=context).data
+        self.assertEqual(render(compiled.serialize(rows)), render(drf))
+        # no category - DRF leaves category_name out, so does the compiled one
+        self.assertNotIn('category_name', compiled.serialize(rows)[1])
+
+    def test_compiled_plans_are_reused(self):
+        def compiled(serializer_class, query=''):
+            request = Request(APIRequestFactory().get(f'/api/v1/products/{query}'))
+            return compile_serializer(serializer_class(context={'request': request}))
+
+        first, second = compiled(ProductDetailSerializer), compiled(ProductDetailSerializer)
+        self.assertIs(first.functions, second.functions)
+        self.assertIsNot(first.serializer, second.serializer)
+        self.assertIs(second.adjust.__self__, second.serializer)
+        # other fields, other plan
+        narrow = compiled(ProductDetailSerializer, '?fields=id,name')
+        self.assertIsNot(narrow.functions, first.functions)
+        # SerializerMethodField reads its own serializer, compiled every time
+        self.assertIsNot(
+            compile_serializer(CategorySerializer()).functions,
+            compile_serializer(CategorySerializer()).functions,
+        )
+
+    def test_slug_allocation(self):
+        def make(sku, **kwargs):
+            return Product(
+                name='USB-C Cable', sku=sku, description='cable', price='5.00',
+                category=self.category, seller=self.seller, **kwargs
+            )
+
+        make('USB-0').save()
+        make('USB-5', slug='usb-c-cable-5').save()
+        make('USB-X', slug='usb-c-cable-extra').save()
+        # one query for the slug, no matter how many are taken
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_slug('USB-C Cable'), 'usb-c-cable-6')
+
+        batch = assign_slugs([make(f'USB-B{i}') for i in range(3)] + [
+            Product(name='Other', sku='O-1', description='x', price='1.00', seller=self.seller)
+        ])
+        self.assertEqual(
+            [p.slug for p in batch],
+            ['usb-c-cable-6', 'usb-c-cable-7', 'usb-c-cable-8', 'other'],
+        )
+        Product.objects.bulk_create(batch)
+
+        # lost a race for the slug - retries with the next free one
+        racer = make('USB-R')
+        with patch('products.models.allocate_slug', side_effect=['usb-c-cable-7', 'usb-c-cable-9']):
+            racer.save()
+        self.assertEqual(racer.slug, 'usb-c-cable-9')
+
+        # a real duplicate (sku) still raises
+        with self.assertRaises(IntegrityError):
+            make('USB-R').save()
+
+
+    def test_generated_data(self):
+        out = io.StringIO()
+        args = ['--products', '300', '--users', '40', '--reviews', '400', '--orders', '80',
+                '--seed', '7', '--category-depth', '3', '--category-fanout', '3']
+        call_command('seed_data', *args, stdout=out)
+
+        generated = Product.objects.filter(sku__startswith='GEN7-')
+        self.assertEqual(generated.count(), 300)
+        self.assertEqual(Review.objects.filter(product__in=generated).count(), 400)
+        self.assertEqual(Category.objects.filter(slug__startswith='gen7-', depth=2).count(), 27)
+        # same seed, same data
+        self.assertEqual(generated.get(sku='GEN7-00000042').price, Decimal('15.13'))
+
+        # counters were rebuilt after the bulk inserts
+        product = generated.order_by('-rating_count').first()
+        self.assertEqual(product.rating_count, product.reviews.count())
+        root = Category.objects.get(slug='gen7-0')
+        self.assertEqual(
+            root.subtree_product_count,
+            generated.filter(is_active=True, category__path__startswith=root.path).count(),
+        )
+
+        # popularity is skewed: the hottest product sells far above average
+        per_product = list(
+            OrderItem.objects.values('product_id').annotate(n=Count('id'))
+            .order_by('-n').values_list('n', flat=True)
+        )
+        self.assertGreater(per_product[0], 5 * sum(per_product) / 300)
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', *args, stdout=out)
+
+
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class ReviewTests(QueryBudgetMixin, TestCase):
 
     def setUp(self):
+        # anon throttle counts live in the cache and add up over the suite
+        cache.clear()
         self.client = APIClient()
         self.seller = User.objects.create_user(
             email='seller2@test.com', username='seller2',
@@ -146,6 +777,33 @@ class ReviewTests(TestCase):
             category=cat, seller=self.seller,
         )
 
+    def test_product_delete_skips_per_review_work(self):
+        def product_with(count):
+            product = Product.objects.create(
+                name=f'Book {count}', description='x', price='9.99', sku=f'BK-{count}0',
+                category=self.product.category, seller=self.seller,
+            )
+            for i in range(count):
+                user = User.objects.create_user(
+                    email=f'd{count}-{i}@test.com', username=f'd{count}-{i}', password='Pass123!',
+                )
+                Review.objects.create(product=product, user=user, rating=3)
+                ProductImage.objects.create(product=product, image_url=f'https://x.test/{i}.jpg')
+            return product
+
+        small, large = product_with(1), product_with(6)
+        with CaptureQueriesContext(connection) as one:
+            small.delete()
+        with CaptureQueriesContext(connection) as six:
+            large.delete()
+        self.assertEqual(len(six), len(one))
+
+        # a review deleted on its own still comes off the counters
+        review = Review.objects.create(product=self.product, user=self.buyer, rating=5)
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_5), (0, 0))
+
     def test_add_review(self):
         self.client.force_authenticate(user=self.buyer)
         resp = self.client.post(
@@ -171,3 +829,376 @@ class ReviewTests(TestCase):
             format='json',
         )
         self.assertEqual(resp.status_code, 400)
+
+    def test_review_updates_rating_counters(self):
+        self.client.force_authenticate(user=self.buyer)
+        self.client.post(
+            f'/api/v1/products/{self.product.slug}/reviews/',
+            {'rating': 4, 'comment': 'Good'},
+            format='json',
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.rating_4, 1)
+        self.assertEqual(self.product.avg_rating, 4.0)
+
+        # editing moves the rating between star buckets
+        review = Review.objects.get(product=self.product, user=self.buyer)
+        review.rating = 2
+        review.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_sum, 2)
+        self.assertEqual(self.product.rating_4, 0)
+        self.assertEqual(self.product.rating_2, 1)
+
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 0)
+        self.assertIsNone(self.product.avg_rating)
+
+    def test_reviews_are_paged(self):
+        for i in range(25):
+            user = User.objects.create_user(
+                email=f'page{i}@test.com', username=f'page{i}', password='Pass123!',
+            )
+            Review.objects.create(product=self.product, user=user, rating=i % 5 + 1, comment=f'#{i}')
+        url = f'/api/v1/products/{self.product.slug}/reviews/'
+
+        # product id + one page with the users joined in, plus the etag row
+        with self.assertNumQueries(3):
+            resp = self.client.get(url)
+        first = resp.data['results']
+        self.assertEqual(len(first), 20)
+        self.assertEqual(first[0]['comment'], '#24')
+        self.assertEqual(first[0]['user_email'], 'page24@test.com')
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual([r['comment'] for r in resp.data['results']], [f'#{i}' for i in range(4, -1, -1)])
+        self.assertIsNone(resp.data['next'])
+
+        resp = self.client.get(url, {'rating': 5, 'ordering': 'created_at'})
+        self.assertEqual([r['comment'] for r in resp.data['results']], ['#4', '#9', '#14', '#19', '#24'])
+        resp = self.client.get(url, {'ordering': '-rating'})
+        self.assertEqual({r['rating'] for r in resp.data['results'][:5]}, {5})
+
+        self.assertEqual(self.client.get(url, {'rating': 6}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ordering': 'user'}).status_code, 400)
+        Product.objects.filter(pk=self.product.pk).update(is_active=False)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_detail_embeds_a_review_preview(self):
+        sub = Category.objects.create(name='Python', parent=self.product.category)
+        Category.objects.create(name='Django', parent=sub)
+        Product.objects.filter(pk=self.product.pk).update(category=sub)
+        for i in range(8):
+            user = User.objects.create_user(
+                email=f'prev{i}@test.com', username=f'prev{i}', password='Pass123!',
+            )
+            Review.objects.create(product=self.product, user=user, rating=5 if i % 2 else 3)
+
+        # product id for the detail cache, etag row, product + category +
+        # seller, images, windowed reviews
+        with self.assertNumQueries(5):
+            resp = self.client.get(f'/api/v1/products/{self.product.slug}/')
+        data = resp.data
+        self.assertNotIn('reviews', data)
+        self.assertEqual(
+            [r['user_email'] for r in data['recent_reviews']],
+            [f'prev{i}@test.com' for i in range(7, 2, -1)],
+        )
+        self.assertEqual(data['review_count'], 8)
+        self.assertEqual(data['rating_distribution'], {'1': 0, '2': 0, '3': 4, '4': 0, '5': 4})
+        self.assertEqual(data['category'], {
+            'id': sub.pk, 'name': 'Python', 'slug': 'python',
+            'parent': self.product.category_id, 'depth': 1,
+        })
+
+    def test_read_queries_dont_grow(self):
+        slug = self.product.slug
+        counter = iter(range(100))
+
+        def grow():
+            n = next(counter)
+            sub = Category.objects.create(name=f'Sub {n}', parent=self.product.category)
+            for i in range(5):
+                user = User.objects.create_user(
+                    email=f'r{n}-{i}@test.com', username=f'r{n}-{i}', password='Pass123!',
+                )
+                Review.objects.create(product=self.product, user=user, rating=i + 1)
+                ProductImage.objects.create(product=self.product, image_url=f'https://x.test/{n}/{i}.jpg')
+                Product.objects.create(
+                    name=f'Book {n}-{i}', description='book', price='9.99',
+                    sku=f'BK-{n}-{i}', stock_quantity=3, category=sub, seller=self.seller,
+                )
+
+        for url in ['/api/v1/products/', f'/api/v1/products/{slug}/',
+                    f'/api/v1/products/{slug}/reviews/', '/api/v1/categories/']:
+            with self.subTest(url=url):
+                self.assertQueriesConstant(lambda: self.client.get(url), grow)
+
+    def test_budget_reports_fingerprints(self):
+        queries = [f'SELECT * FROM reviews WHERE product_id = {i}' for i in range(6)]
+        queries.append("SELECT * FROM products WHERE id IN (%s, %s, %s) AND sku = 'X'")
+        with self.assertRaisesRegex(QueryBudgetExceeded, r'6x SELECT \* FROM reviews WHERE product_id = %s'):
+            check('ProductViewSet.reviews', queries, budget=5)
+        self.assertTrue(check('ProductViewSet.reviews', queries[:5], budget=5))
+
+        # outside the tests it only logs
+        with self.assertLogs('core.querybudget', 'WARNING') as logs:
+            self.assertFalse(check('ProductViewSet.reviews', queries, budget=5, strict=False))
+        self.assertIn('IN (...) AND sku = %s', logs.output[0])
+
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                list(Product.objects.all())
+                list(Category.objects.all())
+
+    def test_rebuild_ratings(self):
+        Review.objects.create(product=self.product, user=self.buyer, rating=5)
+        Product.objects.filter(pk=self.product.pk).update(rating_count=0, rating_sum=0, rating_5=0)
+
+        rebuild_ratings()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.rating_5, 1)
+        self.assertEqual(self.product.avg_rating, 5.0)
+
+
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class AsgiTests(QueryBudgetMixin, TestCase):
+    """The DRF views under core.asgi's handler."""
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(
+            email='seller3@test.com', username='seller3', password='Pass123!', is_seller=True,
+        )
+        staff = User.objects.create_user(
+            email='staff3@test.com', username='staff3', password='Pass123!', is_staff=True,
+        )
+        self.product = Product.objects.create(
+            name='Headphones', description='over ear', price='59.00', sku='HP-1',
+            stock_quantity=8, category=Category.objects.create(name='Audio'), seller=self.seller,
+        )
+        self.staff = {'Authorization': f'Bearer {RefreshToken.for_user(staff).access_token}'}
+        # the views run on this thread's connection, opened before the
+        # middleware could hook it (under uvicorn each thread opens its own)
+        install_sql_hook(connection)
+
+    async def test_export_streams_under_asgi(self):
+        resp = await self.async_client.get('/api/v1/products/export/', headers=self.staff)
+        self.assertEqual(resp.status_code, 200)
+        # an async iterator, a plain one would be read into memory first
+        self.assertTrue(resp.is_async)
+        body = b''.join([chunk async for chunk in resp.streaming_content])
+        self.assertEqual([json.loads(line)['sku'] for line in body.splitlines()], ['HP-1'])
+
+    async def test_served_by_the_asgi_handler(self):
+        url = f'/api/v1/products/{self.product.slug}/'
+        resp = await self.async_client.get(url, headers=self.staff)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content)['slug'], self.product.slug)
+        self.assertRegex(resp['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+        # the detail and the JWT user both come from the cache
+        resp = await self.async_client.get(url, headers=self.staff)
+        self.assertIn('desc="0 queries"', resp['Server-Timing'])
+        resp = await self.async_client.get(url, headers={'If-None-Match': resp['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class ImportTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.client = APIClient()
+        self.seller = User.objects.create_user(
+            email='importer@test.com', username='importer',
+            password='Pass123!', is_seller=True,
+        )
+        self.other = User.objects.create_user(
+            email='other@test.com', username='other',
+            password='Pass123!', is_seller=True,
+        )
+        self.category = Category.objects.create(name='Cables')
+        self.mine = Product.objects.create(
+            name='Old Name', sku='CBL-1', description='old', price='1.00',
+            stock_quantity=1, seller=self.seller, rating_count=3, rating_sum=12,
+        )
+        Product.objects.create(
+            name='Theirs', sku='THEIRS-1', description='x', price='1.00', seller=self.other,
+        )
+
+    def test_csv_upload(self):
+        body = (
+            "sku,name,description,price,stock_quantity,category,extra\n"
+            "CBL-1,USB-C Cable,braided,9.99,10,cables,ignored\n"
+            "CBL-2,USB-C Cable,short,4.50,,cables,\n"
+            "CBL-3,HDMI Cable,long,12.00,3,,\n"
+            "THEIRS-1,Stolen,x,1.00,1,,\n"
+            "CBL-4,Bad Price,x,cheap,1,,\n"
+            "CBL-5,Lost,x,1.00,1,nope,\n"
+            "CBL-2,Again,x,1.00,1,,\n"
+        )
+        upload = SimpleUploadedFile('catalog.csv', body.encode(), content_type='text/csv')
+
+        self.client.force_authenticate(user=self.seller)
+        with override_settings(MEDIA_ROOT=self.media), \
+                patch('products.views.import_products.delay') as delay:
+            resp = self.client.post('/api/v1/product-imports/', {'file': upload}, format='multipart')
+            self.assertEqual(resp.status_code, 202)
+            self.assertEqual(resp.data['file_format'], 'csv')
+            delay.assert_called_once_with(resp.data['id'])
+
+            # what the worker does
+            job = run_import(ProductImport.objects.get(pk=resp.data['id']))
+            self.assertEqual(job.status, 'done')
+
+            resp = self.client.get(f'/api/v1/product-imports/{job.pk}/')
+            self.assertEqual(resp.data['progress'], 100)
+            self.assertEqual(resp.data['rows_processed'], 7)
+            self.assertEqual(resp.data['created_count'], 2)
+            self.assertEqual(resp.data['updated_count'], 1)
+            self.assertEqual(resp.data['error_count'], 4)
+            self.assertEqual(
+                sorted((e['line'], e['sku'], list(e['errors'])) for e in resp.data['errors']),
+                [(5, 'THEIRS-1', ['sku']), (6, 'CBL-4', ['price']),
+                 (7, 'CBL-5', ['category']), (8, 'CBL-2', ['sku'])],
+            )
+
+            resp = self.client.get(f'/api/v1/product-imports/{job.pk}/errors/')
+            self.assertEqual(resp.status_code, 200)
+            report = b''.join(resp.streaming_content).decode()
+            self.assertIn('6,CBL-4,price,', report)
+
+        # updated in place, slug and review counters kept
+        self.mine.refresh_from_db()
+        self.assertEqual((self.mine.name, str(self.mine.price), self.mine.stock_quantity),
+                         ('USB-C Cable', '9.99', 10))
+        self.assertEqual(self.mine.slug, 'old-name')
+        self.assertEqual(self.mine.rating_count, 3)
+        self.assertEqual(Product.objects.get(sku='CBL-2').slug, 'usb-c-cable')
+        self.assertEqual(Product.objects.get(sku='THEIRS-1').name, 'Theirs')
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.product_count, 2)
+
+        # only the owner sees their imports
+        self.client.force_authenticate(user=self.other)
+        resp = self.client.get(f'/api/v1/product-imports/{job.pk}/')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_ndjson_batches(self):
+        lines = [
+            f'{{"sku": "ND-{i}", "name": "Item {i}", "description": "d", "price": 2.5}}'
+            for i in range(5)
+        ]
+        lines.insert(2, '{not json')
+        progress = []
+        importer = ProductImporter(
+            self.seller, batch_size=2, on_progress=lambda s: progress.append(s['rows'])
+        )
+        stats = importer.run(read_rows(io.BytesIO('\n'.join(lines).encode()), 'ndjson'))
+
+        self.assertEqual(stats, {'rows': 6, 'created': 5, 'updated': 0, 'errors': 1})
+        self.assertEqual(progress, [2, 4, 6])
+        self.assertEqual(importer.error_sample[0]['line'], 3)
+        self.assertEqual(Product.objects.filter(sku__startswith='ND-').count(), 5)
+
+    def _paths(self):
+        # use_copy values this database can run
+        return [False, True] if connection.vendor == 'postgresql' else [False]
+
+    def test_sku_taken_during_the_import(self):
+        write = ProductImporter._write
+
+        for use_copy in self._paths():
+            sku = f'CBL-9-{use_copy}'
+
+            def other_seller_first(importer, *args):
+                # lands between the sku lookup and the upsert
+                Product.objects.create(name='Quick', sku=sku, price='1.00', seller=self.other)
+                return write(importer, *args)
+
+            rows = [
+                (1, {'sku': f'CBL-8-{use_copy}', 'name': 'Mine', 'description': 'd', 'price': '2.00'}),
+                (2, {'sku': sku, 'name': 'Also mine', 'description': 'd', 'price': '2.00'}),
+            ]
+            with self.subTest(use_copy=use_copy), \
+                    patch.object(ProductImporter, '_write', other_seller_first):
+                importer = ProductImporter(self.seller, use_copy=use_copy)
+                stats = importer.run(rows)
+
+                self.assertEqual(stats, {'rows': 2, 'created': 1, 'updated': 0, 'errors': 1})
+                self.assertEqual(importer.error_sample[0]['line'], 2)
+                self.assertEqual(importer.error_sample[0]['errors'], {'sku': [OTHER_SELLER]})
+                taken = Product.objects.get(sku=sku)
+                self.assertEqual((taken.name, taken.seller_id), ('Quick', self.other.pk))
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY is postgres only')
+    def test_copy_matches_values(self):
+        # slugs differ, the names are the same on both sides
+        columns = ['name', 'description', 'price', 'compare_at_price', 'stock_quantity',
+                   'category_id', 'image_url', 'is_active', 'seller_id', 'rating_count']
+
+        def rows(prefix):
+            return [
+                (1, {'sku': f'{prefix}-1', 'name': 'Tab\tand\nnewline \\ cable', 'description': 'd',
+                     'price': '2.50', 'compare_at_price': '3.00', 'category': 'cables',
+                     'image_url': 'https://x.test/a.jpg', 'stock_quantity': 4}),
+                (2, {'sku': f'{prefix}-2', 'name': 'Plain', 'description': 'd', 'price': '1.00',
+                     'is_active': False}),
+            ]
+
+        for use_copy, prefix in [(False, 'VAL'), (True, 'CPY')]:
+            importer = ProductImporter(self.seller, use_copy=use_copy)
+            self.assertEqual(importer.run(rows(prefix))['created'], 2)
+            # and again, as updates
+            again = ProductImporter(self.seller, use_copy=use_copy)
+            self.assertEqual(again.run(rows(prefix))['updated'], 2)
+
+        def values(prefix):
+            return list(Product.objects.filter(sku__startswith=prefix).order_by('sku').values(*columns))
+        self.assertEqual(values('CPY'), values('VAL'))
+        self.assertEqual(values('CPY')[0]['name'], 'Tab\tand\nnewline \\ cable')
+
+    def test_imports_update_search_and_category_counts(self):
+        backend = get_search_backend()
+        backend.rebuild()
+        parent = Category.objects.create(name='Electronics')
+        self.category.parent = parent
+        self.category.save()
+        rebuild_category_tree()
+
+        rows = [
+            (1, {'sku': 'CBL-1', 'name': 'Braided Cable', 'description': 'd', 'price': '2.00', 'category': 'cables'}),
+            (2, {'sku': 'CBL-2', 'name': 'Zigzag Cable', 'description': 'd', 'price': '2.00', 'category': 'cables'}),
+        ]
+        theirs = Product.objects.get(sku='THEIRS-1')
+        untouched = get_detail_versions(theirs.pk)
+        mine = get_detail_versions(self.mine.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImporter(self.seller, batch_size=1).run(rows)
+        new = Product.objects.get(sku='CBL-2')
+        resp = self.client.get('/api/v1/products/?search=zigzag')
+        self.assertEqual([p['slug'] for p in resp.data['results']], [new.slug])
+        resp = self.client.get('/api/v1/products/?search=braided')
+        self.assertEqual([p['slug'] for p in resp.data['results']], [self.mine.slug])
+        # only the imported products' details are dropped
+        self.assertEqual(get_detail_versions(theirs.pk), untouched)
+        self.assertNotEqual(get_detail_versions(self.mine.pk), mine)
+        self.category.refresh_from_db()
+        parent.refresh_from_db()
+        self.assertEqual((self.category.product_count, parent.subtree_product_count), (2, 2))
+
+        # moved out again, and hidden
+        rows = [(1, {'sku': 'CBL-2', 'name': 'Zigzag Cable', 'description': 'd', 'price': '2.00', 'is_active': False})]
+        ProductImporter(self.seller).run(rows)
+        self.category.refresh_from_db()
+        parent.refresh_from_db()
+        self.assertEqual((self.category.product_count, parent.subtree_product_count), (1, 1))
+
+        resp = self.client.get('/api/v1/products/?search=zigzag')
+        self.assertEqual(resp.data['results'], [])
+        resp = self.client.get('/api/v1/products/?search=braided')
+        self.assertEqual([p['slug'] for p in resp.data['results']], [self.mine.slug])
@@ -0,0 +1,118 @@
+"""
+Category tree helpers.
+
+Each category stores a materialized path of its ancestors' ids ("1/4/9/")
+so the whole tree (or any subtree, with path__startswith) loads in one
+query, plus cached active product counts - its own and rolled up over the
+subtree - so listing categories never has to COUNT products.
+"""
+import logging
+from collections import defaultdict
+
+from django.db.models import Count, F
+
+logger = logging.getLogger(__name__)
+
+TREE_FIELDS = ['path', 'depth', 'product_count', 'subtree_product_count']
+
+
+def ancestor_ids(path):
+    """'1/4/9/' -> [1, 4, 9] (includes the category itself)."""
+    return [int(pk) for pk in path.split('/') if pk]
+
+
+def adjust_category_counts(category_id, delta):
+    """Add delta active products to a category and all of its ancestors."""
+    from .models import Category
+
+    path = Category.objects.filter(pk=category_id).values_list('path', flat=True).first()
+    if path is None:
+        return
+    Category.objects.filter(pk=category_id).update(
+        product_count=F('product_count') + delta
+    )
+    Category.objects.filter(pk__in=ancestor_ids(path) or [category_id]).update(
+        subtree_product_count=F('subtree_product_count') + delta
+    )
+
+
+def adjust_product_counts(deltas):
+    """
+    Add {category_id: delta} to product_count and roll the subtree totals
+    up again, for bulk writes that skip Product.save.
+    """
+    from .models import Category
+
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    for category_id, delta in deltas.items():
+        Category.objects.filter(pk=category_id).update(
+            product_count=F('product_count') + delta
+        )
+    if deltas:
+        rollup_subtree_counts()
+
+
+def build_children_map(categories):
+    """Group categories by parent_id, keeping the order they came in."""
+    children = defaultdict(list)
+    for category in categories:
+        children[category.parent_id].append(category)
+    return children
+
+
+def rollup_subtree_counts():
+    """Recompute subtree_product_count from product_count, categories table only."""
+    from .models import Category
+
+    categories = list(Category.objects.only('id', 'path', 'product_count', 'subtree_product_count'))
+    totals = defaultdict(int)
+    for category in categories:
+        for pk in ancestor_ids(category.path) or [category.pk]:
+            totals[pk] += category.product_count
+
+    changed = []
+    for category in categories:
+        if category.subtree_product_count != totals[category.pk]:
+            category.subtree_product_count = totals[category.pk]
+            changed.append(category)
+    Category.objects.bulk_update(changed, ['subtree_product_count'])
+    return len(changed)
+
+
+def rebuild_category_tree():
+    """
+    Rebuild paths, depths and product counts from scratch. Use after bulk
+    writes that skip Product.save (queryset.update, bulk_create) or if the
+    counters ever drift.
+    """
+    from .models import Category, Product
+
+    categories = list(Category.objects.all())
+    children = build_children_map(categories)
+
+    counts = dict(
+        Product.objects.filter(is_active=True, category__isnull=False)
+        .order_by()
+        .values('category_id')
+        .annotate(n=Count('id'))
+        .values_list('category_id', 'n')
+    )
+
+    # walk down from the roots so each parent's path is known first
+    stack = [(c, '') for c in children[None]]
+    while stack:
+        category, parent_path = stack.pop()
+        category.path = f'{parent_path}{category.pk}/'
+        category.depth = len(ancestor_ids(category.path)) - 1
+        category.product_count = counts.get(category.pk, 0)
+        stack.extend((child, category.path) for child in children[category.pk])
+
+    Category.objects.bulk_update(categories, ['path', 'depth', 'product_count'])
+    rollup_subtree_counts()
+    logger.info(f"Rebuilt category tree for {len(categories)} categories")
+    return len(categories)
+
+
+def active_in(category_id, is_active):
+    """The category a product counts towards, or None if it doesnt count."""
+    return category_id if (category_id and is_active) else None
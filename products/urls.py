@@ -5,10 +5,14 @@ from . import views
 router = DefaultRouter()
 router.register(r'categories', views.CategoryViewSet, basename='category')
 router.register(r'products', views.ProductViewSet, basename='product')
+router.register(r'product-imports', views.ProductImportViewSet, basename='product-import')
 
 urlpatterns = [
     # review create has to come before router, otherwise the @action on
     # ProductViewSet catches the POST and returns 403 (seller-only permission)
+    # same for export, it would be taken for a product slug (and no product
+    # gets that slug, see RESERVED_SLUGS)
+    path('products/export/', views.ProductExportView.as_view(), name='product-export'),
     path('products/<slug:product_slug>/reviews/', views.ReviewCreateView.as_view(), name='product-review-create'),
     path('', include(router.urls)),
 ]
@@ -1,20 +1,41 @@
-from rest_framework import viewsets, generics, permissions, status
+from rest_framework import mixins, viewsets, generics, permissions, status
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.views import APIView
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Category, Product, Review
+from core.compiled import compile_serializer
+from core.metrics import span
+from core.pagination import HybridPagination, KeysetPagination
+from core.throttling import BatchThrottleMixin, ScopedThrottle
+from .models import Category, Product, ProductImport, Review
 from .serializers import (
     CategorySerializer,
     ProductListSerializer,
     ProductDetailSerializer,
+    ProductImportSerializer,
+    REVIEW_COLUMNS,
     ReviewSerializer,
+    recent_reviews_prefetch,
 )
-from .filters import ProductFilter
-from .tasks import notify_low_stock
+from .cache import CATEGORIES, PRODUCTS, cache_catalog_response, get_versions
+from .conditional import (
+    conditional_response,
+    list_validators,
+    product_reviews_validators,
+    product_validators,
+)
+from .detail_cache import cache_product_detail
+from .exporters import CONTENT_TYPES, accepts_gzip, aiter_chunks, export_stream, parse_since
+from .inventory import set_bucketed_stock
+from .filters import ProductFilter, ProductOrderingFilter, ProductSearchFilter
+from .tasks import import_products, notify_low_stock
 
 
 class IsSellerOrReadOnly(permissions.BasePermission):
@@ -32,31 +53,53 @@ class IsSellerOrReadOnly(permissions.BasePermission):
         return obj.seller == request.user
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class IsSeller(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.is_seller
+
+
+class CategoryViewSet(BatchThrottleMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     lookup_field = 'slug'
+    # GETs can read from a replica, see core/db_router.py
+    replica_reads = True
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [permissions.IsAdminUser()]
         return [permissions.AllowAny()]
 
-    @method_decorator(cache_page(60 * 15))  # categories dont change much
+    @conditional_response(list_validators(CATEGORIES))
+    @cache_catalog_response(CATEGORIES)
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        with span('serialize'):
+            data = self.get_serializer(queryset if page is None else page, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.select_related(
-        'category', 'seller'
-    ).prefetch_related('reviews', 'images')
+class ReviewPagination(KeysetPagination):
+    # the (product, created_at, id) / (product, rating, id) indexes
+    page_size = 20
+    ordering_fields = ['created_at', 'rating']
+
+
+class ProductViewSet(BatchThrottleMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.select_related('category', 'seller')
     permission_classes = [IsSellerOrReadOnly]
+    pagination_class = HybridPagination
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, ProductOrderingFilter]
     filterset_class = ProductFilter
-    search_fields = ['name', 'description', 'sku']
+    # ranked and weighted sku > name > description, see search.py
+    search_fields = ['sku', 'name', 'description']
     ordering_fields = ['price', 'created_at', 'name', 'stock_quantity']
     ordering = ['-created_at']
     lookup_field = 'slug'
+    replica_reads = True
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -65,10 +108,34 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         qs = super().get_queryset()
-        # regular users should only see active products
-        if not (self.request.user.is_authenticated and self.request.user.is_seller):
-            qs = qs.filter(is_active=True)
-        return qs
+        serializer_class = self.get_serializer_class()
+        fields = serializer_class.selected_fields(self.request)
+        if fields is not None:
+            # reads only load the columns / joins / prefetches the requested
+            # fields need (?fields=, ?expand=, see core/fieldsets.py). the
+            # ordering columns stay in for the cursor pagination
+            qs = serializer_class.prune_queryset(qs, fields, keep=self.ordering_fields)
+        else:
+            qs = qs.with_available_stock()
+            if self.action != 'list':
+                qs = qs.prefetch_related(recent_reviews_prefetch(), 'images')
+        return self.filter_visible(qs)
+
+    def filter_visible(self, qs):
+        return qs.visible_to(self.request.user)
+
+    def get_count_version(self):
+        # cached page counts get thrown away whenever the catalog changes
+        return get_versions(PRODUCTS)[PRODUCTS]
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        limit = getattr(self.request, 'search_limit', None)
+        if limit is not None:
+            # a broad ?search= only ranks the best `limit` matches, count
+            # and the pages stop there too
+            response.data['search_limit'] = limit
+        return response
 
     def perform_create(self, serializer):
         product = serializer.save(seller=self.request.user)
@@ -81,28 +148,136 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         product = serializer.save()
+        if product.bucket_count and 'stock_quantity' in serializer.validated_data:
+            set_bucketed_stock(product, product.stock_quantity)
         if product.stock_quantity < 5:
             try:
                 notify_low_stock.delay(product.id)
             except Exception:
                 pass
 
-    @method_decorator(cache_page(60 * 5))
+    @conditional_response(list_validators(PRODUCTS, CATEGORIES))
+    @cache_catalog_response(PRODUCTS, CATEGORIES)
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        if not settings.COMPILED_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = compile_serializer(self.get_serializer())
+        if serializer.value_columns is not None:
+            # every requested field is a plain column - skip building model
+            # instances. pk and the ordering columns are for the cursor links
+            columns = ['pk', *serializer.value_columns]
+            columns += [f for f in self.ordering_fields if f not in columns]
+            queryset = queryset.values(*columns)
+
+        page = self.paginate_queryset(queryset)
+        with span('serialize'):
+            data = serializer.serialize(queryset if page is None else page)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    @cache_product_detail
+    @conditional_response(product_validators)
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.COMPILED_SERIALIZERS:
+            return super().retrieve(request, *args, **kwargs)
+        instance = self.get_object()
+        with span('serialize'):
+            data = compile_serializer(self.get_serializer()).to_representation(instance)
+        return Response(data)
 
     @action(detail=True, methods=['get'])
+    @conditional_response(product_reviews_validators)
     def reviews(self, request, slug=None):
-        product = self.get_object()
-        reviews = product.reviews.all()
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        """
+        Cursor pages of a product's reviews.
+        ?ordering=-created_at (default), created_at, -rating, rating
+        ?rating=1..5 only reviews with that many stars
+        """
+        product_id = self.filter_visible(
+            Product.objects.filter(slug=slug)
+        ).values_list('pk', flat=True).first()
+        if product_id is None:
+            raise NotFound()
+
+        ordering = request.query_params.get('ordering', ReviewPagination.default_ordering)
+        if ordering.lstrip('-') not in ReviewPagination.ordering_fields:
+            raise ValidationError({'ordering': "Must be one of created_at, rating (- for descending)."})
+        queryset = Review.objects.filter(product_id=product_id).select_related('user').only(
+            *REVIEW_COLUMNS
+        ).order_by(ordering)
+
+        rating = request.query_params.get('rating')
+        if rating is not None:
+            if rating not in ('1', '2', '3', '4', '5'):
+                raise ValidationError({'rating': "Must be 1 to 5."})
+            queryset = queryset.filter(rating=rating)
+
+        paginator = ReviewPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        with span('serialize'):
+            data = ReviewSerializer(page, many=True).data
+        return paginator.get_paginated_response(data)
+
 
+class ProductExportView(BatchThrottleMixin, APIView):
+    """
+    Stream every active product as NDJSON (default) or CSV, for indexers
+    and partner feeds. One request instead of walking the paginated list.
 
-class ReviewCreateView(generics.CreateAPIView):
+    ?output=ndjson|csv  ?updated_since=<iso date/datetime>  ?seller=<id>
+    gzipped on the fly if the client sends Accept-Encoding: gzip
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [ScopedThrottle]
+    throttle_scope = 'export'
+
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in CONTENT_TYPES:
+            raise ValidationError({'output': "Must be ndjson or csv."})
+
+        updated_since = None
+        if request.query_params.get('updated_since'):
+            updated_since = parse_since(request.query_params['updated_since'])
+            if updated_since is None:
+                raise ValidationError({'updated_since': "Not a valid date or datetime."})
+
+        seller_id = request.query_params.get('seller')
+        if seller_id is not None and not seller_id.isdigit():
+            raise ValidationError({'seller': "Must be a seller id."})
+
+        compress = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        chunks = export_stream(output, updated_since=updated_since,
+                               seller_id=seller_id, compress=compress)
+        if isinstance(request._request, ASGIRequest):
+            # a plain iterator would be read into a list before sending
+            chunks = aiter_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="products.{output}"'
+        response['Vary'] = 'Accept-Encoding'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+
+_list_reviews = ProductViewSet.as_view({'get': 'reviews'})
+
+
+class ReviewCreateView(BatchThrottleMixin, generics.CreateAPIView):
     """Post a review for a product."""
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticated]
+    replica_reads = True  # the GETs, handed to ProductViewSet
+
+    def dispatch(self, request, *args, **kwargs):
+        # this url shadows the reviews @action on ProductViewSet, so reads
+        # are handed over to it
+        if request.method in ('GET', 'HEAD'):
+            return _list_reviews(request, slug=kwargs['product_slug'])
+        return super().dispatch(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         product_slug = self.kwargs.get('product_slug')
@@ -115,3 +290,46 @@ class ReviewCreateView(generics.CreateAPIView):
             )
 
         serializer.save(product=product, user=self.request.user)
+
+
+class ProductImportViewSet(BatchThrottleMixin,
+                           mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.ListModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Upload a CSV / NDJSON file of products, it gets imported in the
+    background. Poll the import for progress, fetch errors/ for the full
+    per-row error report.
+    """
+    serializer_class = ProductImportSerializer
+    permission_classes = [IsSeller]
+    parser_classes = [MultiPartParser]
+
+    def get_queryset(self):
+        return ProductImport.objects.filter(seller=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save(
+            seller=request.user, file_size=serializer.validated_data['file'].size
+        )
+        try:
+            import_products.delay(job.id)
+        except Exception:
+            job.status = 'failed'
+            job.message = "Could not queue the import, try again later."
+            job.save(update_fields=['status', 'message'])
+            return Response(self.get_serializer(job).data, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def errors(self, request, pk=None):
+        job = self.get_object()
+        if not job.error_report:
+            raise NotFound("This import has no error report.")
+        return FileResponse(
+            job.error_report.open('rb'), as_attachment=True,
+            filename=f'import-{job.pk}-errors.csv', content_type='text/csv',
+        )